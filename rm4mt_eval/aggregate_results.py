@@ -0,0 +1,185 @@
+import os
+import argparse
+from glob import glob
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from jsonl_io import iter_jsonl, load_jsonl, save_jsonl
+from results_store import PARTITION_KEYS, partition_from_path, to_float
+
+FIELDS = (
+    "comet_score",
+    "comet_kiwi_score",
+    "grb",
+    "grf",
+    "gea_100",
+    "gea_5",
+    "thinking_length",
+)
+
+
+def summarize_file(path):
+    """
+    Per-field sum and count of the numeric values in one output file
+    """
+    columns = {field: [] for field in FIELDS}
+    for item in iter_jsonl(path):
+        for field in FIELDS:
+            value = to_float(item.get(field))
+            columns[field].append(np.nan if value is None else value)
+
+    summary = {}
+    for field, values in columns.items():
+        values = np.asarray(values, dtype=np.float64)
+        valid = ~np.isnan(values)
+        summary[f"{field}_sum"] = float(values[valid].sum())
+        summary[f"{field}_count"] = int(valid.sum())
+    return summary
+
+
+def find_files(root):
+    patterns = [
+        os.path.join(root, "*", "*", "budget_*", "*.jsonl"),
+        os.path.join(root, "*", "*", "reasoning_effort_*", "*.jsonl"),
+    ]
+    files = []
+    for pattern in patterns:
+        files.extend(glob(pattern))
+    return sorted(files)
+
+
+def scan(roots, cache_path, max_workers):
+    """
+    One summary row per output file under ``roots``.
+
+    Rows are cached with the file's mtime and size, so only new or changed
+    files are read again; those are summarized in parallel processes.
+    """
+    cached = {}
+    if cache_path and os.path.exists(cache_path):
+        cached = {row["path"]: row for row in load_jsonl(cache_path)}
+
+    rows, stale = [], []
+    for root in roots:
+        for path in find_files(root):
+            stat = os.stat(path)
+            row = cached.get(path)
+            if row and row["mtime_ns"] == stat.st_mtime_ns and row["size"] == stat.st_size:
+                rows.append(row)
+            else:
+                row = {
+                    "path": path,
+                    "mtime_ns": stat.st_mtime_ns,
+                    "size": stat.st_size,
+                    **partition_from_path(os.path.relpath(path, root)),
+                }
+                stale.append(row)
+
+    print(f"{len(rows)} files cached, {len(stale)} to read")
+    if stale:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            summaries = executor.map(
+                summarize_file, [row["path"] for row in stale], chunksize=8
+            )
+            for row, summary in tqdm(
+                zip(stale, summaries), total=len(stale), desc="Summarizing"
+            ):
+                row.update(summary)
+                rows.append(row)
+        if cache_path:
+            save_jsonl(rows, cache_path)
+
+    return pd.DataFrame(rows)
+
+
+def aggregate(files, group_by, macro=False):
+    """
+    Mean of every field per group.
+
+    Output trees of different scorers hold the same files, so each file's
+    fields are first merged across roots. By default a group's mean is
+    pooled over all its segments; with ``macro`` every file's mean counts
+    once, like averaging per-file scores.
+    """
+    sums = [f"{field}_sum" for field in FIELDS]
+    counts = [f"{field}_count" for field in FIELDS]
+
+    # Take each field from the first root that has values for it
+    files = files.copy()
+    for total, count in zip(sums, counts):
+        empty = files[count] == 0
+        files.loc[empty, [total, count]] = np.nan
+    files = files.groupby(list(PARTITION_KEYS), as_index=False)[sums + counts].first()
+
+    if macro:
+        means = pd.DataFrame(
+            files[sums].to_numpy() / files[counts].to_numpy(), columns=list(FIELDS)
+        )
+        means[list(group_by)] = files[list(group_by)]
+        result = means.groupby(list(group_by))[list(FIELDS)].mean()
+        result["files"] = files.groupby(list(group_by)).size()
+    else:
+        totals = files.groupby(list(group_by))[sums + counts].sum(min_count=1)
+        result = pd.DataFrame(
+            totals[sums].to_numpy() / totals[counts].to_numpy(),
+            columns=list(FIELDS),
+            index=totals.index,
+        )
+        result["segments"] = totals[counts].max(axis=1)
+
+    result = result.reset_index()
+    # budget_100 sorts after budget_1000 as a string, sort on the number instead
+    budgets = result["budget"] if "budget" in result else None
+    if budgets is not None:
+        result["budget_value"] = pd.to_numeric(
+            budgets.str.replace("budget_", "", regex=False), errors="coerce"
+        )
+        result = result.sort_values([*[k for k in group_by if k != "budget"], "budget_value"])
+        result = result.drop(columns="budget_value")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Average scores and thinking lengths by dataset, model, budget and language pair"
+    )
+    parser.add_argument(
+        "--roots",
+        nargs="+",
+        required=True,
+        help="Scored output roots holding <dataset>/<model>/budget_*/<pair>.jsonl",
+    )
+    parser.add_argument(
+        "--group_by",
+        nargs="+",
+        default=list(PARTITION_KEYS),
+        choices=PARTITION_KEYS,
+        help="Keys to group by (default: dataset model budget pair)",
+    )
+    parser.add_argument(
+        "--macro",
+        action="store_true",
+        help="Average per-file means instead of pooling all segments",
+    )
+    parser.add_argument(
+        "--cache_path",
+        default="../cache/aggregate_cache.jsonl",
+        help="Per-file summaries reused while a file's mtime and size are unchanged",
+    )
+    parser.add_argument("--max_workers", type=int, default=os.cpu_count())
+    parser.add_argument("--output", default=None, help="Write the table to this CSV file")
+    args = parser.parse_args()
+
+    files = scan(args.roots, args.cache_path, args.max_workers)
+    if files.empty:
+        print("No output files found")
+    else:
+        result = aggregate(files, args.group_by, args.macro)
+        if args.output:
+            os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+            result.to_csv(args.output, index=False)
+            print(f"✔ Wrote {len(result)} rows → {args.output}")
+        else:
+            print(result.to_string(index=False))
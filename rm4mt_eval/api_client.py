@@ -0,0 +1,186 @@
+import time
+import asyncio
+import openai
+
+from rate_limit import TokenBucket, backoff_delay
+
+# Worth another attempt: 429, 5xx, timeouts and dropped connections
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APIConnectionError,
+)
+
+_endpoint_buckets = {}
+
+
+def usage_lengths(usage):
+    """
+    Token counts of a completion's usage (an object or a dict), named like
+    the local models' fields; empty if the endpoint reported no usage
+    """
+    if usage is None:
+        return {}
+    if not isinstance(usage, dict):
+        usage = usage.model_dump()
+    details = usage.get("completion_tokens_details") or {}
+    return {
+        "thinking_length": details.get("reasoning_tokens") or 0,
+        "prompt_length": usage.get("prompt_tokens"),
+        "completion_tokens": usage.get("completion_tokens"),
+    }
+
+
+class StreamRecorder:
+    """
+    Collects a streamed chat completion and times it from when the request
+    was sent: first token (reasoning or answer), first answer token and the
+    whole response, in seconds
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.content = []
+        self.reasoning = []
+        self.reasoning_chunks = 0
+        self.first_token = None
+        self.first_answer_token = None
+        self.usage = None
+
+    def add(self, chunk):
+        elapsed = time.perf_counter() - self.start
+        # With include_usage the last chunk has the usage and no choices
+        if chunk.usage is not None:
+            self.usage = chunk.usage
+        if not chunk.choices:
+            return
+        delta = chunk.choices[0].delta
+        reasoning = getattr(delta, "reasoning_content", None)
+        if reasoning:
+            self.reasoning.append(reasoning)
+            self.reasoning_chunks += 1
+        if self.first_token is None and (reasoning or delta.content):
+            self.first_token = elapsed
+        if delta.content:
+            self.content.append(delta.content)
+            if self.first_answer_token is None:
+                self.first_answer_token = elapsed
+
+    def finish(self):
+        """
+        ``(answer, reasoning, stats)`` where stats holds the token counts and timings
+        """
+        latency = time.perf_counter() - self.start
+        stats = usage_lengths(self.usage)
+        if not stats:
+            # Endpoints stream about one token per chunk
+            stats["thinking_length"] = self.reasoning_chunks
+        stats.update(
+            time_to_first_token=self.first_token,
+            time_to_first_answer_token=self.first_answer_token,
+            latency=latency,
+        )
+        return "".join(self.content), "".join(self.reasoning) or None, stats
+
+
+def endpoint_buckets(base_url, rpm=None, tpm=None):
+    """
+    The request and token buckets of one endpoint, shared by every client of
+    that endpoint in the process; the first client to ask sets the limits
+    """
+    if base_url not in _endpoint_buckets:
+        _endpoint_buckets[base_url] = (
+            TokenBucket(rpm) if rpm else None,
+            TokenBucket(tpm) if tpm else None,
+        )
+    return _endpoint_buckets[base_url]
+
+
+class AsyncChatClient:
+    """
+    Rate-limited wrapper around ``AsyncOpenAI.chat.completions.create``.
+
+    Requests wait for the endpoint's requests-per-minute and tokens-per-minute
+    buckets (either may be None for no limit). Transient failures are
+    retried with jittered exponential backoff, the last one is raised. The
+    OpenAI client's own retries should be off (``max_retries=0``) so this
+    policy is the only one.
+    """
+
+    def __init__(
+        self,
+        client,
+        rpm=None,
+        tpm=None,
+        max_retries=6,
+        base_delay=1.0,
+        max_delay=60.0,
+    ):
+        self.client = client
+        self.request_bucket, self.token_bucket = endpoint_buckets(
+            str(client.base_url), rpm, tpm
+        )
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+
+    @staticmethod
+    def estimate_tokens(messages):
+        # Roughly four characters per token, plus a few output tokens
+        return sum(len(message["content"]) for message in messages) // 4 + 8
+
+    async def create(self, messages, **kwargs):
+        async def call():
+            completion = await self.client.chat.completions.create(
+                messages=messages, **kwargs
+            )
+            return completion, getattr(completion.usage, "total_tokens", None)
+
+        return await self._with_retries(messages, call)
+
+    async def create_stream(self, messages, **kwargs):
+        """
+        Stream a completion and return StreamRecorder.finish() of it; a
+        stream that breaks off is retried from the start
+        """
+
+        async def call():
+            recorder = StreamRecorder()
+            stream = await self.client.chat.completions.create(
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True},
+                **kwargs,
+            )
+            async for chunk in stream:
+                recorder.add(chunk)
+            return recorder.finish(), getattr(recorder.usage, "total_tokens", None)
+
+        return await self._with_retries(messages, call)
+
+    async def _with_retries(self, messages, call):
+        """
+        Await ``call()``, which returns ``(result, total tokens or None)``,
+        under the rate limits and retry policy
+        """
+        estimate = self.estimate_tokens(messages)
+
+        for attempt in range(self.max_retries + 1):
+            if self.request_bucket is not None:
+                await self.request_bucket.acquire(1)
+            if self.token_bucket is not None:
+                await self.token_bucket.acquire(estimate)
+
+            try:
+                result, total_tokens = await call()
+            except RETRYABLE_ERRORS:
+                if attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                await asyncio.sleep(backoff_delay(attempt, self.base_delay, self.max_delay))
+                continue
+
+            if self.token_bucket is not None and total_tokens:
+                self.token_bucket.adjust(total_tokens - estimate)
+            return result
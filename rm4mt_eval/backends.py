@@ -0,0 +1,617 @@
+from collections import OrderedDict, deque
+import torch
+from transformers import DynamicCache
+
+from budget_tree import build_penalties, build_warpers
+from engine import (
+    AnswerCompleteCriteria,
+    Generation,
+    ThinkingTokenBudgetProcessor,
+    TokenAccounting,
+    chat_prompts,
+    generate_batch,
+)
+
+# KV tokens set aside for a prompt when --max_kv_tokens is sized from
+# --max_new_tokens; translation and post-editing prompts stay well below it
+PROMPT_KV_TOKENS = 1024
+
+
+class InferenceBackend:
+    """
+    Turns a batch of chat conversations into one Generation per
+    conversation, in order. translate_dir only talks to this interface.
+    """
+
+    def __init__(self, tokenizer, model):
+        self.tokenizer = tokenizer
+        self.model = model
+
+    def generate(
+        self,
+        family,
+        batch_messages,
+        thinking_budget,
+        max_new_tokens,
+        enable_wait_insertion,
+        temperature=None,
+        top_p=None,
+        do_sample=None,
+        early_stop_stats=None,
+    ):
+        raise NotImplementedError
+
+
+class HFBackend(InferenceBackend):
+    """
+    model.generate on left-padded batches; the whole batch decodes until its
+    longest row is done
+    """
+
+    def generate(
+        self,
+        family,
+        batch_messages,
+        thinking_budget,
+        max_new_tokens,
+        enable_wait_insertion,
+        temperature=None,
+        top_p=None,
+        do_sample=None,
+        early_stop_stats=None,
+    ):
+        return generate_batch(
+            self.model,
+            self.tokenizer,
+            family,
+            batch_messages,
+            thinking_budget,
+            max_new_tokens,
+            enable_wait_insertion,
+            temperature=temperature,
+            top_p=top_p,
+            do_sample=do_sample,
+            early_stop_stats=early_stop_stats,
+        )
+
+
+class Sequence:
+    """
+    One request of the paged engine: its token ids and the blocks its KV
+    is charged to
+    """
+
+    def __init__(self, index, prompt_ids):
+        self.index = index
+        self.prompt_ids = prompt_ids
+        self.new_ids = []
+        self.blocks = []
+        # Tokens whose KV is in the cache; the newest token never is
+        self.num_cached = 0
+
+    @property
+    def token_ids(self):
+        return self.prompt_ids + self.new_ids
+
+    @property
+    def last_token(self):
+        return self.new_ids[-1] if self.new_ids else self.prompt_ids[-1]
+
+
+def layer_cache(past_key_values, layer):
+    """
+    Keys and values of one layer of a DynamicCache
+    """
+    # transformers 5 no longer indexes caches, older releases have no .layers
+    if hasattr(past_key_values, "layers"):
+        cached = past_key_values.layers[layer]
+        return cached.keys, cached.values
+    return past_key_values[layer]
+
+
+def dense_cache(layers):
+    """
+    A DynamicCache holding the given (keys, values) of every layer
+    """
+    past_key_values = DynamicCache()
+    for layer, (keys, values) in enumerate(layers):
+        past_key_values.update(keys, values, layer)
+    return past_key_values
+
+
+class PagedKVCache:
+    """
+    KV cache space carved into fixed-size blocks shared by all sequences.
+
+    A sequence owns a list of blocks that grows a block at a time, so the
+    space follows the tokens actually decoded instead of ``max_new_tokens``
+    for every row, and a finished sequence hands its blocks straight to the
+    next one. The blocks decide which sequences fit; the KV of the running
+    sequences itself lives in a RunningBatch.
+
+    With prefix caching the full blocks of every prompt also keep a copy of
+    their KV, so a later prompt starting with the same tokens only prefills
+    the rest. Blocks are reference counted and a cached block nobody uses
+    stays until its space is needed.
+    """
+
+    def __init__(self, num_layers, num_blocks, block_size):
+        self.num_layers = num_layers
+        self.num_blocks = num_blocks
+        self.block_size = block_size
+        self.free_blocks = deque(range(num_blocks))
+        self.ref_counts = [0] * num_blocks
+        # Prefix caching: full prompt blocks by the hash of the tokens up to
+        # and including them, and their KV per layer. Unreferenced cached
+        # blocks stay in ``evictable`` (oldest first) until their space is
+        # needed.
+        self.cached_blocks = {}
+        self.block_hashes = {}
+        self.evictable = OrderedDict()
+        self.stored = {}
+
+    def allocate(self, seq, num_tokens):
+        """
+        Grow ``seq`` to hold ``num_tokens`` tokens; False if there are not
+        enough free blocks, in which case nothing is taken
+        """
+        needed = -(-num_tokens // self.block_size) - len(seq.blocks)
+        if needed > len(self.free_blocks) + len(self.evictable):
+            return False
+        for _ in range(needed):
+            if self.free_blocks:
+                block = self.free_blocks.popleft()
+            else:
+                block, _ = self.evictable.popitem(last=False)
+                del self.cached_blocks[self.block_hashes.pop(block)]
+                del self.stored[block]
+            self.ref_counts[block] = 1
+            seq.blocks.append(block)
+        return True
+
+    def free(self, seq):
+        for block in seq.blocks:
+            self.ref_counts[block] -= 1
+            if self.ref_counts[block]:
+                continue
+            if block in self.block_hashes:
+                self.evictable[block] = None
+            else:
+                self.free_blocks.append(block)
+        seq.blocks = []
+        seq.num_cached = 0
+
+    def prefix_hashes(self, token_ids):
+        """
+        Chained hashes of the full blocks of ``token_ids``
+        """
+        hashes = []
+        parent = None
+        for start in range(0, len(token_ids) - self.block_size + 1, self.block_size):
+            parent = hash((parent, tuple(token_ids[start : start + self.block_size])))
+            hashes.append(parent)
+        return hashes
+
+    def match_prefix(self, seq):
+        """
+        Share the cached blocks of the longest cached prefix of an empty
+        ``seq``'s prompt and return its length in tokens. The last prompt
+        token is always left to prefill, its logits pick the first new token.
+        """
+        for block_hash in self.prefix_hashes(seq.token_ids[:-1]):
+            block = self.cached_blocks.get(block_hash)
+            if block is None:
+                break
+            if not self.ref_counts[block]:
+                del self.evictable[block]
+            self.ref_counts[block] += 1
+            seq.blocks.append(block)
+        seq.num_cached = len(seq.blocks) * self.block_size
+        return seq.num_cached
+
+    def register_prefix(self, seq, past_key_values):
+        """
+        Keep the KV of the full blocks of a prefilled ``seq``'s prompt, from
+        its one-row ``past_key_values``, for later prompts that start the
+        same way
+        """
+        layers = [layer_cache(past_key_values, layer) for layer in range(self.num_layers)]
+        hashes = self.prefix_hashes(seq.prompt_ids)
+        for index, (block, block_hash) in enumerate(zip(seq.blocks, hashes)):
+            if block_hash in self.cached_blocks or block in self.block_hashes:
+                continue
+            start = index * self.block_size
+            end = start + self.block_size
+            self.cached_blocks[block_hash] = block
+            self.block_hashes[block] = block_hash
+            # Copies, so the prefill's cache is not kept alive by a view
+            self.stored[block] = [
+                (keys[:, :, start:end].clone(), values[:, :, start:end].clone())
+                for keys, values in layers
+            ]
+
+    def prefix_cache(self, seq):
+        """
+        A one-row DynamicCache of the shared prefix blocks of ``seq``
+        """
+        blocks = seq.blocks[: seq.num_cached // self.block_size]
+        return dense_cache(
+            (
+                torch.cat([self.stored[block][layer][0] for block in blocks], dim=2),
+                torch.cat([self.stored[block][layer][1] for block in blocks], dim=2),
+            )
+            for layer in range(self.num_layers)
+        )
+
+
+class RunningBatch:
+    """
+    The running sequences and their KV in one left-padded DynamicCache.
+
+    Every decode step the model appends one token per row to the cache, as
+    in model.generate. Rows are only dropped when their sequences finish or
+    are preempted and added when sequences are admitted, so a step never
+    rebuilds the cache. There is no paged attention kernel in transformers,
+    so rows that share a prompt prefix each hold their own copy of it.
+    """
+
+    def __init__(self, num_layers, device):
+        self.num_layers = num_layers
+        # Of the attention mask; layers may sit on other GPUs with a device_map
+        self.device = device
+        self.seqs = []
+        self.past_key_values = None
+        self.attention_mask = None
+
+    def update(self, leaving, joining):
+        """
+        Drop the rows of the sequences in ``leaving`` and append ``joining``,
+        (sequence, one-row past_key_values) pairs of prefilled sequences
+        """
+        leaving = set(leaving)
+        keep = [row for row, seq in enumerate(self.seqs) if seq not in leaving]
+        if len(keep) == len(self.seqs) and not joining:
+            return
+        self.seqs = [self.seqs[row] for row in keep] + [seq for seq, _ in joining]
+        if not self.seqs:
+            self.past_key_values = self.attention_mask = None
+            return
+
+        parts = []
+        if keep:
+            keep = torch.tensor(keep)
+            mask = self.attention_mask[keep.to(self.device)]
+            # Columns that only padded the rows that left
+            start = int(mask.any(dim=0).nonzero()[0])
+            layers = []
+            for keys, values in self.layers():
+                rows = keep.to(keys.device)
+                layers.append((keys[rows, :, start:], values[rows, :, start:]))
+            parts.append((mask[:, start:], layers))
+        for seq, past_key_values in joining:
+            layers = [layer_cache(past_key_values, layer) for layer in range(self.num_layers)]
+            mask = torch.ones(1, layers[0][0].shape[2], dtype=torch.long, device=self.device)
+            parts.append((mask, layers))
+
+        width = max(mask.shape[1] for mask, _ in parts)
+
+        def left_pad(tensor, dim):
+            # F.pad takes (left, right) pairs starting from the last dimension
+            padding = [0, 0] * (tensor.dim() - 1 - dim)
+            return torch.nn.functional.pad(tensor, padding + [width - tensor.shape[dim], 0])
+
+        self.attention_mask = torch.cat([left_pad(mask, 1) for mask, _ in parts])
+        self.past_key_values = dense_cache(
+            (
+                torch.cat([left_pad(layers[layer][0], 2) for _, layers in parts]),
+                torch.cat([left_pad(layers[layer][1], 2) for _, layers in parts]),
+            )
+            for layer in range(self.num_layers)
+        )
+
+    def layers(self):
+        return [layer_cache(self.past_key_values, layer) for layer in range(self.num_layers)]
+
+
+class PagedBackend(InferenceBackend):
+    """
+    Continuous batching with a block-managed KV cache, after vLLM.
+
+    Requests are admitted while there are free sequence slots and KV
+    blocks. Every step decodes one token for all running sequences; a
+    sequence that finishes frees its blocks at once and a waiting request
+    takes its place in the next step, instead of the batch idling until
+    its longest row ends. When the cache is full the youngest sequence is
+    preempted and recomputed later. The thinking budget processor, sampling
+    warpers and stop check run once per step over all running rows, with
+    the processor keeping one state row per request.
+
+    With ``prefix_caching`` the full KV blocks of every prompt are kept
+    (until their space is needed) and a later prompt starting with the same
+    tokens shares them, prefilling only the rest.
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        model,
+        max_num_seqs=64,
+        max_kv_tokens=32768,
+        block_size=16,
+        prefix_caching=False,
+    ):
+        super().__init__(tokenizer, model)
+        self.max_num_seqs = max_num_seqs
+        self.num_blocks = max_kv_tokens // block_size
+        self.block_size = block_size
+        self.prefix_caching = prefix_caching
+        self.preemptions = 0
+        # Prompt tokens admitted, and how many of them came from shared blocks
+        self.prefill_tokens = 0
+        self.prefix_hit_tokens = 0
+
+        eos_token_id = model.generation_config.eos_token_id
+        if eos_token_id is None:
+            eos_token_id = tokenizer.eos_token_id
+        self.eos_token_ids = set(
+            eos_token_id if isinstance(eos_token_id, list) else [eos_token_id]
+        )
+
+    def generate(
+        self,
+        family,
+        batch_messages,
+        thinking_budget,
+        max_new_tokens,
+        enable_wait_insertion,
+        temperature=None,
+        top_p=None,
+        do_sample=None,
+        early_stop_stats=None,
+    ):
+        tokenizer = self.tokenizer
+        texts = chat_prompts(tokenizer, family, batch_messages, thinking_budget)
+        prompts = tokenizer(texts)["input_ids"]
+
+        if do_sample is None:
+            do_sample = self.model.generation_config.do_sample
+        penalties = build_penalties(self.model.generation_config)
+        warpers = build_warpers(self.model.generation_config, temperature, top_p)
+
+        num_running = min(self.max_num_seqs, len(prompts))
+        per_seq = self.num_blocks * self.block_size // max(num_running, 1)
+        if prompts and per_seq < max(map(len, prompts)) + max_new_tokens:
+            print(
+                f"⚠️ {self.num_blocks * self.block_size} KV cache tokens leave {per_seq} per "
+                f"sequence with {num_running} running, fewer than a prompt plus "
+                f"{max_new_tokens} new tokens: long generations will be preempted and "
+                "recomputed. Raise --max_kv_tokens or lower --max_num_seqs."
+            )
+
+        # One processor for all requests, its state rows are the request indices
+        processor = None
+        if family.uses_budget_processor(thinking_budget):
+            processor = ThinkingTokenBudgetProcessor(
+                tokenizer,
+                max_thinking_tokens=[thinking_budget] * len(prompts),
+                enable_wait_insertion=enable_wait_insertion,
+                think_start_tag=family.think_start_tag,
+                think_end_tag=family.think_end_tag,
+            )
+        criteria = AnswerCompleteCriteria(tokenizer, family, thinking_budget, 0)
+
+        waiting = deque(Sequence(index, prompt_ids) for index, prompt_ids in enumerate(prompts))
+        num_layers = self.model.config.num_hidden_layers
+        cache = PagedKVCache(num_layers, self.num_blocks, self.block_size)
+        batch = RunningBatch(num_layers, self.model.device)
+        # Admission order, the youngest sequence is preempted first
+        running = []
+        leaving = []
+        finished = {}
+        stopped_at = []
+
+        def step(seqs, logits):
+            # Pick the next token of every sequence at once and return the
+            # sequences that are done
+            device = logits.device
+            last_tokens = torch.tensor([[seq.last_token] for seq in seqs], device=device)
+            if penalties:
+                # Rows are left-padded with their own first token, which a
+                # penalty counts once however often it appears
+                width = max(len(seq.prompt_ids) + len(seq.new_ids) for seq in seqs)
+                token_ids = torch.tensor(
+                    [
+                        [seq.prompt_ids[0]] * (width - len(seq.prompt_ids) - len(seq.new_ids))
+                        + seq.token_ids
+                        for seq in seqs
+                    ],
+                    device=device,
+                )
+                logits = penalties(token_ids, logits)
+            if processor is not None:
+                rows = torch.tensor([seq.index for seq in seqs], device=device)
+                logits = processor.process_rows(last_tokens, logits, rows)
+            if do_sample:
+                logits = warpers(last_tokens, logits)
+                tokens = torch.multinomial(torch.softmax(logits, dim=-1), 1).squeeze(1)
+            else:
+                tokens = logits.argmax(dim=-1)
+
+            done = []
+            checking = []
+            for seq, token in zip(seqs, tokens.tolist()):
+                seq.new_ids.append(token)
+                if token in self.eos_token_ids or len(seq.new_ids) >= max_new_tokens:
+                    done.append(seq)
+                elif criteria.enabled and token not in criteria.special_ids:
+                    checking.append(seq)
+            if checking:
+                complete = criteria.complete_rows(
+                    [(len(seq.prompt_ids), seq.token_ids) for seq in checking]
+                )
+                for seq, is_complete in zip(checking, complete):
+                    if is_complete:
+                        stopped_at.append(len(seq.new_ids))
+                        done.append(seq)
+            return done
+
+        def retire(seq):
+            cache.free(seq)
+            running.remove(seq)
+            leaving.append(seq)
+            finished[seq.index] = seq
+
+        def preempt():
+            # Drop the youngest sequence's KV; it is recomputed when readmitted
+            seq = running.pop()
+            cache.free(seq)
+            leaving.append(seq)
+            waiting.appendleft(seq)
+            self.preemptions += 1
+
+        device = self.model.device
+        with torch.no_grad():
+            while waiting or running:
+                # Admit and prefill waiting requests while there is room
+                joining = []
+                admitted_logits = []
+                while waiting and len(running) < self.max_num_seqs:
+                    seq = waiting[0]
+                    token_ids = seq.token_ids
+                    start = cache.match_prefix(seq) if self.prefix_caching else 0
+                    if not cache.allocate(seq, len(token_ids)):
+                        cache.free(seq)
+                        if not running:
+                            raise RuntimeError(
+                                f"A prompt of {len(token_ids)} tokens does not fit in "
+                                f"{self.num_blocks * self.block_size} KV cache tokens"
+                            )
+                        break
+                    waiting.popleft()
+                    input_ids = torch.tensor([token_ids[start:]], device=device)
+                    if start:
+                        # Only the tokens after the shared prefix are prefilled
+                        outputs = self.model(
+                            input_ids=input_ids,
+                            attention_mask=torch.ones(1, len(token_ids), dtype=torch.long, device=device),
+                            position_ids=torch.arange(start, len(token_ids), device=device)[None],
+                            past_key_values=cache.prefix_cache(seq),
+                            use_cache=True,
+                        )
+                        self.prefix_hit_tokens += start
+                    else:
+                        outputs = self.model(input_ids=input_ids, use_cache=True)
+                    seq.num_cached = len(token_ids)
+                    self.prefill_tokens += len(token_ids)
+                    if self.prefix_caching:
+                        cache.register_prefix(seq, outputs.past_key_values)
+                    running.append(seq)
+                    joining.append((seq, outputs.past_key_values))
+                    admitted_logits.append(outputs.logits[:, -1, :])
+                if joining:
+                    admitted = [seq for seq, _ in joining]
+                    for seq in step(admitted, torch.cat(admitted_logits).float()):
+                        retire(seq)
+
+                # Every running sequence needs a slot for the token it feeds
+                for seq in list(running):
+                    while seq in running and not cache.allocate(seq, seq.num_cached + 1):
+                        preempt()
+
+                gone = set(leaving)
+                batch.update(leaving, [(seq, kv) for seq, kv in joining if seq not in gone])
+                leaving = []
+                if not running:
+                    continue
+
+                attention_mask = torch.cat(
+                    [batch.attention_mask, batch.attention_mask.new_ones(len(batch.seqs), 1)],
+                    dim=1,
+                )
+                outputs = self.model(
+                    input_ids=torch.tensor([[seq.last_token] for seq in batch.seqs], device=device),
+                    attention_mask=attention_mask,
+                    position_ids=torch.tensor(
+                        [[seq.num_cached] for seq in batch.seqs], device=device
+                    ),
+                    past_key_values=batch.past_key_values,
+                    use_cache=True,
+                )
+                batch.past_key_values = outputs.past_key_values
+                batch.attention_mask = attention_mask
+                for seq in batch.seqs:
+                    seq.num_cached += 1
+                for seq in step(batch.seqs, outputs.logits[:, -1, :].float()):
+                    retire(seq)
+
+        if early_stop_stats is not None:
+            early_stop_stats.update(len(prompts), stopped_at)
+
+        accounting = TokenAccounting(tokenizer, family, self.model)
+        wait_inserted = [False] * len(prompts)
+        if processor is not None and processor.wait_inserted is not None:
+            wait_inserted = processor.wait_inserted.tolist()
+        generations = []
+        for index in range(len(prompts)):
+            seq = finished[index]
+            token_stats = None
+            if accounting.enabled:
+                token_stats = accounting.count(
+                    seq.new_ids, len(seq.prompt_ids), wait_inserted[index]
+                )
+            generations.append(Generation(seq.prompt_ids, seq.new_ids, token_stats))
+        return generations
+
+
+BACKENDS = {"hf": HFBackend, "paged": PagedBackend}
+
+
+def add_backend_args(parser):
+    """
+    The inference backend options shared by the eval scripts
+    """
+    parser.add_argument(
+        "--backend",
+        choices=sorted(BACKENDS),
+        default="hf",
+        help="hf: model.generate on padded batches; paged: continuous batching "
+        "over a paged KV cache (--batch_size is then the number of sentences "
+        "queued at once)",
+    )
+    parser.add_argument(
+        "--max_num_seqs",
+        type=int,
+        default=64,
+        help="Sequences decoded together by the paged backend",
+    )
+    parser.add_argument(
+        "--max_kv_tokens",
+        type=int,
+        default=None,
+        help="KV cache size of the paged backend, in tokens (default: room for "
+        "--max_num_seqs sequences of a prompt plus --max_new_tokens each). "
+        "A smaller cache still works, but long generations are preempted and "
+        "recomputed",
+    )
+    parser.add_argument(
+        "--prefix_caching",
+        action="store_true",
+        help="Let the paged backend reuse the KV of prompt prefixes it has already seen",
+    )
+
+
+def backend_options(args):
+    if args.backend != "paged":
+        return {}
+    max_kv_tokens = args.max_kv_tokens
+    if max_kv_tokens is None:
+        max_kv_tokens = args.max_num_seqs * (PROMPT_KV_TOKENS + args.max_new_tokens)
+    return {
+        "max_num_seqs": args.max_num_seqs,
+        "max_kv_tokens": max_kv_tokens,
+        "prefix_caching": args.prefix_caching,
+    }
+
+
+def build_backend(name, tokenizer, model, **options):
+    return BACKENDS[name](tokenizer, model, **options)
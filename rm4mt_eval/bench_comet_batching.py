@@ -0,0 +1,95 @@
+import os
+import time
+import random
+import argparse
+from glob import glob
+from comet import download_model, load_from_checkpoint
+
+from compute_comet import compute_comet_scores, compute_comet_scores_global, load_texts
+
+
+def synthetic_files(num_files, lines_per_file, seed):
+    """
+    Files of random word soup with the mixed segment lengths of our datasets,
+    from short sentences to paragraph-level documents
+    """
+    rng = random.Random(seed)
+    words = ["translation", "model", "the", "of", "reasoning", "budget", "a", "sentence"]
+
+    def text(length):
+        return " ".join(rng.choice(words) for _ in range(length))
+
+    files = []
+    for _ in range(num_files):
+        items = []
+        for _ in range(lines_per_file):
+            length = rng.choice([8, 16, 32, 64, 256])
+            items.append(
+                {"src_text": text(length), "hyp_text": text(length), "tgt_text": text(length)}
+            )
+        files.append(items)
+    return files
+
+
+def run(model, datasets, max_tokens, gpu_num):
+    """
+    Time the per-file path against the global bucketed path on the same
+    data and return items/sec of each plus the largest score difference
+    """
+    total = sum(len(items) for items in datasets)
+
+    start = time.perf_counter()
+    per_file = [compute_comet_scores(model, items, gpu_num) for items in datasets]
+    per_file_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    bucketed = compute_comet_scores_global(
+        model,
+        datasets,
+        max_tokens=max_tokens,
+        device="cuda" if gpu_num > 0 else "cpu",
+    )
+    bucketed_time = time.perf_counter() - start
+
+    max_diff = max(
+        abs(a - b)
+        for file_a, file_b in zip(per_file, bucketed)
+        for a, b in zip(file_a, file_b)
+    )
+    return total / per_file_time, total / bucketed_time, max_diff
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Per-file COMET scoring against global length-bucketed batching"
+    )
+    parser.add_argument("--model", default="Unbabel/wmt22-comet-da")
+    parser.add_argument(
+        "--input_root",
+        default=None,
+        help="Benchmark on budget_*/*.jsonl under this root instead of synthetic files",
+    )
+    parser.add_argument("--num_files", type=int, default=12)
+    parser.add_argument("--lines_per_file", type=int, default=16)
+    parser.add_argument("--max_tokens", type=int, default=16384)
+    parser.add_argument("--gpu_num", type=int, default=0, help="0 runs on CPU")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if args.input_root:
+        paths = glob(os.path.join(args.input_root, "*", "budget_*", "*.jsonl"))
+        datasets = [load_texts(path) for path in paths]
+    else:
+        datasets = synthetic_files(args.num_files, args.lines_per_file, args.seed)
+
+    model = load_from_checkpoint(download_model(args.model))
+    per_file_rate, bucketed_rate, max_diff = run(
+        model, datasets, args.max_tokens, args.gpu_num
+    )
+    print(
+        f"files={len(datasets)}  items={sum(len(items) for items in datasets)}  "
+        f"per-file={per_file_rate:.1f} items/s  "
+        f"bucketed={bucketed_rate:.1f} items/s  "
+        f"speedup={bucketed_rate / per_file_rate:.2f}x  "
+        f"max |diff|={max_diff:.2e}"
+    )
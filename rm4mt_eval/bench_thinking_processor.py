@@ -0,0 +1,174 @@
+import time
+import argparse
+import torch
+
+from engine import ThinkingTokenBudgetProcessor
+
+
+class FakeTokenizer:
+    """
+    Maps the handful of strings the processor looks up to fixed token ids
+    """
+
+    TOKEN_IDS = {"<think>": 1, "</think>": 2, "\n": 3, "wait": 4}
+
+    def encode(self, text, add_special_tokens=False):
+        return [self.TOKEN_IDS[text]]
+
+
+class RowWiseThinkingTokenBudgetProcessor(ThinkingTokenBudgetProcessor):
+    """
+    The previous row-by-row implementation, kept here as the reference the
+    vectorized processor has to agree with
+    """
+
+    def _init_state(self, batch_size, device):
+        if isinstance(self.max_thinking_tokens, (list, tuple)):
+            self.budgets = list(self.max_thinking_tokens)
+        else:
+            self.budgets = [self.max_thinking_tokens] * batch_size
+        self.thinking_tokens_count = [0] * batch_size
+        self.in_thinking = [False] * batch_size
+        self.stopped_thinking = [False] * batch_size
+        self.wait_inserted = [False] * batch_size
+
+    def _process_row(self, row, last_token, scores):
+        budget = self.budgets[row]
+        if last_token == self.think_start_token:
+            self.in_thinking[row] = True
+            self.thinking_tokens_count[row] = 0
+            self.wait_inserted[row] = False
+        elif last_token == self.think_end_token:
+            self.in_thinking[row] = False
+            self.stopped_thinking[row] = True
+
+        if self.in_thinking[row]:
+            self.thinking_tokens_count[row] += 1
+        count = self.thinking_tokens_count[row]
+
+        if not (
+            budget is not None
+            and budget > 0
+            and self.in_thinking[row]
+            and not self.stopped_thinking[row]
+        ):
+            return
+
+        row_scores = scores[row]
+        if (
+            self.enable_wait_insertion
+            and count < budget
+            and not self.wait_inserted[row]
+            and count > 5
+            and row_scores[self.think_end_token] == row_scores.max()
+        ):
+            row_scores[:] = self.neg_inf
+            row_scores[self.wait_token] = 0
+            self.wait_inserted[row] = True
+            return
+
+        if count >= budget * 0.95:
+            boost_factor = 1 + (count / budget)
+            row_scores[self.nl_token] = row_scores[self.nl_token] * boost_factor
+            row_scores[self.think_end_token] = (
+                row_scores[self.think_end_token] * boost_factor
+            )
+
+        if count >= budget - 1:
+            row_scores[:] = self.neg_inf
+            if count == budget - 1:
+                row_scores[self.nl_token] = 0
+            else:
+                row_scores[self.think_end_token] = 0
+                self.stopped_thinking[row] = True
+
+    def __call__(self, input_ids, scores):
+        batch_size = scores.shape[0]
+        if self.in_thinking is None:
+            self._init_state(batch_size, scores.device)
+        last_tokens = input_ids[:, -1].tolist()
+        for row in range(batch_size):
+            self._process_row(row, last_tokens[row], scores)
+        self.tokens_generated += 1
+        return scores
+
+
+def run(budgets, vocab_size, steps, enable_wait_insertion, seed):
+    """
+    Drive both processors with the same random logits, check that they pick
+    the same token at every step and time the per-step overhead of each
+    """
+    tokenizer = FakeTokenizer()
+    generator = torch.Generator().manual_seed(seed)
+    batch_size = len(budgets)
+
+    reference = RowWiseThinkingTokenBudgetProcessor(
+        tokenizer, budgets, enable_wait_insertion=enable_wait_insertion
+    )
+    vectorized = ThinkingTokenBudgetProcessor(
+        tokenizer, budgets, enable_wait_insertion=enable_wait_insertion
+    )
+
+    input_ids = torch.full((batch_size, 1), FakeTokenizer.TOKEN_IDS["<think>"])
+    reference_time = 0.0
+    vectorized_time = 0.0
+    for step in range(steps):
+        scores = torch.randn(batch_size, vocab_size, generator=generator)
+        # Make </think> the favourite every so often so the wait rule fires
+        if step % 7 == 0:
+            scores[:, FakeTokenizer.TOKEN_IDS["</think>"]] += 10
+
+        reference_scores = scores.clone()
+        start = time.perf_counter()
+        reference_scores = reference(input_ids, reference_scores)
+        reference_time += time.perf_counter() - start
+
+        vectorized_scores = scores.clone()
+        start = time.perf_counter()
+        vectorized_scores = vectorized(input_ids, vectorized_scores)
+        vectorized_time += time.perf_counter() - start
+
+        if not torch.equal(reference_scores, vectorized_scores):
+            raise AssertionError(f"Processors disagree at step {step}")
+
+        next_tokens = reference_scores.argmax(dim=-1, keepdim=True)
+        input_ids = torch.cat([input_ids, next_tokens], dim=1)
+
+    return reference_time / steps, vectorized_time / steps
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="CPU microbenchmark of the thinking budget logits processor"
+    )
+    parser.add_argument("--vocab_size", type=int, default=151936)
+    parser.add_argument("--steps", type=int, default=300)
+    parser.add_argument(
+        "--batch_sizes", type=int, nargs="+", default=[1, 8, 32]
+    )
+    parser.add_argument(
+        "--budgets",
+        type=int,
+        nargs="+",
+        default=[0, 100, 200, 300],
+        help="Budgets assigned to the batch rows round-robin",
+    )
+    parser.add_argument("--enable_wait_insertion", action="store_true")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    for batch_size in args.batch_sizes:
+        budgets = [args.budgets[i % len(args.budgets)] for i in range(batch_size)]
+        reference_step, vectorized_step = run(
+            budgets,
+            args.vocab_size,
+            args.steps,
+            args.enable_wait_insertion,
+            args.seed,
+        )
+        print(
+            f"batch_size={batch_size:>3}  "
+            f"row-wise: {reference_step * 1e6:9.1f} us/step  "
+            f"vectorized: {vectorized_step * 1e6:9.1f} us/step  "
+            f"(identical decisions over {args.steps} steps)"
+        )
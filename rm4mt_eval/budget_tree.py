@@ -0,0 +1,391 @@
+import copy
+import os
+import torch
+from transformers import (
+    LogitsProcessorList,
+    MinPLogitsWarper,
+    RepetitionPenaltyLogitsProcessor,
+    TemperatureLogitsWarper,
+    TopKLogitsWarper,
+    TopPLogitsWarper,
+)
+from tqdm import tqdm
+
+from engine import (
+    AnswerCompleteCriteria,
+    EarlyStopStats,
+    Generation,
+    ThinkingTokenBudgetProcessor,
+    TokenAccounting,
+    build_output_record,
+    load_model,
+)
+from jsonl_io import JsonlWriter, iter_jsonl
+from resume_index import ResumeIndex
+
+BUDGET_TREE_NOTE = (
+    "Budget tree decoding shares the prompt KV cache and the common decode "
+    "prefix between thinking budgets. It reproduces separate per-budget runs "
+    "exactly only under greedy decoding (--greedy). With sampling, every "
+    "sentence is decoded with a generator reseeded from --seed, so the tree is "
+    "reproducible, but the samples are not the ones separate runs would draw."
+)
+
+
+class Branch:
+    """
+    One path of the budget tree: the budgets that still agree on every
+    token, their processors and the KV cache of the tokens decoded so far
+    """
+
+    def __init__(self, budgets, processors, input_ids, past_key_values, rng_state):
+        self.budgets = budgets
+        self.processors = processors
+        self.input_ids = input_ids
+        self.past_key_values = past_key_values
+        self.rng_state = rng_state
+
+
+def build_penalties(generation_config):
+    """
+    The generation_config processors model.generate applies before a custom
+    logits processor, sampled or not; they read the whole sequence
+    """
+    penalties = LogitsProcessorList()
+    repetition_penalty = generation_config.repetition_penalty
+    if repetition_penalty is not None and repetition_penalty != 1.0:
+        penalties.append(RepetitionPenaltyLogitsProcessor(repetition_penalty))
+    return penalties
+
+
+def build_warpers(generation_config, temperature, top_p):
+    """
+    The sampling warpers model.generate would apply, in the same order
+    """
+    if temperature is None:
+        temperature = generation_config.temperature
+    if top_p is None:
+        top_p = generation_config.top_p
+
+    warpers = LogitsProcessorList()
+    if temperature is not None and temperature != 1.0:
+        warpers.append(TemperatureLogitsWarper(temperature))
+    if generation_config.top_k is not None and generation_config.top_k != 0:
+        warpers.append(TopKLogitsWarper(generation_config.top_k))
+    if top_p is not None and top_p < 1.0:
+        warpers.append(TopPLogitsWarper(top_p))
+    if generation_config.min_p is not None:
+        warpers.append(MinPLogitsWarper(generation_config.min_p))
+    return warpers
+
+
+def generate_budget_tree(
+    model,
+    tokenizer,
+    family,
+    text,
+    budgets,
+    max_new_tokens,
+    enable_wait_insertion,
+    temperature=None,
+    top_p=None,
+    do_sample=None,
+    seed=42,
+    early_stop_stats=None,
+):
+    """
+    Decode one prompt for several thinking budgets at once.
+
+    The prompt is prefilled once. All budgets then follow a single path
+    until their processed logits pick different tokens, typically when the
+    smallest budget starts boosting or forcing ``</think>``. At that point
+    the KV cache is copied and each group of budgets continues on its own
+    branch. A budget also finishes once its family's answer is complete.
+    Returns a dict of budget to Generation.
+    """
+    if do_sample is None:
+        do_sample = model.generation_config.do_sample
+    penalties = build_penalties(model.generation_config)
+    warpers = build_warpers(model.generation_config, temperature, top_p)
+
+    eos_token_id = model.generation_config.eos_token_id
+    if eos_token_id is None:
+        eos_token_id = tokenizer.eos_token_id
+    eos_token_ids = set(eos_token_id if isinstance(eos_token_id, list) else [eos_token_id])
+
+    model_inputs = tokenizer(text, return_tensors="pt").to(model.device)
+    prompt_length = model_inputs["input_ids"].shape[1]
+
+    processors = {}
+    for budget in budgets:
+        if family.uses_budget_processor(budget):
+            processors[budget] = ThinkingTokenBudgetProcessor(
+                tokenizer,
+                max_thinking_tokens=budget,
+                enable_wait_insertion=enable_wait_insertion,
+                think_start_tag=family.think_start_tag,
+                think_end_tag=family.think_end_tag,
+            )
+        else:
+            processors[budget] = None
+    stop_criteria = {
+        budget: AnswerCompleteCriteria(tokenizer, family, budget, prompt_length)
+        for budget in budgets
+    }
+    stopped_at = []
+
+    generator = None
+    stack = [
+        Branch(
+            sorted(budgets), processors, model_inputs["input_ids"], None, None
+        )
+    ]
+    results = {}
+
+    while stack:
+        branch = stack.pop()
+
+        while True:
+            with torch.no_grad():
+                if branch.past_key_values is None:
+                    outputs = model(**model_inputs, use_cache=True)
+                else:
+                    outputs = model(
+                        input_ids=branch.input_ids[:, -1:],
+                        past_key_values=branch.past_key_values,
+                        use_cache=True,
+                    )
+            branch.past_key_values = outputs.past_key_values
+            logits = outputs.logits[:, -1, :].to(copy=True, dtype=torch.float32)
+            logits = penalties(branch.input_ids, logits)
+
+            if do_sample and generator is None:
+                generator = torch.Generator(device=logits.device)
+                generator.manual_seed(seed)
+            if do_sample and branch.rng_state is None:
+                branch.rng_state = generator.get_state()
+
+            # Group the budgets of this branch by the token they pick next
+            groups = []
+            for budget in branch.budgets:
+                processor = branch.processors[budget]
+                scores = logits.clone()
+                if processor is not None:
+                    scores = processor(branch.input_ids, scores)
+
+                if do_sample:
+                    scores = warpers(branch.input_ids, scores)
+                    match = next(
+                        (g for g in groups if torch.equal(g["scores"], scores)), None
+                    )
+                    if match is None:
+                        generator.set_state(branch.rng_state)
+                        probs = torch.softmax(scores, dim=-1)
+                        token = torch.multinomial(probs, 1, generator=generator)
+                        match = {
+                            "scores": scores,
+                            "token": token,
+                            "rng_state": generator.get_state(),
+                            "budgets": [],
+                        }
+                        groups.append(match)
+                else:
+                    token = scores.argmax(dim=-1, keepdim=True)
+                    match = next(
+                        (g for g in groups if torch.equal(g["token"], token)), None
+                    )
+                    if match is None:
+                        match = {"token": token, "rng_state": None, "budgets": []}
+                        groups.append(match)
+                match["budgets"].append(budget)
+
+            # The first unfinished group keeps this branch's cache, the others get a copy
+            continuation = None
+            for group in groups:
+                input_ids = torch.cat([branch.input_ids, group["token"]], dim=1)
+                new_tokens = input_ids.shape[1] - prompt_length
+                finished = (
+                    group["token"].item() in eos_token_ids
+                    or new_tokens >= max_new_tokens
+                )
+                group_budgets = group["budgets"]
+                if not finished and family.stop_trigger is not None:
+                    complete = [
+                        budget
+                        for budget in group_budgets
+                        if stop_criteria[budget].is_complete(input_ids[0])
+                    ]
+                    for budget in complete:
+                        results[budget] = input_ids[0, prompt_length:].tolist()
+                        stopped_at.append(new_tokens)
+                    group_budgets = [b for b in group_budgets if b not in complete]
+
+                if finished:
+                    for budget in group_budgets:
+                        results[budget] = input_ids[0, prompt_length:].tolist()
+                elif not group_budgets:
+                    continue
+                elif continuation is None:
+                    continuation = Branch(
+                        group_budgets,
+                        branch.processors,
+                        input_ids,
+                        branch.past_key_values,
+                        group["rng_state"],
+                    )
+                else:
+                    stack.append(
+                        Branch(
+                            group_budgets,
+                            branch.processors,
+                            input_ids,
+                            copy.deepcopy(branch.past_key_values),
+                            group["rng_state"],
+                        )
+                    )
+
+            if continuation is None:
+                break
+            branch = continuation
+
+    if early_stop_stats is not None:
+        early_stop_stats.update(len(budgets), stopped_at)
+
+    accounting = TokenAccounting(tokenizer, family, model)
+    token_stats = {}
+    for budget, token_ids in results.items():
+        processor = processors[budget]
+        wait_inserted = (
+            processor is not None
+            and processor.wait_inserted is not None
+            and bool(processor.wait_inserted[0])
+        )
+        token_stats[budget] = (
+            accounting.count(token_ids, prompt_length, wait_inserted)
+            if accounting.enabled
+            else None
+        )
+
+    prompt_ids = model_inputs["input_ids"][0].tolist()
+    return {
+        budget: Generation(prompt_ids, token_ids, token_stats[budget])
+        for budget, token_ids in results.items()
+    }
+
+
+def translate_grid(
+    family,
+    build_request,
+    model_name,
+    cells,
+    max_new_tokens,
+    seed,
+    device_map,
+    enable_wait_insertion,
+    do_sample=None,
+):
+    """
+    Budget tree version of engine.translate_grid.
+
+    Cells that share an input directory are decoded together: for every
+    sentence, the budgets still missing from their output files are grouped
+    by prompt and sampling settings and decoded as one budget tree.
+    """
+    print(BUDGET_TREE_NOTE)
+    tokenizer, model = load_model(model_name, family, device_map)
+
+    cells_by_input_dir = {}
+    for cell in cells:
+        cells_by_input_dir.setdefault(cell["input_dir"], []).append(cell)
+
+    for input_dir, dir_cells in cells_by_input_dir.items():
+        for cell in dir_cells:
+            os.makedirs(cell["output_dir"], exist_ok=True)
+
+        task = input_dir.split("/")[-1]
+        for filename in os.listdir(input_dir):
+            if not filename.endswith(".jsonl"):
+                continue
+
+            src_lang, tgt_lang = filename.replace(".jsonl", "").split("-")
+            input_file = os.path.join(input_dir, filename)
+            output_files = [
+                os.path.join(cell["output_dir"], filename) for cell in dir_cells
+            ]
+            resume_indexes = [
+                ResumeIndex(output_file, input_file) for output_file in output_files
+            ]
+            total_lines = resume_indexes[0].input_lines
+            early_stop_stats = EarlyStopStats(max_new_tokens)
+
+            fouts = [JsonlWriter(output_file, mode="a") for output_file in output_files]
+            try:
+                progress_bar = tqdm(
+                    iter_jsonl(input_file),
+                    total=total_lines,
+                    desc=f"Translating {filename} ({len(dir_cells)} budgets)",
+                    unit="examples",
+                )
+                for item in progress_bar:
+                    src_text, tgt_text, messages = build_request(
+                        task, item, src_lang, tgt_lang
+                    )
+                    if not src_text:
+                        continue
+
+                    # Budgets that share a prompt and sampling settings share a tree
+                    trees = {}
+                    for i, cell in enumerate(dir_cells):
+                        if (src_lang, tgt_lang, src_text) in resume_indexes[i]:
+                            continue
+                        budget = cell["thinking_budget"]
+                        text = family.chat_prompt(tokenizer, messages, budget)
+                        key = (text, cell.get("temperature"), cell.get("top_p"))
+                        trees.setdefault(key, []).append(i)
+
+                    for (text, temperature, top_p), indices in trees.items():
+                        budgets = [dir_cells[i]["thinking_budget"] for i in indices]
+                        try:
+                            generations = generate_budget_tree(
+                                model,
+                                tokenizer,
+                                family,
+                                text,
+                                budgets,
+                                max_new_tokens,
+                                enable_wait_insertion,
+                                temperature=temperature,
+                                top_p=top_p,
+                                do_sample=do_sample,
+                                seed=seed,
+                                early_stop_stats=early_stop_stats,
+                            )
+                        except Exception as e:
+                            print("=" * 30)
+                            print(f"Skipping budgets {budgets} due to error: {e}")
+                            print(f"src_text: {src_text}")
+                            print("=" * 30)
+                            continue
+
+                        for i in indices:
+                            budget = dir_cells[i]["thinking_budget"]
+                            output = build_output_record(
+                                tokenizer,
+                                family,
+                                model_name,
+                                budget,
+                                src_lang,
+                                tgt_lang,
+                                src_text,
+                                tgt_text,
+                                generations[budget],
+                            )
+                            fouts[i].write(output)
+                            fouts[i].flush()  # Ensure data is written immediately
+                            resume_indexes[i].add(src_lang, tgt_lang, src_text)
+            finally:
+                for fout in fouts:
+                    fout.close()
+
+            early_stop_stats.report(filename)
+            print(f"✔ Translated {filename} for budgets {[c['thinking_budget'] for c in dir_cells]}")
@@ -0,0 +1,238 @@
+import time
+import random
+import argparse
+import torch
+from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer
+
+from backends import HFBackend, PagedBackend
+from engine import (
+    MODEL_FAMILIES,
+    TokenAccounting,
+    build_translation_request,
+    chat_prompts,
+    think_tag_ids,
+)
+
+TINY_CONFIG = {
+    "hidden_size": 64,
+    "intermediate_size": 128,
+    "num_hidden_layers": 2,
+    "num_attention_heads": 4,
+    "num_key_value_heads": 2,
+    "head_dim": 16,
+}
+
+
+def tiny_model(tokenizer_name, seed):
+    """
+    A two-layer random-weight model with the architecture and vocabulary of
+    ``tokenizer_name``, small enough to decode on CPU
+    """
+    config = AutoConfig.from_pretrained(tokenizer_name)
+    config.update(TINY_CONFIG)
+    if getattr(config, "layer_types", None):
+        config.layer_types = config.layer_types[: config.num_hidden_layers]
+    torch.manual_seed(seed)
+    model = AutoModelForCausalLM.from_config(config, torch_dtype=torch.float32)
+    return model.eval()
+
+
+def open_thinking(family):
+    """
+    ``family`` with its think start tag ending every thinking prompt, so a
+    random-weight model is inside the thinking span from its first token and
+    the budget processor really counts, inserts wait and forces the end tag
+    """
+
+    class OpenThinkingFamily(type(family)):
+        def chat_prompt(self, tokenizer, messages, thinking_budget):
+            prompt = super().chat_prompt(tokenizer, messages, thinking_budget)
+            if self.uses_budget_processor(thinking_budget) and not prompt.endswith(
+                self.think_start_tag
+            ):
+                prompt += self.think_start_tag
+            return prompt
+
+    return OpenThinkingFamily()
+
+
+def favour_think_end(model, tokenizer, family, requests):
+    """
+    Bias the think end tag's logit so the random-weight model ranks it first
+    about half the time. The processor answers an early end tag with wait
+    and a late one ends the thinking, so both paths are taken.
+    """
+    end_id = tokenizer.encode(family.think_end_tag, add_special_tokens=False)[0]
+    with torch.no_grad():
+        logits = torch.cat(
+            [
+                model(**tokenizer(text, return_tensors="pt")).logits[0]
+                for text in chat_prompts(tokenizer, family, requests[:8], 1)
+            ]
+        )
+    gap = logits.max(dim=-1).values - logits[:, end_id]
+    bias = torch.zeros(logits.shape[-1])
+    bias[end_id] = gap.median()
+    model.lm_head.bias = torch.nn.Parameter(bias)
+
+
+def synthetic_requests(num_requests, seed):
+    rng = random.Random(seed)
+    words = ["translation", "model", "the", "of", "reasoning", "budget", "a", "sentence"]
+    requests = []
+    for _ in range(num_requests):
+        item = {"en_text": " ".join(rng.choice(words) for _ in range(rng.randint(3, 40)))}
+        _, _, messages = build_translation_request("WMT", item, "en", "zh", False)
+        requests.append(messages)
+    return requests
+
+
+def run(backend, family, requests, budget, max_new_tokens, batch_size, enable_wait_insertion):
+    generations = []
+    start = time.perf_counter()
+    for i in range(0, len(requests), batch_size):
+        generations.extend(
+            backend.generate(
+                family,
+                requests[i : i + batch_size],
+                budget,
+                max_new_tokens,
+                enable_wait_insertion=enable_wait_insertion,
+                do_sample=False,
+            )
+        )
+    return generations, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check that the paged backend decodes exactly like model.generate under "
+        "greedy decoding, and compare their throughput"
+    )
+    parser.add_argument(
+        "--tokenizer",
+        default="Qwen/Qwen3-0.6B",
+        help="Tokenizer and architecture of the tiny random-weight model",
+    )
+    parser.add_argument("--family", default="qwen", choices=sorted(MODEL_FAMILIES))
+    parser.add_argument("--budgets", type=int, nargs="+", default=[0, 8, 16, 64])
+    parser.add_argument(
+        "--no_wait_insertion",
+        action="store_true",
+        help="Check without the processor's wait insertion",
+    )
+    parser.add_argument("--num_requests", type=int, default=24)
+    parser.add_argument("--max_new_tokens", type=int, default=96)
+    parser.add_argument("--batch_size", type=int, default=1, help="Batch size of the HF reference")
+    parser.add_argument("--max_num_seqs", type=int, default=8)
+    parser.add_argument(
+        "--max_kv_tokens",
+        type=int,
+        default=2048,
+        help="Small enough to exercise preemption",
+    )
+    parser.add_argument(
+        "--prefix_caching",
+        action="store_true",
+        help="Check the paged backend with prompt prefixes shared between requests",
+    )
+    parser.add_argument(
+        "--repetition_penalty",
+        type=float,
+        default=None,
+        help="Set in the model's generation_config, which both backends must apply",
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer)
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    model = tiny_model(args.tokenizer, args.seed)
+    family = open_thinking(MODEL_FAMILIES[args.family])
+    requests = synthetic_requests(args.num_requests, args.seed)
+    favour_think_end(model, tokenizer, family, requests)
+    model.generation_config.repetition_penalty = args.repetition_penalty
+    enable_wait_insertion = not args.no_wait_insertion
+
+    hf = HFBackend(tokenizer, model)
+    paged = PagedBackend(
+        tokenizer,
+        model,
+        max_num_seqs=args.max_num_seqs,
+        max_kv_tokens=args.max_kv_tokens,
+        prefix_caching=args.prefix_caching,
+    )
+    trailing_ids = TokenAccounting(tokenizer, family, model).trailing_ids
+
+    def trimmed(ids):
+        # model.generate pads finished rows, the paged backend simply stops them
+        end = len(ids)
+        while end and ids[end - 1] in trailing_ids:
+            end -= 1
+        return ids[:end]
+
+    end_id = tokenizer.encode(family.think_end_tag, add_special_tokens=False)[0]
+    mismatches = 0
+    waits = ended = 0
+    for budget in args.budgets:
+        expected, hf_time = run(
+            hf, family, requests, budget, args.max_new_tokens, args.batch_size, enable_wait_insertion
+        )
+        actual, paged_time = run(
+            paged,
+            family,
+            requests,
+            budget,
+            args.max_new_tokens,
+            len(requests),
+            enable_wait_insertion,
+        )
+        if budget:
+            waits += sum(bool((g.token_stats or {}).get("wait_inserted")) for g in expected)
+            ended += sum(end_id in g.new_ids for g in expected)
+        for i, (a, b) in enumerate(zip(expected, actual)):
+            if trimmed(a.new_ids) != trimmed(b.new_ids) or a.token_stats != b.token_stats:
+                mismatches += 1
+                print(f"budget={budget} request {i} differs")
+                print(f"  hf:    {tokenizer.decode(a.new_ids)!r}")
+                print(f"  paged: {tokenizer.decode(b.new_ids)!r}")
+        new_tokens = sum(len(trimmed(g.new_ids)) for g in actual)
+        print(
+            f"budget={budget}  hf(batch {args.batch_size})={new_tokens / hf_time:.1f} tok/s  "
+            f"paged={new_tokens / paged_time:.1f} tok/s  preemptions={paged.preemptions}  "
+            f"prefix hits={paged.prefix_hit_tokens}/{paged.prefill_tokens} tokens"
+        )
+
+    # Throughput at the same concurrency: model.generate on padded batches
+    # of --max_num_seqs against the paged backend running --max_num_seqs
+    budget = max(args.budgets)
+    hf_generations, hf_time = run(
+        hf, family, requests, budget, args.max_new_tokens, args.max_num_seqs, enable_wait_insertion
+    )
+    paged_generations, paged_time = run(
+        paged, family, requests, budget, args.max_new_tokens, len(requests), enable_wait_insertion
+    )
+    hf_rate = sum(len(trimmed(g.new_ids)) for g in hf_generations) / hf_time
+    paged_rate = sum(len(trimmed(g.new_ids)) for g in paged_generations) / paged_time
+    print(
+        f"Throughput with {args.max_num_seqs} sequences at budget={budget}: "
+        f"hf={hf_rate:.1f} tok/s  paged={paged_rate:.1f} tok/s  ({paged_rate / hf_rate:.2f}x)"
+    )
+
+    print(f"{len(args.budgets) * len(requests)} generations compared, {mismatches} mismatches")
+    print(f"With a budget: {waits} generations got a wait, {ended} closed their thinking")
+    start_id, end_id = think_tag_ids(tokenizer, family)
+    if None in (start_id, end_id) or tokenizer.unk_token_id in (start_id, end_id):
+        print(
+            f"{family.think_start_tag} and {family.think_end_tag} are not tokens of this "
+            "tokenizer, the budget processor was not exercised"
+        )
+    elif any(map(family.uses_budget_processor, args.budgets)) and (
+        not ended or (enable_wait_insertion and not waits)
+    ):
+        print("The budget processor never acted, the check proves nothing about it")
+        raise SystemExit(1)
+    if mismatches:
+        raise SystemExit(1)
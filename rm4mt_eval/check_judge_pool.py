@@ -0,0 +1,170 @@
+import os
+import json
+import asyncio
+import argparse
+import tempfile
+import threading
+from glob import glob
+from google import genai
+
+import compute_gea
+import compute_grb_grf
+from judge_client import AsyncJudgeClient, QuotaExhausted
+from judge_pool import JudgePool
+from judge_runner import score_files
+from jsonl_io import iter_jsonl
+from stub_gemini_server import fake_score, serve
+
+SCRIPTS = {"gea": compute_gea, "grb_grf": compute_grb_grf}
+
+
+def write_inputs(input_root, num_files, lines_per_file):
+    for i in range(num_files):
+        path = os.path.join(input_root, "model", f"budget_{i}", "en-zh.jsonl")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for line in range(lines_per_file):
+                record = {
+                    "src_lang": "en",
+                    "tgt_lang": "zh",
+                    "src_text": f"Source sentence {line}.",
+                    "tgt_text": f"参考 {line}",
+                    "hyp_text": f"译文 {i} {line}",
+                    "reasoning": "..." * 50,
+                }
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def expected_score(script, item, options):
+    """
+    The score the stub gives an item, from the same prompt the script sends
+    """
+    prompt = script.build_prompt(item, **options)
+    body = {"contents": []}
+    if isinstance(prompt, tuple):
+        system, prompt = prompt
+        body["systemInstruction"] = {"parts": [{"text": system}]}
+    body["contents"].append({"parts": [{"text": prompt}]})
+    return fake_score(body)
+
+
+def run(script, base_url, files, input_root, output_root, max_retries, max_workers):
+    client = genai.Client(api_key="stub", http_options={"base_url": base_url})
+    judge = AsyncJudgeClient(client, max_retries=max_retries, base_delay=0.05, max_delay=0.5)
+    pool = JudgePool(max_workers=max_workers)
+    error = None
+    try:
+        asyncio.run(
+            score_files(
+                judge,
+                pool,
+                files,
+                input_root,
+                output_root,
+                False,
+                script.METRICS,
+                script.compute_score,
+                script.PROMPT_FIELDS,
+            )
+        )
+    except QuotaExhausted as e:
+        error = e
+    return judge, pool, error
+
+
+def journaled(output_root):
+    scores = []
+    for path in glob(os.path.join(output_root, "**", "*.journal"), recursive=True):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                entry.pop("id")
+                scores.extend(entry.values())
+    return scores
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Exercise the judge pool against a local Gemini stub: 429/5xx retries, "
+        "dropped connections, drain-and-checkpoint on quota exhaustion and resuming"
+    )
+    parser.add_argument("--script", choices=sorted(SCRIPTS), default="gea")
+    parser.add_argument("--num_files", type=int, default=4)
+    parser.add_argument("--lines_per_file", type=int, default=40)
+    parser.add_argument("--max_workers", type=int, default=16)
+    parser.add_argument("--error_rate", type=float, default=0.3, help="429s of the first run")
+    parser.add_argument("--server_error_rate", type=float, default=0.05)
+    parser.add_argument("--drop_rate", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    script = SCRIPTS[args.script]
+    server, state = serve(
+        "127.0.0.1",
+        0,
+        latency=0.02,
+        jitter=0.01,
+        error_rate=args.error_rate,
+        server_error_rate=args.server_error_rate,
+        drop_rate=args.drop_rate,
+        seed=args.seed,
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        input_root = os.path.join(workdir, "input")
+        output_root = os.path.join(workdir, "output")
+        write_inputs(input_root, args.num_files, args.lines_per_file)
+        files = sorted(glob(os.path.join(input_root, "*", "budget_*", "*.jsonl")))
+        total = args.num_files * args.lines_per_file * len(script.METRICS)
+
+        # 1. Few retries against many 429s: the run must stop on quota
+        # exhaustion, with every score that came back journaled
+        judge, pool, error = run(script, base_url, files, input_root, output_root, 1, args.max_workers)
+        partial_scores = journaled(output_root)
+        merged = glob(os.path.join(output_root, "**", "*.jsonl"), recursive=True)
+        print(
+            f"first run: quota error={error is not None}  retries={judge.retries}  "
+            f"failed={pool.failures}  journaled={len(partial_scores)}  merged files={len(merged)}"
+        )
+        if error is None:
+            failures.append("the first run did not hit QuotaExhausted")
+        if not judge.retries:
+            failures.append("no request was retried")
+        if any(isinstance(score, str) for score in partial_scores):
+            failures.append("a failed request was journaled as a score")
+
+        # 2. Resume with enough retries: every missing score is requested
+        # again and every file is merged with the stub's scores
+        state.error_rate = 0.05
+        judge, pool, error = run(script, base_url, files, input_root, output_root, 20, args.max_workers)
+        print(
+            f"second run: quota error={error is not None}  retries={judge.retries}  "
+            f"failed={pool.failures}  stub requests={state.requests}  "
+            f"peak in flight={state.max_in_flight}"
+        )
+        checked = 0
+        for input_path in files:
+            output_path = os.path.join(output_root, os.path.relpath(input_path, input_root))
+            if not os.path.exists(output_path):
+                failures.append(f"{output_path} was not written")
+                continue
+            if os.path.exists(output_path + ".journal"):
+                failures.append(f"{output_path}.journal was left behind")
+            for item in iter_jsonl(output_path):
+                for metric, options in script.METRICS.items():
+                    checked += 1
+                    if item.get(metric) != expected_score(script, item, options):
+                        failures.append(f"{output_path}: {metric}={item.get(metric)!r}")
+        print(f"{checked}/{total} scores checked")
+        if checked != total:
+            failures.append(f"expected {total} scores")
+
+    server.shutdown()
+    for failure in failures[:10]:
+        print(f"FAIL: {failure}")
+    if failures:
+        raise SystemExit(1)
+    print("OK")
@@ -0,0 +1,101 @@
+import os
+import argparse
+from glob import glob
+from transformers import AutoTokenizer
+
+from engine import (
+    MODEL_FAMILIES,
+    build_translation_request,
+    extract_from_ids,
+)
+from jsonl_io import iter_jsonl
+
+
+def prompt_ids_for(tokenizer, family, thinking_budget, record):
+    item = {f"{record['src_lang']}_text": record["src_text"]}
+    _, _, messages = build_translation_request(
+        "WMT", item, record["src_lang"], record["tgt_lang"], False
+    )
+    text = family.chat_prompt(tokenizer, messages, thinking_budget)
+    return tokenizer(text)["input_ids"]
+
+
+def recorded_generation(tokenizer, prompt_ids, record):
+    """
+    The generated text of a recorded output, or None if it cannot be told
+    apart from the prompt.
+
+    Outputs written before the span extraction hold the decoded prompt and
+    generation in all_generated_text, newer ones the generation only.
+    """
+    prompt_text = tokenizer.decode(prompt_ids, skip_special_tokens=True)
+    all_generated_text = record["all_generated_text"]
+    if all_generated_text.startswith(prompt_text):
+        return all_generated_text[len(prompt_text) :]
+    if record["src_text"].strip() in all_generated_text:
+        # A prompt this script cannot rebuild (e.g. with RAG documents)
+        return None
+    return all_generated_text
+
+
+def check(tokenizer, family, thinking_budget, prompt_ids, generation):
+    """
+    Run the token span extraction and the string extraction it replaces on
+    one generation; returns ``(matches, string, spans)``
+    """
+    new_ids = tokenizer.encode(generation, add_special_tokens=False)
+    spans = extract_from_ids(tokenizer, family, thinking_budget, prompt_ids, new_ids)
+    # The string extraction ran on the decoded prompt and generation together
+    full_text = tokenizer.decode(prompt_ids + new_ids, skip_special_tokens=True)
+    string = family.extract_thinking_and_response(thinking_budget, full_text)
+    return spans == string, string, spans
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare token span extraction with the string extraction on recorded generations"
+    )
+    parser.add_argument("--model", required=True, help="Tokenizer to check with")
+    parser.add_argument("--family", required=True, choices=sorted(MODEL_FAMILIES))
+    parser.add_argument(
+        "--input_root",
+        required=True,
+        help="Output root holding budget_*/*.jsonl of the model",
+    )
+    parser.add_argument("--max_records", type=int, default=2000)
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    family = MODEL_FAMILIES[args.family]
+
+    paths = sorted(glob(os.path.join(args.input_root, "**", "budget_*", "*.jsonl"), recursive=True))
+    checked = 0
+    skipped = 0
+    mismatches = []
+    for path in paths:
+        for record in iter_jsonl(path):
+            if checked + skipped >= args.max_records:
+                break
+            budget = record["thinking_budget"]
+            prompt_ids = prompt_ids_for(tokenizer, family, budget, record)
+            generation = recorded_generation(tokenizer, prompt_ids, record)
+            if generation is None:
+                skipped += 1
+                continue
+            matches, string, spans = check(tokenizer, family, budget, prompt_ids, generation)
+            checked += 1
+            if not matches:
+                mismatches.append((path, budget, generation, string, spans))
+
+    for path, budget, generation, string, spans in mismatches[:10]:
+        print("=" * 30)
+        print(f"{path} budget={budget}")
+        print(f"generation: {generation!r}")
+        print(f"string:     {string!r}")
+        print(f"spans:      {spans!r}")
+    print(
+        f"{checked} recorded generations checked, {len(mismatches)} mismatches, "
+        f"{skipped} skipped (prompt not rebuilt)"
+    )
+    if mismatches:
+        raise SystemExit(1)
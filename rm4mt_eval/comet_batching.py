@@ -0,0 +1,110 @@
+import torch
+
+
+# Characters per subword by script: Latin and Cyrillic text packs about four
+# into a token, Indic scripts about two, CJK, kana and Hangul about one
+SCRIPT_CHARS_PER_TOKEN = [("\u0900", "\u0dff", 2), ("\u2e80", "\U0002ffff", 1)]
+
+
+def estimate_tokens(entry):
+    """
+    Rough subword count of a COMET input, counted per script, for when the
+    model's tokenizer is not at hand
+    """
+    tokens = 0.0
+    for text in entry.values():
+        for char in text:
+            for low, high, chars_per_token in SCRIPT_CHARS_PER_TOKEN:
+                if low <= char <= high:
+                    tokens += 1 / chars_per_token
+                    break
+            else:
+                tokens += 0.25
+        tokens += 2
+    return int(tokens)
+
+
+def token_lengths(tokenizer, entries):
+    """
+    Subword count of every COMET input with the model's own tokenizer,
+    two special tokens per segment included
+    """
+    lengths = [0] * len(entries)
+    fields = {field for entry in entries for field in entry}
+    for field in fields:
+        rows = [i for i, entry in enumerate(entries) if field in entry]
+        input_ids = tokenizer(
+            [entries[i][field] for i in rows], add_special_tokens=False
+        )["input_ids"]
+        for i, ids in zip(rows, input_ids):
+            lengths[i] += len(ids) + 2
+    return lengths
+
+
+def length_buckets(entries, max_tokens=16384, max_batch_size=256, lengths=None):
+    """
+    Split entries into batches of similar length.
+
+    Entries are sorted longest first and packed greedily while
+    ``batch size * longest entry`` stays within ``max_tokens``, so short
+    segments go out in large batches and long ones in small batches with
+    little padding either way. Yields lists of indices into ``entries``.
+    ``lengths`` are the entries' token counts, estimated if not given.
+    """
+    if lengths is None:
+        lengths = [estimate_tokens(entry) for entry in entries]
+    order = sorted(range(len(entries)), key=lambda i: lengths[i], reverse=True)
+
+    batch = []
+    batch_max = 0
+    for i in order:
+        longest = max(batch_max, lengths[i])
+        if batch and (
+            (len(batch) + 1) * longest > max_tokens or len(batch) >= max_batch_size
+        ):
+            yield batch
+            batch = []
+            longest = lengths[i]
+        batch.append(i)
+        batch_max = longest
+    if batch:
+        yield batch
+
+
+def to_device(obj, device):
+    if torch.is_tensor(obj):
+        return obj.to(device)
+    if isinstance(obj, dict):
+        return {key: to_device(value, device) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_device(value, device) for value in obj)
+    return obj
+
+
+def predict_bucketed(model, entries, max_tokens=16384, max_batch_size=256, device=None, progress_bar=None):
+    """
+    Score COMET entries in length-sorted, token-budgeted batches.
+
+    Runs the same collate and predict_step that ``model.predict`` runs,
+    without building a Trainer and DataLoader per call, so one call can
+    cover the entries of many files. Returns scores in entry order.
+    """
+    if device is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    model.eval()
+    model.to(device)
+
+    # COMET encoders carry their Hugging Face tokenizer
+    tokenizer = getattr(getattr(model, "encoder", None), "tokenizer", None)
+    lengths = token_lengths(tokenizer, entries) if tokenizer is not None else None
+
+    scores = [None] * len(entries)
+    with torch.no_grad():
+        for batch in length_buckets(entries, max_tokens, max_batch_size, lengths):
+            inputs = model.prepare_for_inference([entries[i] for i in batch])
+            prediction = model.predict_step(to_device(inputs, device))
+            for i, score in zip(batch, prediction.scores.tolist()):
+                scores[i] = score
+            if progress_bar is not None:
+                progress_bar.update(len(batch))
+    return scores
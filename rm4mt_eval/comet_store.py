@@ -0,0 +1,88 @@
+import os
+import sqlite3
+import hashlib
+
+# SQLite's default limit on bound parameters is 999 on older builds
+LOOKUP_CHUNK = 900
+
+
+def triple_key(src, mt, ref=None):
+    """
+    128-bit hash of a (src, mt, ref) triple; ``ref`` is None for reference-free models
+    """
+    parts = [src, mt] if ref is None else [src, mt, ref]
+    return hashlib.blake2b(
+        "\x1f".join(parts).encode("utf-8"), digest_size=16
+    ).digest()
+
+
+class CometScoreStore:
+    """
+    Persistent store of COMET segment scores keyed by model and triple hash.
+
+    Scores do not depend on which budget, model or run produced a
+    hypothesis, so a triple is scored once and later files only send the
+    triples the store has never seen to the model.
+
+    Jobs on different nodes share the file, so it keeps SQLite's default
+    rollback journal (WAL needs shared memory on one host and is unsafe on
+    network filesystems) and waits up to a minute for the write lock.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+
+        # timeout is SQLite's busy timeout: wait for other jobs' writes
+        self.conn = sqlite3.connect(path, timeout=60)
+        # Also turns a file left in WAL mode by older runs back
+        self.conn.execute("PRAGMA journal_mode=DELETE")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS scores ("
+            "model TEXT NOT NULL, key BLOB NOT NULL, score REAL NOT NULL, "
+            "PRIMARY KEY (model, key)) WITHOUT ROWID"
+        )
+        self.conn.commit()
+
+    def lookup(self, model_name, keys, count=True):
+        """
+        Return a dict of the known scores among ``keys``; ``count=False``
+        leaves the reuse counters alone, for planning lookups
+        """
+        keys = list(keys)
+        found = {}
+        for start in range(0, len(keys), LOOKUP_CHUNK):
+            chunk = keys[start : start + LOOKUP_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT key, score FROM scores WHERE model = ? AND key IN ({placeholders})",
+                (model_name, *chunk),
+            )
+            found.update(rows)
+        if count:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def add(self, model_name, scores):
+        """
+        Store ``{key: score}`` for a model
+        """
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO scores (model, key, score) VALUES (?, ?, ?)",
+            ((model_name, key, float(score)) for key, score in scores.items()),
+        )
+        self.conn.commit()
+
+    def report(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups * 100 if lookups else 0.0
+        print(
+            f"COMET store: {self.hits} known triples, {self.misses} scored "
+            f"({hit_rate:.1f}% reused) in {self.path}"
+        )
+
+    def close(self):
+        self.conn.close()
@@ -1,76 +1,285 @@
 import os
-import json
+import time
 from glob import glob
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
-from comet import download_model, load_from_checkpoint
 import argparse
 
+from comet_batching import predict_bucketed
+from comet_store import CometScoreStore, triple_key
+from jsonl_io import JsonlWriter, iter_jsonl
+from results_store import ResultsStore, partition_for
 
-def load_jsonl(filepath):
-    with open(filepath, encoding="utf-8") as f:
-        return [json.loads(line) for line in f]
+COMET_MODEL = "Unbabel/wmt22-comet-da"
+COMETKIWI_MODEL = "Unbabel/wmt22-cometkiwi-da"
+# Checkpoint and whether it scores against the reference
+METRIC_MODELS = [(COMET_MODEL, True), (COMETKIWI_MODEL, False)]
 
 
-def save_jsonl(data, filepath):
-    os.makedirs(os.path.dirname(filepath), exist_ok=True)
-    with open(filepath, "w", encoding="utf-8") as f:
-        for item in data:
-            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+# The only fields COMET reads; the bulky reasoning text is never held in memory
+TEXT_FIELDS = ("src_text", "hyp_text", "tgt_text")
 
 
-def compute_comet_scores(model, items, gpu_num, use_ref=True):
-    print("gpu_num:", gpu_num)
-    data = []
+def load_texts(filepath):
+    return [
+        {field: item[field] for field in TEXT_FIELDS if field in item}
+        for item in iter_jsonl(filepath)
+    ]
+
+
+def write_scored(input_path, output_path, columns, results=None, partition=None):
+    """
+    Stream the input records to the output with ``{field: scores}`` added,
+    and add the same columns to the results store partition if given
+    """
+    with JsonlWriter(output_path) as writer:
+        for i, item in enumerate(iter_jsonl(input_path)):
+            for field, scores in columns.items():
+                item[field] = scores[i]
+            writer.write(item)
+
+    if results is not None:
+        for field, scores in columns.items():
+            results.write_metric(partition, field, scores)
+
+
+def build_entries(items, use_ref=True):
+    """
+    Return the triple key of every item and the distinct COMET entries by key
+    """
+    keys = []
+    unique = {}
     for item in items:
         entry = {"src": item["src_text"], "mt": item["hyp_text"]}
         if use_ref and "tgt_text" in item:
             entry["ref"] = item["tgt_text"]
-        data.append(entry)
-    output = model.predict(data, batch_size=8, gpus=gpu_num)
-    return output.scores
+        key = triple_key(entry["src"], entry["mt"], entry.get("ref"))
+        keys.append(key)
+        unique.setdefault(key, entry)
+    return keys, unique
 
 
-def main(input_root, output_root, gpu_num, overwrite=False):
-    comet_model_path = download_model("Unbabel/wmt22-comet-da")
-    comet_model = load_from_checkpoint(comet_model_path)
+def score_unique(unique, predict, store=None, model_name=None):
+    """
+    Scores for every distinct entry, predicting only those the store lacks
+    """
+    known = store.lookup(model_name, unique) if store is not None else {}
+    missing = [key for key in unique if key not in known]
+    if missing:
+        new_scores = dict(zip(missing, predict([unique[key] for key in missing])))
+        if store is not None:
+            store.add(model_name, new_scores)
+        known.update(new_scores)
+    return known
 
-    cometkiwi_model_path = download_model("Unbabel/wmt22-cometkiwi-da")
-    cometkiwi_model = load_from_checkpoint(cometkiwi_model_path)
 
-    # Find JSONL files in budget_* and reasoning_effort_* directories
-    patterns = [
-        os.path.join(input_root, "*", "budget_*", "*.jsonl"),
-        os.path.join(input_root, "*", "reasoning_effort_*", "*.jsonl")
-    ]
-    
-    jsonl_files = []
-    for pattern in patterns:
-        jsonl_files.extend(glob(pattern))
+def compute_comet_scores(model, items, gpu_num, use_ref=True, store=None, model_name=None):
+    """
+    Score items with a COMET model, in item order.
+
+    Each distinct (src, mt, ref) triple is predicted at most once, and with
+    a store only triples it has never seen reach ``model.predict``.
+    """
+    print("gpu_num:", gpu_num)
+    keys, unique = build_entries(items, use_ref)
+    known = score_unique(
+        unique,
+        lambda entries: model.predict(entries, batch_size=8, gpus=gpu_num).scores,
+        store,
+        model_name,
+    )
+    return [known[key] for key in keys]
+
+
+def compute_comet_scores_global(
+    model,
+    datasets,
+    use_ref=True,
+    store=None,
+    model_name=None,
+    max_tokens=16384,
+    device=None,
+):
+    """
+    Score the items of many files in one pass.
+
+    The distinct triples of all files go into a single length-bucketed
+    queue (see comet_batching), and the scores are scattered back per
+    file. Returns one list of scores per dataset, in item order.
+    """
+    file_keys = []
+    unique = {}
+    for items in datasets:
+        keys, file_unique = build_entries(items, use_ref)
+        file_keys.append(keys)
+        for key, entry in file_unique.items():
+            unique.setdefault(key, entry)
+
+    def predict(entries):
+        with tqdm(total=len(entries), desc=f"Scoring {model_name}", unit="segments") as progress_bar:
+            return predict_bucketed(
+                model, entries, max_tokens=max_tokens, device=device, progress_bar=progress_bar
+            )
+
+    known = score_unique(unique, predict, store, model_name)
+    return [[known[key] for key in keys] for keys in file_keys]
+
+
+@contextmanager
+def timed(phase):
+    start = time.perf_counter()
+    yield
+    print(f"⏱ {phase}: {time.perf_counter() - start:.1f}s")
+
+
+def models_needed(pending, store=None):
+    """
+    Checkpoints that at least one pending file still needs predictions from
+    """
+    if not pending:
+        return []
+    if store is None:
+        return [model_name for model_name, _ in METRIC_MODELS]
+
+    needed = []
+    for input_path, _ in pending:
+        data = load_texts(input_path)
+        for model_name, use_ref in METRIC_MODELS:
+            if model_name in needed:
+                continue
+            _, unique = build_entries(data, use_ref)
+            if len(store.lookup(model_name, unique, count=False)) < len(unique):
+                needed.append(model_name)
+        if len(needed) == len(METRIC_MODELS):
+            break
+    return needed
 
-    print(f"Found {len(jsonl_files)} files to process")
 
-    for input_path in tqdm(jsonl_files, desc="Processing files"):
-        relative_path = os.path.relpath(input_path, input_root)
-        output_path = os.path.join(output_root, relative_path)
+def load_model(model_name):
+    # Imported here so runs with nothing to score never pay for importing COMET
+    from comet import download_model, load_from_checkpoint
 
-        # Skip if output file exists and overwrite is False
-        if os.path.exists(output_path) and not overwrite:
-            print(f"⏭️ Skipping {input_path} (already processed)")
-            continue
+    return load_from_checkpoint(download_model(model_name))
 
-        data = load_jsonl(input_path)
 
-        comet_scores = compute_comet_scores(comet_model, data, gpu_num, use_ref=True)
-        cometkiwi_scores = compute_comet_scores(
-            cometkiwi_model, data, gpu_num, use_ref=False
-        )
+def load_models(model_names):
+    """
+    Download and load checkpoints concurrently, one thread per checkpoint
+    """
+    if not model_names:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(model_names)) as executor:
+        return dict(zip(model_names, executor.map(load_model, model_names)))
 
-        for i in range(len(data)):
-            data[i]["comet_score"] = comet_scores[i]
-            data[i]["comet_kiwi_score"] = cometkiwi_scores[i]
 
-        save_jsonl(data, output_path)
-        print(f"✔ {input_path} → {output_path}")
+def main(
+    input_root,
+    output_root,
+    gpu_num,
+    overwrite=False,
+    store_path=None,
+    global_batching=False,
+    max_tokens=16384,
+    results_root=None,
+):
+    store = CometScoreStore(store_path) if store_path else None
+    results = ResultsStore(results_root) if results_root else None
+
+    with timed("discover files"):
+        # Find JSONL files in budget_* and reasoning_effort_* directories
+        patterns = [
+            os.path.join(input_root, "*", "budget_*", "*.jsonl"),
+            os.path.join(input_root, "*", "reasoning_effort_*", "*.jsonl")
+        ]
+
+        jsonl_files = []
+        for pattern in patterns:
+            jsonl_files.extend(glob(pattern))
+
+        print(f"Found {len(jsonl_files)} files to process")
+
+        pending = []
+        for input_path in jsonl_files:
+            relative_path = os.path.relpath(input_path, input_root)
+            output_path = os.path.join(output_root, relative_path)
+
+            # Skip if output file exists and overwrite is False
+            if os.path.exists(output_path) and not overwrite:
+                print(f"⏭️ Skipping {input_path} (already processed)")
+                continue
+            pending.append((input_path, output_path))
+
+    # Models are only loaded if some file needs them, and in parallel
+    with timed("plan"):
+        needed = models_needed(pending, store)
+    print(f"Models needed: {needed or 'none'}")
+    with timed("load models"):
+        models = load_models(needed)
+    comet_model = models.get(COMET_MODEL)
+    cometkiwi_model = models.get(COMETKIWI_MODEL)
+
+    with timed("score"):
+        if global_batching:
+            datasets = [load_texts(input_path) for input_path, _ in pending]
+            device = "cuda" if gpu_num > 0 else "cpu"
+            comet_scores = compute_comet_scores_global(
+                comet_model,
+                datasets,
+                use_ref=True,
+                store=store,
+                model_name=COMET_MODEL,
+                max_tokens=max_tokens,
+                device=device,
+            )
+            cometkiwi_scores = compute_comet_scores_global(
+                cometkiwi_model,
+                datasets,
+                use_ref=False,
+                store=store,
+                model_name=COMETKIWI_MODEL,
+                max_tokens=max_tokens,
+                device=device,
+            )
+            for (input_path, output_path), file_comet, file_cometkiwi in zip(
+                pending, comet_scores, cometkiwi_scores
+            ):
+                write_scored(
+                    input_path,
+                    output_path,
+                    {"comet_score": file_comet, "comet_kiwi_score": file_cometkiwi},
+                    results,
+                    partition_for(input_root, input_path),
+                )
+                print(f"✔ {input_path} → {output_path}")
+        else:
+            for input_path, output_path in tqdm(pending, desc="Processing files"):
+                data = load_texts(input_path)
+
+                comet_scores = compute_comet_scores(
+                    comet_model, data, gpu_num, use_ref=True, store=store, model_name=COMET_MODEL
+                )
+                cometkiwi_scores = compute_comet_scores(
+                    cometkiwi_model,
+                    data,
+                    gpu_num,
+                    use_ref=False,
+                    store=store,
+                    model_name=COMETKIWI_MODEL,
+                )
+
+                write_scored(
+                    input_path,
+                    output_path,
+                    {"comet_score": comet_scores, "comet_kiwi_score": cometkiwi_scores},
+                    results,
+                    partition_for(input_root, input_path),
+                )
+                print(f"✔ {input_path} → {output_path}")
+
+    if store is not None:
+        store.report()
+        store.close()
 
 
 if __name__ == "__main__":
@@ -88,6 +297,39 @@ if __name__ == "__main__":
         "--overwrite", action="store_true", 
         help="Overwrite existing output files (default: skip already processed files)"
     )
+    parser.add_argument(
+        "--store_path",
+        default="../cache/comet_scores.sqlite",
+        help="Persistent (src, mt, ref) score store shared across runs",
+    )
+    parser.add_argument(
+        "--no_store", action="store_true", help="Score every triple with the model"
+    )
+    parser.add_argument(
+        "--global_batching",
+        action="store_true",
+        help="Score all files in one length-bucketed pass instead of file by file",
+    )
+    parser.add_argument(
+        "--max_tokens",
+        type=int,
+        default=16384,
+        help="Padded token budget per batch with --global_batching",
+    )
+    parser.add_argument(
+        "--results_root",
+        default=None,
+        help="Also add the metric columns to this columnar results store",
+    )
     args = parser.parse_args()
 
-    main(args.input_root, args.output_root, args.gpu_num, args.overwrite)
+    main(
+        args.input_root,
+        args.output_root,
+        args.gpu_num,
+        args.overwrite,
+        None if args.no_store else args.store_path,
+        args.global_batching,
+        args.max_tokens,
+        args.results_root,
+    )
@@ -20,6 +20,13 @@ SCRIPT="compute_comet.py"
 # OUTPUT_BASE=""
 
 OVERWRITE=false
+# Score all files of a dataset in one length-bucketed pass
+GLOBAL_BATCHING=false
+
+EXTRA_ARGS=()
+if [ "$GLOBAL_BATCHING" = true ]; then
+  EXTRA_ARGS+=(--global_batching)
+fi
 
 GPU_COUNT=${SLURM_GPUS_PER_TASK}
 echo "Using $GPU_COUNT GPUs based on SLURM_GPUS_PER_TASK."
@@ -57,13 +64,15 @@ for DATASET in "${DATASETS[@]}"; do
           --input_root "$INPUT_ROOT" \
           --output_root "$OUTPUT_ROOT" \
           --gpu_num "$GPU_COUNT" \
+          "${EXTRA_ARGS[@]}" \
           --overwrite
   else
       echo "Mode: Skip already processed files"
       python "$SCRIPT" \
           --input_root "$INPUT_ROOT" \
           --output_root "$OUTPUT_ROOT" \
-          --gpu_num "$GPU_COUNT"
+          --gpu_num "$GPU_COUNT" \
+          "${EXTRA_ARGS[@]}"
   fi
 
   echo "Completed dataset: $DATASET"
@@ -21,7 +21,6 @@ SCRIPT="compute_grb_grf.py"
 # OUTPUT_BASE=""
 
 MAX_WORKERS=5
-BATCH_SIZE=100
 OVERWRITE=false
 
 DATASETS=(
@@ -57,15 +56,13 @@ for DATASET in "${DATASETS[@]}"; do
       --input_root "$INPUT_ROOT" \
       --output_root "$OUTPUT_ROOT" \
       --max_workers "$MAX_WORKERS" \
-      --batch_size "$BATCH_SIZE" \
       --overwrite
   else
     echo "Mode: Skip already processed files"
     python "$SCRIPT" \
       --input_root "$INPUT_ROOT" \
       --output_root "$OUTPUT_ROOT" \
-      --max_workers "$MAX_WORKERS" \
-      --batch_size "$BATCH_SIZE"
+      --max_workers "$MAX_WORKERS"
   fi
 done
 
@@ -0,0 +1,1096 @@
+import os
+import torch
+from transformers import (
+    LogitsProcessor,
+    StoppingCriteria,
+    AutoTokenizer,
+    AutoModelForCausalLM,
+)
+from tqdm import tqdm
+
+from jsonl_io import JsonlWriter, iter_jsonl
+from resume_index import ResumeIndex
+
+LANG_CODE_TO_NAME = {
+    "en": "English",
+    "fr": "French",
+    "nl": "Dutch",
+    "pt": "Portuguese",
+    "es": "Spanish",
+    "hi": "Hindi",
+    "ta": "Tamil",
+    "te": "Telugu",
+    "zh": "Chinese",
+    "de": "German",
+    "ru": "Russian",
+    "it": "Italian",
+}
+
+
+class ThinkingTokenBudgetProcessor(LogitsProcessor):
+    """
+    A processor where after a maximum number of tokens are generated,
+    a </think> token is added at the end to stop the thinking generation,
+    and then it will continue to generate the response.
+
+    The thinking state is kept per batch row in device tensors and every rule
+    is applied with ``torch.where`` over the whole batch, so a decode step
+    never synchronises with the host. ``max_thinking_tokens`` is either a
+    single budget shared by all rows or a list with one budget per row.
+    The think tags default to Qwen's and are overridden per model family.
+
+    A continuous-batching caller uses ``process_rows`` with ``rows``, the
+    state rows (request indices) of the batch rows of ``scores``, so one
+    processor keeps the state of every request while the running batch
+    changes; the state then has one row per entry of a
+    ``max_thinking_tokens`` list.
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        max_thinking_tokens=None,
+        enable_wait_insertion=True,
+        think_start_tag="<think>",
+        think_end_tag="</think>",
+    ):
+        self.tokenizer = tokenizer
+        self.max_thinking_tokens = max_thinking_tokens
+        self.enable_wait_insertion = enable_wait_insertion  # 是否开启强制插入wait
+
+        # 获取关键token的ID
+        self.think_start_token = self.tokenizer.encode(
+            think_start_tag, add_special_tokens=False
+        )[0]
+        self.think_end_token = self.tokenizer.encode(
+            think_end_tag, add_special_tokens=False
+        )[0]
+        self.nl_token = self.tokenizer.encode("\n", add_special_tokens=False)[0]
+        self.wait_token = self.tokenizer.encode("wait", add_special_tokens=False)[
+            0
+        ]  # 延长思考的token
+
+        # 状态跟踪（每行一份，在第一次调用时按batch大小在scores所在设备上初始化）
+        self.tokens_generated = 0
+        self.budgets = None
+        self.thinking_tokens_count = None
+        self.in_thinking = None
+        self.stopped_thinking = None
+        self.wait_inserted = None  # 跟踪是否已插入wait
+        self.neg_inf = float("-inf")
+
+    def _init_state(self, batch_size, device):
+        if isinstance(self.max_thinking_tokens, (list, tuple)):
+            if len(self.max_thinking_tokens) != batch_size:
+                raise ValueError(
+                    f"Got {len(self.max_thinking_tokens)} thinking budgets for a batch of {batch_size}"
+                )
+            budgets = [b or 0 for b in self.max_thinking_tokens]
+        else:
+            budgets = [self.max_thinking_tokens or 0] * batch_size
+
+        # 阈值在float64下计算，与逐行实现中的Python浮点比较完全一致
+        self.budgets = torch.tensor(budgets, dtype=torch.long, device=device)
+        self.boost_threshold = torch.tensor(
+            [b * 0.95 for b in budgets], dtype=torch.float64, device=device
+        )
+        self.thinking_tokens_count = torch.zeros(
+            batch_size, dtype=torch.long, device=device
+        )
+        self.in_thinking = torch.zeros(batch_size, dtype=torch.bool, device=device)
+        self.stopped_thinking = torch.zeros(batch_size, dtype=torch.bool, device=device)
+        self.wait_inserted = torch.zeros(batch_size, dtype=torch.bool, device=device)
+
+    def __call__(
+        self, input_ids: torch.LongTensor, scores: torch.FloatTensor
+    ) -> torch.FloatTensor:
+        return self.process_rows(input_ids, scores)
+
+    def process_rows(self, input_ids, scores, rows=None):
+        batch_size = scores.shape[0]
+        if self.in_thinking is None:
+            self._init_state(
+                batch_size if rows is None else len(self.max_thinking_tokens), scores.device
+            )
+        self.tokens_generated += 1
+
+        # 取出本批各行的状态，处理完再写回
+        select = slice(None) if rows is None else rows
+        in_thinking = self.in_thinking[select]
+        count = self.thinking_tokens_count[select]
+        wait_inserted = self.wait_inserted[select]
+        stopped_thinking = self.stopped_thinking[select]
+        budgets = self.budgets[select]
+
+        # 检查当前是否在思考状态中
+        if input_ids.shape[1] > 0:
+            last_tokens = input_ids[:, -1]
+            is_start = last_tokens == self.think_start_token  # 检测思考开始
+            is_end = last_tokens == self.think_end_token  # 检测思考结束
+            in_thinking = torch.where(
+                is_start, True, torch.where(is_end, False, in_thinking)
+            )
+            count = torch.where(is_start, 0, count)
+            wait_inserted = wait_inserted & ~is_start  # 重置wait状态
+            stopped_thinking = stopped_thinking | is_end
+
+        # 如果在思考状态中，增加思考token计数
+        count = count + in_thinking
+
+        # 处理有限制的思考token数量
+        active = (budgets > 0) & in_thinking & ~stopped_thinking
+
+        # 如果开启了wait插入功能，且模型想要结束思考但还没达到最大tokens，且还没插入过wait，就插入wait
+        if self.enable_wait_insertion:
+            end_is_max = scores[:, self.think_end_token] == scores.max(dim=-1).values
+            force_wait = (
+                active
+                & (count < budgets)
+                & ~wait_inserted
+                & (count > 5)  # 至少思考5个token后才考虑插入wait
+                & end_is_max  # </think>必须是概率最高的token
+            )
+        else:
+            force_wait = torch.zeros_like(active)
+        wait_inserted = wait_inserted | force_wait
+        active = active & ~force_wait
+
+        # 当接近token限制时，增加结束思考的概率
+        boost = active & (count.double() >= self.boost_threshold[select])
+        boost_factor = torch.where(
+            boost, 1 + count.double() / budgets.clamp(min=1), 1.0
+        ).float()
+        for token in (self.nl_token, self.think_end_token):
+            scores[:, token] = (scores[:, token].float() * boost_factor).to(
+                scores.dtype
+            )
+
+        # 强制结束思考：倒数第二个token选择换行，最后一个token选择结束思考
+        force_nl = active & (count == budgets - 1)
+        force_end = active & (count >= budgets)
+        stopped_thinking = stopped_thinking | force_end
+
+        if rows is None:
+            self.in_thinking = in_thinking
+            self.thinking_tokens_count = count
+            self.wait_inserted = wait_inserted
+            self.stopped_thinking = stopped_thinking
+        else:
+            self.in_thinking[rows] = in_thinking
+            self.thinking_tokens_count[rows] = count
+            self.wait_inserted[rows] = wait_inserted
+            self.stopped_thinking[rows] = stopped_thinking
+
+        forced = force_wait | force_nl | force_end
+        forced_token = torch.where(
+            force_wait,
+            self.wait_token,
+            torch.where(
+                force_nl,
+                self.nl_token,
+                torch.full_like(count, self.think_end_token),
+            ),
+        )
+        forced_scores = torch.full_like(scores, self.neg_inf)
+        forced_scores.scatter_(1, forced_token.unsqueeze(1), 0)
+
+        return torch.where(forced.unsqueeze(1), forced_scores, scores)
+
+
+class ModelFamily:
+    """
+    Everything that differs between the local reasoning models: the think
+    tags, the chat template arguments, whether the budget processor is
+    attached, how the answer is extracted from the decoded text and when
+    that answer is already final.
+    The defaults describe Qwen3.
+    """
+
+    name = "qwen"
+    think_start_tag = "<think>"
+    think_end_tag = "</think>"
+    compile_model = False
+
+    def chat_template_kwargs(self, thinking_budget):
+        return {"enable_thinking": thinking_budget != 0}
+
+    def chat_prompt(self, tokenizer, messages, thinking_budget):
+        """
+        Render one conversation with the chat template, ready for generation
+        """
+        return tokenizer.apply_chat_template(
+            messages,
+            tokenize=False,
+            add_generation_prompt=True,
+            **self.chat_template_kwargs(thinking_budget),
+        )
+
+    def uses_budget_processor(self, thinking_budget):
+        return thinking_budget != 0
+
+    # Text whose appearance in the newest tokens makes answer_complete worth checking
+    stop_trigger = None
+
+    def answer_complete(self, thinking_budget, text):
+        """
+        Whether extract_thinking_and_response gives the same result for
+        ``text`` and for any continuation of it. Qwen keeps everything after
+        </think> as the answer, so only EOS ends it.
+        """
+        return False
+
+    # Whether extract_thinking_and_response only ever matches markers in the
+    # generation, so its fallback can run on the generated text alone
+    markers_in_generation = False
+
+    def split_token_ids(
+        self, thinking_budget, prompt_ids, new_ids, think_start_id, think_end_id
+    ):
+        """
+        Thinking and answer token spans that decode to what
+        extract_thinking_and_response finds in the decoded prompt plus
+        generation, or None to fall back to it. The spans run from the
+        first think start tag to the first end tag and from there to the end.
+        """
+        if think_start_id is None or think_end_id is None:
+            return None
+        ids = prompt_ids + new_ids
+        if think_start_id not in ids or think_end_id not in ids:
+            return None
+        think_start = ids.index(think_start_id)
+        think_end = ids.index(think_end_id)
+        return ids[think_start + 1 : think_end], ids[think_end + 1 :]
+
+    def response_from_answer(self, thinking_budget, answer_text):
+        """
+        The response, given the decoded answer span of split_token_ids
+        """
+        return answer_text.strip()
+
+    def extract_thinking_and_response(self, thinking_budget, text):
+        """
+        Extract thinking content and response from generated text
+        """
+        thinking_content = ""
+        response_content = ""
+
+        # Find thinking tags
+        think_start = text.find(self.think_start_tag)
+        think_end = text.find(self.think_end_tag)
+
+        if think_start != -1 and think_end != -1:
+            thinking_content = text[
+                think_start + len(self.think_start_tag) : think_end
+            ].strip()
+            response_content = text[think_end + len(self.think_end_tag) :].strip()
+        else:
+            response_content = text.strip()
+
+        return thinking_content, response_content
+
+
+class QwenFamily(ModelFamily):
+    pass
+
+
+class CogitoFamily(ModelFamily):
+    name = "cogito"
+    stop_trigger = "(Note"
+
+    def answer_complete(self, thinking_budget, text):
+        # With thinking, the answer ends at the first "\n\n(Note" after </think>
+        if thinking_budget == 0:
+            return False
+        think_end = text.find(self.think_end_tag)
+        if text.find(self.think_start_tag) == -1 or think_end == -1:
+            return False
+        after_think_end = text[think_end + len(self.think_end_tag) :]
+        start_pos = after_think_end.find("\n\n")
+        if start_pos == -1:
+            return False
+        return after_think_end.find("\n\n(Note", start_pos + 2) != -1
+
+    def split_token_ids(
+        self, thinking_budget, prompt_ids, new_ids, think_start_id, think_end_id
+    ):
+        if thinking_budget == 0:
+            # The first "assistant\n\n" is the header that opens the generation
+            return [], new_ids
+        return super().split_token_ids(
+            thinking_budget, prompt_ids, new_ids, think_start_id, think_end_id
+        )
+
+    def response_from_answer(self, thinking_budget, answer_text):
+        if thinking_budget == 0:
+            return answer_text.strip()
+        return self.response_after_think_end(answer_text)
+
+    @staticmethod
+    def response_after_think_end(after_think_end):
+        # Find content between "\n\n" after </think> and the next "\n\n(Note"
+        start_marker = "\n\n"
+        start_pos = after_think_end.find(start_marker)
+
+        if start_pos != -1:
+            content_start = start_pos + len(start_marker)
+            end_pos = after_think_end.find("\n\n(Note", content_start)
+            if end_pos != -1:
+                return after_think_end[content_start:end_pos].strip()
+            # If no ending "\n\n(Note" found, take everything after the start marker
+            return after_think_end[content_start:].strip()
+        # Fallback: if no "\n\n" found after </think>, take everything after </think>
+        return after_think_end.strip()
+
+    def extract_thinking_and_response(self, thinking_budget, text):
+        """
+        Extract thinking content and response from generated text
+        """
+        thinking_content = ""
+        response_content = ""
+
+        if thinking_budget == 0:
+            # For budget=0, take everything after "assistant\n\n"
+            start_marker = "assistant\n\n"
+            start_pos = text.find(start_marker)
+
+            if start_pos != -1:
+                response_content = text[start_pos + len(start_marker) :].strip()
+            else:
+                # Fallback: if no "assistant\n\n" found, return the whole text
+                response_content = text.strip()
+        else:
+            # For budget>0, use thinking tags
+            think_start = text.find(self.think_start_tag)
+            think_end = text.find(self.think_end_tag)
+
+            if think_start != -1 and think_end != -1:
+                thinking_content = text[
+                    think_start + len(self.think_start_tag) : think_end
+                ].strip()
+
+                response_content = self.response_after_think_end(
+                    text[think_end + len(self.think_end_tag) :]
+                )
+            else:
+                response_content = text.strip()
+
+        return thinking_content, response_content
+
+
+class DrtFamily(ModelFamily):
+    name = "drt"
+    think_start_tag = "<thought>"
+    think_end_tag = "</thought>"
+    compile_model = True
+
+    def chat_template_kwargs(self, thinking_budget):
+        return {}
+
+    def uses_budget_processor(self, thinking_budget):
+        # DRT always thinks, a budget of 0 simply leaves it unconstrained
+        return True
+
+    stop_trigger = "</output>"
+    markers_in_generation = True
+
+    def split_token_ids(
+        self, thinking_budget, prompt_ids, new_ids, think_start_id, think_end_id
+    ):
+        # The answer sits in <output> tags that are not single tokens, the
+        # string extraction runs on the generated text instead
+        return None
+
+    def answer_complete(self, thinking_budget, text):
+        # Everything after the first </output> is discarded
+        return all(
+            text.find(tag) != -1
+            for tag in (self.think_start_tag, self.think_end_tag, "<output>", "</output>")
+        )
+
+    def extract_thinking_and_response(self, thinking_budget, text):
+        """
+        Extract thinking content and response from generated text
+        """
+        thinking_content = ""
+        response_content = ""
+
+        think_start = text.find(self.think_start_tag)
+        think_end = text.find(self.think_end_tag)
+
+        # Find output tags
+        output_start = text.find("<output>")
+        output_end = text.find("</output>")
+
+        if think_start != -1 and think_end != -1 and output_start != -1 and output_end != -1:
+            thinking_content = text[
+                think_start + len(self.think_start_tag) : think_end
+            ].strip()
+            response_content = text[output_start + len("<output>") : output_end].strip()
+        else:
+            response_content = text.strip()
+
+        return thinking_content, response_content
+
+
+MODEL_FAMILIES = {
+    family.name: family for family in (QwenFamily(), CogitoFamily(), DrtFamily())
+}
+
+
+def single_token_id(tokenizer, text):
+    """
+    The id of ``text`` if it is a single token, else None
+    """
+    ids = tokenizer.encode(text, add_special_tokens=False)
+    return ids[0] if len(ids) == 1 else None
+
+
+_think_tag_ids = {}
+
+
+def think_tag_ids(tokenizer, family):
+    """
+    ``(start id, end id)`` of the family's think tags, None for a tag that
+    is not a single token
+    """
+    key = (id(tokenizer), family.name)
+    if key not in _think_tag_ids:
+        _think_tag_ids[key] = (
+            single_token_id(tokenizer, family.think_start_tag),
+            single_token_id(tokenizer, family.think_end_tag),
+        )
+    return _think_tag_ids[key]
+
+
+def extract_from_ids(tokenizer, family, thinking_budget, prompt_ids, new_ids):
+    """
+    Thinking and response of one generation, from its token ids.
+
+    Where the family can split the ids at its think tags, each span is
+    decoded once and the prompt is never decoded. Otherwise this falls back
+    to extract_thinking_and_response on the decoded text.
+    """
+    spans = family.split_token_ids(
+        thinking_budget, prompt_ids, new_ids, *think_tag_ids(tokenizer, family)
+    )
+    if spans is not None:
+        thinking_ids, answer_ids = spans
+        thinking_content = tokenizer.decode(thinking_ids, skip_special_tokens=True).strip()
+        response_content = family.response_from_answer(
+            thinking_budget, tokenizer.decode(answer_ids, skip_special_tokens=True)
+        )
+        return thinking_content, response_content
+
+    ids = new_ids if family.markers_in_generation else prompt_ids + new_ids
+    return family.extract_thinking_and_response(
+        thinking_budget, tokenizer.decode(ids, skip_special_tokens=True)
+    )
+
+
+class Generation:
+    """
+    One generated row: its prompt ids without padding, the new token ids
+    and the TokenAccounting counts (None when they are unavailable)
+    """
+
+    def __init__(self, prompt_ids, new_ids, token_stats=None):
+        self.prompt_ids = prompt_ids
+        self.new_ids = new_ids
+        self.token_stats = token_stats
+
+
+class TokenAccounting:
+    """
+    Counts prompt, thinking and answer tokens of a generation from its
+    token ids, so thinking_length is what was actually decoded rather than
+    a re-tokenization of the extracted reasoning text.
+
+    Thinking tokens are those strictly between the family's think tags;
+    a generation cut off before the end tag counts everything after the
+    start tag. Only works for tags that are single tokens, ``enabled`` is
+    False otherwise.
+    """
+
+    def __init__(self, tokenizer, family, model=None):
+        self.think_start_id, self.think_end_id = think_tag_ids(tokenizer, family)
+
+        eos_token_id = model.generation_config.eos_token_id if model is not None else None
+        if eos_token_id is None:
+            eos_token_id = tokenizer.eos_token_id
+        eos_token_ids = eos_token_id if isinstance(eos_token_id, list) else [eos_token_id]
+        # EOS and the padding after it are not part of the answer
+        self.trailing_ids = {tokenizer.pad_token_id, *eos_token_ids}
+
+    @property
+    def enabled(self):
+        return self.think_start_id is not None and self.think_end_id is not None
+
+    def count(self, new_ids, prompt_length, wait_inserted=False):
+        """
+        Token counts of one row from its generated ids (prompt excluded)
+        """
+        end = len(new_ids)
+        while end and new_ids[end - 1] in self.trailing_ids:
+            end -= 1
+        new_ids = new_ids[:end]
+
+        start_pos = new_ids.index(self.think_start_id) if self.think_start_id in new_ids else -1
+        try:
+            end_pos = new_ids.index(self.think_end_id, start_pos + 1)
+        except ValueError:
+            end_pos = -1
+
+        if end_pos != -1:
+            thinking_length = end_pos - start_pos - 1
+            answer_length = len(new_ids) - end_pos - 1
+        elif start_pos != -1:
+            thinking_length = len(new_ids) - start_pos - 1
+            answer_length = 0
+        else:
+            thinking_length = 0
+            answer_length = len(new_ids)
+
+        return {
+            "thinking_length": thinking_length,
+            "prompt_length": prompt_length,
+            "answer_length": answer_length,
+            "wait_inserted": bool(wait_inserted),
+        }
+
+
+class AnswerCompleteCriteria(StoppingCriteria):
+    """
+    Stop every row as soon as its family's answer can no longer change.
+
+    Each step only the newest ``window`` tokens are decoded and checked for
+    the family's stop trigger; the whole row is decoded only on a hit.
+    Counts the rows it stopped and how many new tokens they had so far.
+    """
+
+    def __init__(self, tokenizer, family, thinking_budget, prompt_length, window=16):
+        self.tokenizer = tokenizer
+        self.family = family
+        self.thinking_budget = thinking_budget
+        self.prompt_length = prompt_length
+        self.window = window
+        # Rows that already ended on EOS are padded, they were not stopped by us
+        self.special_ids = set(tokenizer.all_special_ids)
+        self.stopped = set()
+        self.stopped_at = []
+
+    @property
+    def enabled(self):
+        return self.family.stop_trigger is not None
+
+    def tail_has_trigger(self, tail_ids):
+        tail = self.tokenizer.decode(tail_ids, skip_special_tokens=True)
+        return self.family.stop_trigger in tail
+
+    def row_complete(self, token_ids):
+        text = self.tokenizer.decode(token_ids, skip_special_tokens=True)
+        return self.family.answer_complete(self.thinking_budget, text)
+
+    def complete_rows(self, rows):
+        """
+        Check several rows given as (prompt length, prompt plus new token
+        ids), decoding all their tails in one batch
+        """
+        tails = [
+            token_ids[max(prompt_length, len(token_ids) - self.window) :]
+            for prompt_length, token_ids in rows
+        ]
+        texts = self.tokenizer.batch_decode(tails, skip_special_tokens=True)
+        return [
+            self.family.stop_trigger in text and self.row_complete(token_ids)
+            for text, (_, token_ids) in zip(texts, rows)
+        ]
+
+    def is_complete(self, token_ids):
+        """
+        Check one row given as a list of prompt plus new token ids
+        """
+        tail_start = max(self.prompt_length, len(token_ids) - self.window)
+        return self.tail_has_trigger(token_ids[tail_start:]) and self.row_complete(token_ids)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        # One device-to-host copy of every row's window per step; a full row
+        # is only copied when its window holds the stop trigger
+        tail_start = max(self.prompt_length, input_ids.shape[1] - self.window)
+        tails = input_ids[:, tail_start:].tolist()
+        done = [False] * len(tails)
+        for row, tail_ids in enumerate(tails):
+            if row in self.stopped:
+                done[row] = True
+            elif not tail_ids or tail_ids[-1] in self.special_ids:
+                continue
+            elif self.tail_has_trigger(tail_ids) and self.row_complete(input_ids[row].tolist()):
+                done[row] = True
+                self.stopped.add(row)
+                self.stopped_at.append(input_ids.shape[1] - self.prompt_length)
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+class EarlyStopStats:
+    """
+    Per-run tally of rows ended by AnswerCompleteCriteria
+    """
+
+    def __init__(self, max_new_tokens):
+        self.max_new_tokens = max_new_tokens
+        self.rows = 0
+        self.stopped = 0
+        self.tokens_saved = 0
+
+    def update(self, rows, stopped_at):
+        self.rows += rows
+        self.stopped += len(stopped_at)
+        self.tokens_saved += sum(self.max_new_tokens - n for n in stopped_at)
+
+    def report(self, label):
+        if not self.stopped:
+            return
+        print(
+            f"Early stop ({label}): {self.stopped}/{self.rows} generations ended after "
+            f"their answer, up to {self.tokens_saved} tokens not decoded "
+            f"(counted against max_new_tokens={self.max_new_tokens})"
+        )
+
+
+def load_model(model_name, family, device_map):
+    """
+    Load the tokenizer and model once, configured for left-padded batches
+    """
+    print(f"Loading model: {model_name}")
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    # Batched generation needs left padding so every row ends at the last column
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    # Determine device configuration
+    if device_map:
+        print(f"Using device_map: {device_map}")
+    else:
+        print(f"Using device: {'GPU' if torch.cuda.is_available() else 'CPU'}")
+
+    model = AutoModelForCausalLM.from_pretrained(
+        model_name, torch_dtype="auto", device_map="auto"
+    )
+    if family.compile_model:
+        model = torch.compile(model)
+    model.eval()
+
+    return tokenizer, model
+
+
+def build_sampling_kwargs(temperature=None, top_p=None, do_sample=None):
+    """
+    Sampling arguments for model.generate; anything left as None keeps the
+    checkpoint's generation_config
+    """
+    if do_sample is False:
+        return {"do_sample": False}
+
+    sampling_kwargs = {}
+    if do_sample is not None:
+        sampling_kwargs["do_sample"] = do_sample
+    if temperature is not None:
+        sampling_kwargs["temperature"] = temperature
+    if top_p is not None:
+        sampling_kwargs["top_p"] = top_p
+    return sampling_kwargs
+
+
+def chat_prompts(tokenizer, family, batch_messages, thinking_budget):
+    """
+    Render conversations with the chat template, ready for generation
+    """
+    return [
+        family.chat_prompt(tokenizer, messages, thinking_budget)
+        for messages in batch_messages
+    ]
+
+
+def generate_batch(
+    model,
+    tokenizer,
+    family,
+    batch_messages,
+    thinking_budget,
+    max_new_tokens,
+    enable_wait_insertion,
+    temperature=None,
+    top_p=None,
+    do_sample=None,
+    early_stop_stats=None,
+):
+    """
+    Generate for a left-padded batch of conversations and return one
+    Generation per row; nothing is decoded here
+    """
+    texts = chat_prompts(tokenizer, family, batch_messages, thinking_budget)
+    model_inputs = tokenizer(texts, return_tensors="pt", padding=True).to(
+        model.device
+    )
+
+    generate_kwargs = build_sampling_kwargs(temperature, top_p, do_sample)
+    processor = None
+    if family.uses_budget_processor(thinking_budget):
+        processor = ThinkingTokenBudgetProcessor(
+            tokenizer,
+            max_thinking_tokens=thinking_budget,
+            enable_wait_insertion=enable_wait_insertion,
+            think_start_tag=family.think_start_tag,
+            think_end_tag=family.think_end_tag,
+        )
+        generate_kwargs["logits_processor"] = [processor]
+
+    # Stop decoding text the family's extraction would throw away
+    criteria = AnswerCompleteCriteria(
+        tokenizer, family, thinking_budget, model_inputs["input_ids"].shape[1]
+    )
+    if criteria.enabled:
+        generate_kwargs["stopping_criteria"] = [criteria]
+
+    with torch.no_grad():
+        generated_ids = model.generate(
+            **model_inputs,
+            max_new_tokens=max_new_tokens,
+            pad_token_id=tokenizer.pad_token_id,
+            **generate_kwargs,
+        )
+
+    if early_stop_stats is not None:
+        early_stop_stats.update(len(batch_messages), criteria.stopped_at)
+
+    input_length = model_inputs["input_ids"].shape[1]
+    prompt_lengths = model_inputs["attention_mask"].sum(dim=1).tolist()
+    prompt_ids = [
+        row[input_length - prompt_length : input_length]
+        for row, prompt_length in zip(model_inputs["input_ids"].tolist(), prompt_lengths)
+    ]
+    new_ids = generated_ids[:, input_length:].tolist()
+
+    accounting = TokenAccounting(tokenizer, family, model)
+    token_stats = [None] * len(batch_messages)
+    if accounting.enabled:
+        if processor is not None and processor.wait_inserted is not None:
+            wait_inserted = processor.wait_inserted.tolist()
+        else:
+            wait_inserted = [False] * len(batch_messages)
+        token_stats = [
+            accounting.count(row_ids, prompt_length, wait)
+            for row_ids, prompt_length, wait in zip(new_ids, prompt_lengths, wait_inserted)
+        ]
+
+    return [
+        Generation(row_prompt_ids, row_new_ids, stats)
+        for row_prompt_ids, row_new_ids, stats in zip(prompt_ids, new_ids, token_stats)
+    ]
+
+
+def build_output_record(
+    tokenizer,
+    family,
+    model_name,
+    thinking_budget,
+    src_lang,
+    tgt_lang,
+    src_text,
+    tgt_text,
+    generation,
+):
+    """
+    Turn one Generation into an output JSONL record. all_generated_text
+    holds the generated text only, without the prompt.
+    """
+    # Extract thinking and response
+    reasoning_content, answer_content = extract_from_ids(
+        tokenizer, family, thinking_budget, generation.prompt_ids, generation.new_ids
+    )
+    generated_text = tokenizer.decode(generation.new_ids, skip_special_tokens=True)
+
+    token_stats = generation.token_stats
+    if token_stats is None:
+        # Calculate thinking length
+        token_stats = {
+            "thinking_length": tokenizer(reasoning_content, return_length=True)["length"][0]
+        }
+
+    return {
+        "model": model_name,
+        "thinking_budget": thinking_budget,
+        **token_stats,
+        "src_lang": src_lang,
+        "tgt_lang": tgt_lang,
+        "src_text": src_text,
+        "tgt_text": tgt_text,
+        "hyp_text": answer_content,
+        "reasoning": reasoning_content,
+        "all_generated_text": generated_text,
+    }
+
+
+def translate_dir(
+    backend,
+    family,
+    build_request,
+    input_dir,
+    output_dir,
+    model_name,
+    thinking_budget,
+    max_new_tokens,
+    seed,
+    enable_wait_insertion,
+    temperature=None,
+    top_p=None,
+    batch_size=1,
+    do_sample=None,
+):
+    """
+    Translate every <src>-<tgt>.jsonl file in input_dir with an inference
+    backend around an already loaded model.
+
+    ``build_request(task, item, src_lang, tgt_lang)`` turns an input line into
+    ``(src_text, tgt_text, messages)``; lines with an empty ``src_text`` are
+    skipped. Output files are appended to and resumed through their
+    ResumeIndex sidecar.
+    """
+    tokenizer = backend.tokenizer
+    # Reseed per directory so a cell gives the same output alone or in a sweep
+    torch.manual_seed(seed)
+    if torch.cuda.is_available():
+        torch.cuda.manual_seed(seed)
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    task = input_dir.split("/")[-1]
+    for filename in os.listdir(input_dir):
+        if not filename.endswith(".jsonl"):
+            continue
+
+        src_lang, tgt_lang = filename.replace(".jsonl", "").split("-")
+        input_file = os.path.join(input_dir, filename)
+        output_file = os.path.join(output_dir, filename)
+
+        resume_index = ResumeIndex(output_file, input_file)
+        total_lines = resume_index.input_lines
+        early_stop_stats = EarlyStopStats(max_new_tokens)
+
+        with JsonlWriter(output_file, mode="a") as fout:
+            progress_bar = tqdm(
+                iter_jsonl(input_file),
+                total=total_lines,
+                desc=f"Translating {filename}",
+                unit="examples",
+            )
+
+            def flush(pending):
+                try:
+                    generations = backend.generate(
+                        family,
+                        [messages for _, _, messages in pending],
+                        thinking_budget,
+                        max_new_tokens,
+                        enable_wait_insertion,
+                        temperature=temperature,
+                        top_p=top_p,
+                        do_sample=do_sample,
+                        early_stop_stats=early_stop_stats,
+                    )
+                except Exception as e:
+                    print("=" * 30)
+                    print(f"Skipping batch of {len(pending)} due to error: {e}")
+                    for src_text, _, _ in pending:
+                        print(f"src_text: {src_text}")
+                    print("=" * 30)
+                    return
+
+                for (src_text, tgt_text, _), generation in zip(pending, generations):
+                    output = build_output_record(
+                        tokenizer,
+                        family,
+                        model_name,
+                        thinking_budget,
+                        src_lang,
+                        tgt_lang,
+                        src_text,
+                        tgt_text,
+                        generation,
+                    )
+                    fout.write(output)
+                fout.flush()  # Ensure data is written immediately
+                resume_index.add_all(
+                    (src_lang, tgt_lang, src_text) for src_text, _, _ in pending
+                )
+
+            pending = []
+            for item in progress_bar:
+                src_text, tgt_text, messages = build_request(
+                    task, item, src_lang, tgt_lang
+                )
+                if not src_text or (src_lang, tgt_lang, src_text) in resume_index:
+                    continue
+
+                pending.append((src_text, tgt_text, messages))
+                if len(pending) >= batch_size:
+                    flush(pending)
+                    pending = []
+
+            if pending:
+                flush(pending)
+
+        early_stop_stats.report(filename)
+        print(f"✔ Translated {filename} → saved to {output_file}")
+
+
+def translate_grid(
+    family,
+    build_request,
+    model_name,
+    cells,
+    max_new_tokens,
+    seed,
+    device_map,
+    enable_wait_insertion,
+    batch_size=1,
+    do_sample=None,
+    backend="hf",
+    backend_options=None,
+):
+    """
+    Load the model once and run translate_dir for every cell of a sweep.
+
+    Each cell is a dict with ``input_dir``, ``output_dir``, ``thinking_budget``,
+    ``temperature`` and ``top_p``. Cells resume independently from their own
+    output files, so an interrupted sweep can simply be relaunched.
+    ``backend`` names one of backends.BACKENDS, built with ``backend_options``.
+    """
+    # backends builds on this module, import it only once it is loaded
+    from backends import build_backend
+
+    tokenizer, model = load_model(model_name, family, device_map)
+    backend = build_backend(backend, tokenizer, model, **(backend_options or {}))
+
+    for i, cell in enumerate(cells):
+        print(
+            f"[{i + 1}/{len(cells)}] budget={cell['thinking_budget']} "
+            f"{cell['input_dir']} → {cell['output_dir']}"
+        )
+        translate_dir(
+            backend,
+            family,
+            build_request,
+            cell["input_dir"],
+            cell["output_dir"],
+            model_name,
+            cell["thinking_budget"],
+            max_new_tokens,
+            seed,
+            enable_wait_insertion,
+            temperature=cell.get("temperature"),
+            top_p=cell.get("top_p"),
+            batch_size=batch_size,
+            do_sample=do_sample,
+        )
+
+
+def translate_dataset(
+    family,
+    build_request,
+    input_dir,
+    output_dir,
+    model_name,
+    thinking_budget,
+    max_new_tokens,
+    seed,
+    device_map,
+    enable_wait_insertion,
+    temperature=None,
+    top_p=None,
+    batch_size=1,
+    backend="hf",
+    backend_options=None,
+):
+    """
+    Translate dataset using local model inference
+    """
+    cell = {
+        "input_dir": input_dir,
+        "output_dir": output_dir,
+        "thinking_budget": thinking_budget,
+        "temperature": temperature,
+        "top_p": top_p,
+    }
+    translate_grid(
+        family,
+        build_request,
+        model_name,
+        [cell],
+        max_new_tokens,
+        seed,
+        device_map,
+        enable_wait_insertion,
+        batch_size=batch_size,
+        backend=backend,
+        backend_options=backend_options,
+    )
+
+
+def budget_output_dir(output_root, dataset_name, model_name, thinking_budget):
+    """
+    Output directory of one sweep cell, the same layout the SLURM templates use
+    """
+    return os.path.join(
+        output_root,
+        dataset_name,
+        os.path.basename(model_name),
+        f"budget_{thinking_budget}",
+    )
+
+
+def build_translation_request(task, item, src_lang, tgt_lang, add_doc_for_ragtrans):
+    """
+    Build the chat messages for one source sentence
+    """
+    src_text = item.get(f"{src_lang}_text", "").strip()
+    tgt_text = item.get(f"{tgt_lang}_text", "")
+    src_lang_name = LANG_CODE_TO_NAME[src_lang]
+    tgt_lang_name = LANG_CODE_TO_NAME[tgt_lang]
+    if task == "RAGtrans":
+        if add_doc_for_ragtrans:
+            sys_prompt = f"You are a professional translator, and your task is to translate an given input sentence from {src_lang_name} to {tgt_lang_name}. In addition to the input sentence, you will be provided with a document that may contain relevant information to aid in the translation. However, be aware that some documents may contain irrelevant or noisy information."
+            doc = item.get("doc", "")
+            prompt = f"<document>\n{doc}\n<document>\nTranslate the following text from {src_lang_name} to {tgt_lang_name}\n{src_lang_name}: {src_text}\n{tgt_lang_name}: "
+        else:
+            sys_prompt = f"You are a professional translator, and your task is to translate an given input sentence from {src_lang_name} to {tgt_lang_name}."
+            prompt = f"Translate the following text from {src_lang_name} to {tgt_lang_name}\n{src_lang_name}: {src_text}\n{tgt_lang_name}: "
+        messages = [
+            {"role": "system", "content": sys_prompt},
+            {"role": "user", "content": prompt},
+        ]
+    else:
+        prompt = f"Translate the following text from {src_lang_name} to {tgt_lang_name}\n{src_lang_name}: {src_text}\n{tgt_lang_name}: "
+        messages = [{"role": "user", "content": prompt}]
+    return src_text, tgt_text, messages
+
+
+def parse_device_map(device_map):
+    """
+    Parse a custom device_map given as a string representation of a dict
+    """
+    if device_map and device_map not in [
+        "auto",
+        "balanced",
+        "balanced_low_0",
+        "sequential",
+    ]:
+        try:
+            # Try to parse as JSON for custom device mapping
+            import ast
+
+            return ast.literal_eval(device_map)
+        except:
+            # If parsing fails, use as string
+            pass
+    return device_map
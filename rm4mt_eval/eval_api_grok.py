@@ -1,11 +1,17 @@
 import os
 import json
+import time
+import asyncio
 import argparse
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 from dotenv import load_dotenv
 from tqdm import tqdm
 import httpx
 
+from api_client import AsyncChatClient, StreamRecorder, usage_lengths
+from jsonl_io import JsonlWriter, iter_jsonl, loads
+from resume_index import ResumeIndex
+
 load_dotenv()
 
 LANG_CODE_TO_NAME = {
@@ -24,81 +30,158 @@ LANG_CODE_TO_NAME = {
 }
 
 
-def translate_dataset(input_dir, output_dir, model_name, base_url, api_key, extra_body):
-    client = OpenAI(api_key=api_key, base_url=base_url, timeout=httpx.Timeout(3600.0))
+def build_messages(task, item, src_lang, tgt_lang):
+    """
+    Build the chat messages for one source sentence
+    """
+    src_text = item.get(f"{src_lang}_text", "").strip()
+    tgt_text = item.get(f"{tgt_lang}_text", "")
+    src_lang_name = LANG_CODE_TO_NAME[src_lang]
+    tgt_lang_name = LANG_CODE_TO_NAME[tgt_lang]
+    if task == "RAGtrans":
+        sys_prompt = f"You are a professional translator, and your task is to translate an given input sentence from {src_lang_name} to {tgt_lang_name}. In addition to the input sentence, you will be provided with a document that may contain relevant information to aid in the translation. However, be aware that some documents may contain irrelevant or noisy information."
+        doc = item.get("doc", "")
+        prompt = f"<document>\n{doc}\n<document>\nTranslate the following text from {src_lang_name} to {tgt_lang_name}\nPlease only provide me with the translated content, without any additional explanations\n{src_lang_name}: {src_text}\n{tgt_lang_name}: "
+        messages = [
+            {"role": "system", "content": sys_prompt},
+            {"role": "user", "content": prompt},
+        ]
+    else:
+        prompt = f"Translate the following text from {src_lang_name} to {tgt_lang_name}\nPlease only provide me with the translated content, without any additional explanations\n{src_lang_name}: {src_text}\n{tgt_lang_name}: "
+        messages = [{"role": "user", "content": prompt}]
+    return src_text, tgt_text, messages
 
-    os.makedirs(output_dir, exist_ok=True)
 
-    task = input_dir.split("/")[-1]
+def build_output(
+    model_name, extra_body, src_lang, tgt_lang, src_text, tgt_text, hyp_text, reasoning, stats
+):
+    """
+    Output JSONL record of one translated sentence; ``stats`` holds its
+    token counts and, when streamed, its timings
+    """
+    return {
+        "model": model_name,
+        "reasoning_effort": extra_body.get("reasoning_effort", "low"),
+        **stats,
+        "src_lang": src_lang,
+        "tgt_lang": tgt_lang,
+        "src_text": src_text,
+        "tgt_text": tgt_text,
+        "hyp_text": hyp_text,
+        "reasoning": reasoning,
+    }
+
+
+def completion_output(model_name, extra_body, src_lang, tgt_lang, src_text, tgt_text, completion):
+    """
+    Output record of a chat completion object
+    """
+    message = completion.choices[0].message
+    return build_output(
+        model_name,
+        extra_body,
+        src_lang,
+        tgt_lang,
+        src_text,
+        tgt_text,
+        message.content,
+        getattr(message, "reasoning_content", None),
+        usage_lengths(completion.usage),
+    )
+
+
+def stream_completion(client, **kwargs):
+    """
+    Stream one chat completion; returns StreamRecorder.finish() of it
+    """
+    recorder = StreamRecorder()
+    stream = client.chat.completions.create(
+        stream=True, stream_options={"include_usage": True}, **kwargs
+    )
+    for chunk in stream:
+        recorder.add(chunk)
+    return recorder.finish()
+
+
+def iter_files(input_dir, output_dir):
+    """
+    Yield ``(filename, src_lang, tgt_lang, input_file, output_file)`` for every
+    <src>-<tgt>.jsonl file in input_dir
+    """
+    os.makedirs(output_dir, exist_ok=True)
     for filename in os.listdir(input_dir):
         if not filename.endswith(".jsonl"):
             continue
-
         src_lang, tgt_lang = filename.replace(".jsonl", "").split("-")
-        input_file = os.path.join(input_dir, filename)
-        output_file = os.path.join(output_dir, filename)
-
-        already_translated = set()
-        if os.path.exists(output_file):
-            with open(output_file, "r", encoding="utf-8") as fdone:
-                for line in fdone:
-                    try:
-                        obj = json.loads(line)
-                        already_translated.add(obj.get("src_text", "").strip())
-                    except Exception:
-                        continue
-
-        with open(input_file, "r", encoding="utf-8") as fin:
-            total_lines = sum(1 for _ in fin)
-        with open(input_file, "r", encoding="utf-8") as fin, open(
-            output_file, "a", encoding="utf-8"
-        ) as fout:
+        yield (
+            filename,
+            src_lang,
+            tgt_lang,
+            os.path.join(input_dir, filename),
+            os.path.join(output_dir, filename),
+        )
+
+
+def translate_dataset(
+    input_dir,
+    output_dir,
+    model_name,
+    base_url,
+    api_key,
+    extra_body,
+    timeout=3600.0,
+    stream=False,
+):
+    client = OpenAI(api_key=api_key, base_url=base_url, timeout=httpx.Timeout(timeout))
+
+    task = input_dir.split("/")[-1]
+    for filename, src_lang, tgt_lang, input_file, output_file in iter_files(
+        input_dir, output_dir
+    ):
+        resume_index = ResumeIndex(output_file, input_file)
+        total_lines = resume_index.input_lines
+
+        with JsonlWriter(output_file, mode="a") as fout:
             progress_bar = tqdm(
-                fin, total=total_lines, desc=f"Translating {filename}", unit="examples"
+                iter_jsonl(input_file),
+                total=total_lines,
+                desc=f"Translating {filename}",
+                unit="examples",
             )
 
-            for line in progress_bar:
-                item = json.loads(line)
-                src_text = item.get(f"{src_lang}_text", "").strip()
-                if not src_text or src_text in already_translated:
+            for item in progress_bar:
+                src_text, tgt_text, messages = build_messages(task, item, src_lang, tgt_lang)
+                if not src_text or (src_lang, tgt_lang, src_text) in resume_index:
                     continue
 
-                src_lang_name = LANG_CODE_TO_NAME[src_lang]
-                tgt_lang_name = LANG_CODE_TO_NAME[tgt_lang]
-                if task == "RAGtrans":
-                    sys_prompt = f"You are a professional translator, and your task is to translate an given input sentence from {src_lang_name} to {tgt_lang_name}. In addition to the input sentence, you will be provided with a document that may contain relevant information to aid in the translation. However, be aware that some documents may contain irrelevant or noisy information."
-                    doc = item.get("doc", "")
-                    prompt = f"<document>\n{doc}\n<document>\nTranslate the following text from {src_lang_name} to {tgt_lang_name}\nPlease only provide me with the translated content, without any additional explanations\n{src_lang_name}: {src_text}\n{tgt_lang_name}: "
-                    messages = [
-                        {"role": "system", "content": sys_prompt},
-                        {"role": "user", "content": prompt},
-                    ]
-                else:
-                    prompt = f"Translate the following text from {src_lang_name} to {tgt_lang_name}\nPlease only provide me with the translated content, without any additional explanations\n{src_lang_name}: {src_text}\n{tgt_lang_name}: "
-                    messages = [{"role": "user", "content": prompt}]
-
                 try:
-                    completion = client.chat.completions.create(
-                        model=model_name,
-                        messages=messages,
-                        extra_body=extra_body,
-                    )
-
-                    reasoning_content = completion.choices[0].message.reasoning_content
-                    answer_content = completion.choices[0].message.content
-
-                    output = {
-                        "model": model_name,
-                        "reasoning_effort": extra_body.get("reasoning_effort", "low"),
-                        "src_lang": src_lang,
-                        "tgt_lang": tgt_lang,
-                        "src_text": src_text,
-                        "tgt_text": item.get(f"{tgt_lang}_text", ""),
-                        "hyp_text": answer_content,
-                        "reasoning": reasoning_content,
-                    }
-                    fout.write(json.dumps(output, ensure_ascii=False) + "\n")
+                    if stream:
+                        hyp_text, reasoning, stats = stream_completion(
+                            client, model=model_name, messages=messages, extra_body=extra_body
+                        )
+                        output = build_output(
+                            model_name,
+                            extra_body,
+                            src_lang,
+                            tgt_lang,
+                            src_text,
+                            tgt_text,
+                            hyp_text,
+                            reasoning,
+                            stats,
+                        )
+                    else:
+                        completion = client.chat.completions.create(
+                            model=model_name,
+                            messages=messages,
+                            extra_body=extra_body,
+                        )
+                        output = completion_output(
+                            model_name, extra_body, src_lang, tgt_lang, src_text, tgt_text, completion
+                        )
+                    fout.write(output)
                     fout.flush()  # Ensure data is written immediately
+                    resume_index.add(src_lang, tgt_lang, src_text)
 
                 except Exception as e:
                     print("=" * 30)
@@ -110,6 +193,311 @@ def translate_dataset(input_dir, output_dir, model_name, base_url, api_key, extr
         print(f"✔ Translated {filename} → saved to {output_file}")
 
 
+async def translate_file_async(
+    chat,
+    model_name,
+    extra_body,
+    task,
+    src_lang,
+    tgt_lang,
+    input_file,
+    output_file,
+    max_in_flight,
+    stream=False,
+):
+    """
+    Translate one file with up to ``max_in_flight`` concurrent requests.
+
+    Completions are written in input order: a finished request waits in a
+    reorder buffer until every earlier one is written or skipped, and no
+    request starts more than a few windows ahead of the oldest unwritten
+    one, so a single slow request cannot grow the buffer without bound.
+    """
+    resume_index = ResumeIndex(output_file, input_file)
+    jobs = []
+    for item in iter_jsonl(input_file):
+        src_text, tgt_text, messages = build_messages(task, item, src_lang, tgt_lang)
+        if src_text and (src_lang, tgt_lang, src_text) not in resume_index:
+            jobs.append((src_text, tgt_text, messages))
+
+    window = 4 * max_in_flight
+    next_job = 0
+    next_write = 0
+    done = {}
+    ready = asyncio.Condition()
+    progress_bar = tqdm(
+        total=len(jobs), desc=f"Translating {os.path.basename(input_file)}", unit="examples"
+    )
+
+    with JsonlWriter(output_file, mode="a") as fout:
+
+        def write_ready():
+            nonlocal next_write
+            while next_write in done:
+                output = done.pop(next_write)
+                if output is not None:
+                    fout.write(output)
+                    fout.flush()  # Ensure data is written immediately
+                    resume_index.add(src_lang, tgt_lang, output["src_text"])
+                next_write += 1
+                progress_bar.update(1)
+
+        async def worker():
+            nonlocal next_job
+            while next_job < len(jobs):
+                index = next_job
+                next_job += 1
+                async with ready:
+                    await ready.wait_for(lambda: index < next_write + window)
+
+                src_text, tgt_text, messages = jobs[index]
+                output = None
+                try:
+                    if stream:
+                        hyp_text, reasoning, stats = await chat.create_stream(
+                            messages, model=model_name, extra_body=extra_body
+                        )
+                        output = build_output(
+                            model_name,
+                            extra_body,
+                            src_lang,
+                            tgt_lang,
+                            src_text,
+                            tgt_text,
+                            hyp_text,
+                            reasoning,
+                            stats,
+                        )
+                    else:
+                        completion = await chat.create(
+                            messages, model=model_name, extra_body=extra_body
+                        )
+                        output = completion_output(
+                            model_name, extra_body, src_lang, tgt_lang, src_text, tgt_text, completion
+                        )
+                except Exception as e:
+                    # Left out of the output, the next run retries it
+                    print("=" * 30)
+                    print(f"Skipping due to error: {e}")
+                    print(f"src_text: {src_text}")
+                    print("=" * 30)
+
+                done[index] = output
+                async with ready:
+                    write_ready()
+                    ready.notify_all()
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(max_in_flight)))
+        finally:
+            progress_bar.close()
+
+
+async def translate_dataset_async(
+    input_dir,
+    output_dir,
+    model_name,
+    base_url,
+    api_key,
+    extra_body,
+    max_in_flight,
+    rpm=None,
+    tpm=None,
+    max_retries=6,
+    timeout=3600.0,
+    stream=False,
+):
+    """
+    translate_dataset with concurrent requests, see translate_file_async
+    """
+    # Retries are AsyncChatClient's job, with the endpoint's rate limits
+    client = AsyncOpenAI(
+        api_key=api_key, base_url=base_url, timeout=httpx.Timeout(timeout), max_retries=0
+    )
+    chat = AsyncChatClient(client, rpm=rpm, tpm=tpm, max_retries=max_retries)
+
+    task = input_dir.split("/")[-1]
+    for filename, src_lang, tgt_lang, input_file, output_file in iter_files(
+        input_dir, output_dir
+    ):
+        await translate_file_async(
+            chat,
+            model_name,
+            extra_body,
+            task,
+            src_lang,
+            tgt_lang,
+            input_file,
+            output_file,
+            max_in_flight,
+            stream=stream,
+        )
+        print(f"✔ Translated {filename} → saved to {output_file}")
+
+    if chat.retries:
+        print(f"Retried {chat.retries} requests after rate limits or transient errors")
+
+
+# Batch runs finished one way or another; only "completed" has results
+BATCH_DONE = ("completed", "failed", "expired", "cancelled")
+
+
+def batch_paths(batch_dir, filename):
+    """
+    The batch input file and the state file of one <src>-<tgt>.jsonl file
+    """
+    name = filename.replace(".jsonl", "")
+    return (
+        os.path.join(batch_dir, f"{name}.requests.jsonl"),
+        os.path.join(batch_dir, f"{name}.batch.json"),
+    )
+
+
+def prepare_batches(input_dir, output_dir, batch_dir, model_name, extra_body):
+    """
+    Write one batch input file per language pair with a chat completion
+    request for every sentence not yet in the output. Requests use the
+    OpenAI batch format, and their custom_id is ``<src>-<tgt>:<line>``
+    so collect_batches can find the input line again.
+    """
+    os.makedirs(batch_dir, exist_ok=True)
+    task = input_dir.split("/")[-1]
+    for filename, src_lang, tgt_lang, input_file, output_file in iter_files(
+        input_dir, output_dir
+    ):
+        resume_index = ResumeIndex(output_file, input_file)
+        requests_file, state_file = batch_paths(batch_dir, filename)
+        if os.path.exists(state_file):
+            print(f"Skipping {filename}: batch already submitted ({state_file})")
+            continue
+
+        count = 0
+        with JsonlWriter(requests_file) as fout:
+            for line, item in enumerate(iter_jsonl(input_file)):
+                src_text, _, messages = build_messages(task, item, src_lang, tgt_lang)
+                if not src_text or (src_lang, tgt_lang, src_text) in resume_index:
+                    continue
+                fout.write(
+                    {
+                        "custom_id": f"{src_lang}-{tgt_lang}:{line}",
+                        "method": "POST",
+                        "url": "/v1/chat/completions",
+                        "body": {"model": model_name, "messages": messages, **extra_body},
+                    }
+                )
+                count += 1
+        print(f"✔ Prepared {count} requests for {filename} → {requests_file}")
+
+
+def submit_batches(input_dir, batch_dir, client):
+    """
+    Upload every prepared batch input file and start its batch
+    """
+    for filename in sorted(os.listdir(input_dir)):
+        if not filename.endswith(".jsonl"):
+            continue
+        requests_file, state_file = batch_paths(batch_dir, filename)
+        if not os.path.exists(requests_file) or os.path.exists(state_file):
+            continue
+        if os.path.getsize(requests_file) == 0:
+            continue
+
+        with open(requests_file, "rb") as f:
+            input_file = client.files.create(file=f, purpose="batch")
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        with open(state_file, "w") as f:
+            json.dump({"batch_id": batch.id, "input_file_id": input_file.id}, f)
+        print(f"✔ Submitted {filename} as batch {batch.id}")
+
+
+def collect_batches(
+    input_dir, output_dir, batch_dir, client, model_name, extra_body, poll_interval=60.0
+):
+    """
+    Wait for the submitted batches and append their results to the usual
+    output files, in input order.
+
+    Lines whose request failed are reported and left out, so the next
+    prepare picks them up again. A batch that ended without results has
+    its state file removed for the same reason.
+    """
+    task = input_dir.split("/")[-1]
+    for filename, src_lang, tgt_lang, input_file, output_file in iter_files(
+        input_dir, output_dir
+    ):
+        requests_file, state_file = batch_paths(batch_dir, filename)
+        if not os.path.exists(state_file):
+            continue
+        with open(state_file) as f:
+            batch_id = json.load(f)["batch_id"]
+
+        batch = client.batches.retrieve(batch_id)
+        while batch.status not in BATCH_DONE:
+            print(f"Batch {batch_id} ({filename}) is {batch.status}, checking again in {poll_interval:.0f}s")
+            time.sleep(poll_interval)
+            batch = client.batches.retrieve(batch_id)
+
+        if batch.status != "completed" or batch.output_file_id is None:
+            print(f"Batch {batch_id} ({filename}) ended as {batch.status}, prepare it again")
+            os.remove(state_file)
+            continue
+
+        results = {}
+        failed = 0
+        content = client.files.content(batch.output_file_id).text
+        for raw in content.splitlines():
+            if not raw.strip():
+                continue
+            result = loads(raw)
+            response = result.get("response") or {}
+            if result.get("error") or response.get("status_code") != 200:
+                failed += 1
+                continue
+            line = int(result["custom_id"].rsplit(":", 1)[1])
+            results[line] = (
+                response["body"]["choices"][0]["message"],
+                response["body"].get("usage"),
+            )
+
+        resume_index = ResumeIndex(output_file, input_file)
+        written = []
+        with JsonlWriter(output_file, mode="a") as fout:
+            for line, item in enumerate(iter_jsonl(input_file)):
+                if line not in results:
+                    continue
+                src_text, tgt_text, _ = build_messages(task, item, src_lang, tgt_lang)
+                if (src_lang, tgt_lang, src_text) in resume_index:
+                    continue
+                message, usage = results[line]
+                fout.write(
+                    build_output(
+                        model_name,
+                        extra_body,
+                        src_lang,
+                        tgt_lang,
+                        src_text,
+                        tgt_text,
+                        message.get("content"),
+                        message.get("reasoning_content"),
+                        usage_lengths(usage),
+                    )
+                )
+                written.append((src_lang, tgt_lang, src_text))
+        # Index the records once the writer has flushed them all
+        resume_index.add_all(written)
+
+        os.remove(state_file)
+        os.remove(requests_file)
+        print(
+            f"✔ Collected {len(results)} results of batch {batch_id} → {output_file}"
+            + (f" ({failed} failed requests left for the next prepare)" if failed else "")
+        )
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--input_dir", required=True, help="Path to input .jsonl files")
@@ -120,18 +508,93 @@ if __name__ == "__main__":
     )
     parser.add_argument("--seed", type=int, default=42)
     parser.add_argument("--reasoning_effort", type=str, default="low")
+    parser.add_argument(
+        "--max_in_flight",
+        type=int,
+        default=1,
+        help="Concurrent requests; 1 sends them one after another",
+    )
+    parser.add_argument("--rpm", type=int, default=None, help="Requests per minute limit")
+    parser.add_argument("--tpm", type=int, default=None, help="Tokens per minute limit")
+    parser.add_argument(
+        "--max_retries",
+        type=int,
+        default=6,
+        help="Retries of a rate-limited or failed request with --max_in_flight > 1",
+    )
+    parser.add_argument("--timeout", type=float, default=3600.0, help="Request timeout in seconds")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream completions and record time to first (answer) token and latency",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=["direct", "prepare", "submit", "collect"],
+        default="direct",
+        help="direct: send chat completions now; prepare/submit/collect: go through the batch API",
+    )
+    parser.add_argument(
+        "--batch_dir",
+        default=None,
+        help="Batch input and state files (default: <output_dir>/batch)",
+    )
+    parser.add_argument(
+        "--poll_interval", type=float, default=60.0, help="Seconds between batch status checks"
+    )
     args = parser.parse_args()
 
     extra_body = {
         "seed": args.seed,
         "reasoning_effort": args.reasoning_effort,
     }
+    batch_dir = args.batch_dir or os.path.join(args.output_dir, "batch")
 
-    translate_dataset(
-        input_dir=args.input_dir,
-        output_dir=args.output_dir,
-        model_name=args.model,
-        base_url=args.base_url,
-        api_key=os.getenv("xAI_API_KEY"),
-        extra_body=extra_body,
-    )
+    if args.mode == "prepare":
+        prepare_batches(args.input_dir, args.output_dir, batch_dir, args.model, extra_body)
+    elif args.mode in ("submit", "collect"):
+        client = OpenAI(
+            api_key=os.getenv("xAI_API_KEY"),
+            base_url=args.base_url,
+            timeout=httpx.Timeout(args.timeout),
+        )
+        if args.mode == "submit":
+            submit_batches(args.input_dir, batch_dir, client)
+        else:
+            collect_batches(
+                args.input_dir,
+                args.output_dir,
+                batch_dir,
+                client,
+                args.model,
+                extra_body,
+                args.poll_interval,
+            )
+    elif args.max_in_flight > 1:
+        asyncio.run(
+            translate_dataset_async(
+                input_dir=args.input_dir,
+                output_dir=args.output_dir,
+                model_name=args.model,
+                base_url=args.base_url,
+                api_key=os.getenv("xAI_API_KEY"),
+                extra_body=extra_body,
+                max_in_flight=args.max_in_flight,
+                rpm=args.rpm,
+                tpm=args.tpm,
+                max_retries=args.max_retries,
+                timeout=args.timeout,
+                stream=args.stream,
+            )
+        )
+    else:
+        translate_dataset(
+            input_dir=args.input_dir,
+            output_dir=args.output_dir,
+            model_name=args.model,
+            base_url=args.base_url,
+            api_key=os.getenv("xAI_API_KEY"),
+            extra_body=extra_body,
+            timeout=args.timeout,
+            stream=args.stream,
+        )
@@ -20,6 +20,8 @@ MODEL_NAME=""
 BASE_URL="https://api.x.ai/v1"
 REASONING_EFFORT="low"
 SEED=42
+# Concurrent requests; 1 sends them one after another
+MAX_IN_FLIGHT=1
 
 DATASET_NAME=$(basename "$INPUT_DIR")
 OUTPUT_DIR="/scratch/project_462000941/members/zihao/rm4mt/rm4mt_translated/${DATASET_NAME}/${MODEL_NAME}/reasoning_effort_${REASONING_EFFORT}"
@@ -34,6 +36,7 @@ CMD="python $SCRIPT \
     --model \"$MODEL_NAME\" \
     --base_url "$BASE_URL" \
     --seed "$SEED" \
+    --max_in_flight "$MAX_IN_FLIGHT" \
     --reasoning_effort \"$REASONING_EFFORT\""
 
 eval $CMD
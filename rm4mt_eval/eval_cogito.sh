@@ -19,6 +19,7 @@ MODEL_NAME=""
 THINKING_BUDGET=
 ENABLE_WAIT_INSERTION=""
 SEED=42
+BATCH_SIZE=1
 ADD_DOC_FOR_RAGTRANS=""
 
 DATASET_NAME=$(basename "$INPUT_DIR")
@@ -44,6 +45,7 @@ CMD="python $SCRIPT \
     --max_new_tokens 12000 \
     --thinking_budget \"$THINKING_BUDGET\" \
     --seed \"$SEED\" \
+    --batch_size \"$BATCH_SIZE\" \
     --device_map \"auto\""
 
 if [ "$ADD_DOC_FOR_RAGTRANS" = "True" ]; then
@@ -0,0 +1,77 @@
+#!/bin/bash
+#SBATCH --job-name=eval
+#SBATCH --output=../logs/eval_local/%x_%j.out
+#SBATCH --error=../logs/eval_local/%x_%j.err
+#SBATCH --partition=small-g
+#SBATCH --nodes=1
+#SBATCH --ntasks=1
+#SBATCH --gpus-per-task=1
+#SBATCH --time=3-00:00:00
+#SBATCH --account=project_462000964
+
+start_time=$(date +%s)
+echo "Job started at: $(date)"
+
+source ../.venv/bin/activate
+
+INPUT_DIRS=""
+MODEL_NAME=""
+THINKING_BUDGETS=""
+ENABLE_WAIT_INSERTION=""
+SEED=42
+BATCH_SIZE=1
+ADD_DOC_FOR_RAGTRANS=""
+# Budget tree shares the KV cache across budgets, exact only with greedy decoding
+BUDGET_TREE="False"
+GREEDY="False"
+
+if [ "$ENABLE_WAIT_INSERTION" = "False" ]; then
+    OUTPUT_ROOT="../rm4mt_translated"
+else
+    OUTPUT_ROOT="../rm4mt_wait_translated"
+fi
+
+SCRIPT="eval_qwen.py"
+
+echo "Translating $INPUT_DIRS with budgets $THINKING_BUDGETS ..."
+
+# Budget 0 cells sample with 0.7/0.8, thinking cells with 0.6/0.95
+CMD="python $SCRIPT \
+    --input_dir $INPUT_DIRS \
+    --output_root \"$OUTPUT_ROOT\" \
+    --model \"$MODEL_NAME\" \
+    --temperature 0.6 \
+    --top_p 0.95 \
+    --no_thinking_temperature 0.7 \
+    --no_thinking_top_p 0.8 \
+    --max_new_tokens 12000 \
+    --thinking_budget $THINKING_BUDGETS \
+    --seed \"$SEED\" \
+    --batch_size \"$BATCH_SIZE\" \
+    --device_map \"auto\""
+
+if [ "$ADD_DOC_FOR_RAGTRANS" = "True" ]; then
+    CMD="$CMD --add_doc_for_ragtrans"
+fi
+
+if [ "$ENABLE_WAIT_INSERTION" = "True" ]; then
+    CMD="$CMD --enable_wait_insertion"
+fi
+
+if [ "$BUDGET_TREE" = "True" ]; then
+    CMD="$CMD --budget_tree"
+fi
+
+if [ "$GREEDY" = "True" ]; then
+    CMD="$CMD --greedy"
+fi
+
+eval $CMD
+
+echo "Done: results saved under $OUTPUT_ROOT"
+
+end_time=$(date +%s)
+echo "Job ended at: $(date)"
+
+duration=$((end_time - start_time))
+echo "Job duration: $(date -u -d @${duration} +%T)"
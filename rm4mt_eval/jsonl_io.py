@@ -0,0 +1,102 @@
+import os
+import json
+import mmap
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if orjson is not None:
+
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps(obj):
+        """
+        Serialize one record to UTF-8 bytes, without the trailing newline
+        """
+        return orjson.dumps(obj)
+
+else:
+
+    def loads(data):
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
+    def dumps(obj):
+        """
+        Serialize one record to UTF-8 bytes, without the trailing newline
+        """
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def iter_jsonl(filepath, use_mmap=False):
+    """
+    Yield the records of a JSONL file one at a time, skipping blank lines.
+
+    With ``use_mmap`` the file is memory-mapped and every line is handed to
+    the parser as a slice of the mapping, so no per-line copy is made when
+    orjson is available.
+    """
+    with open(filepath, "rb") as f:
+        if not use_mmap or os.fstat(f.fileno()).st_size == 0:
+            for line in f:
+                if line.strip():
+                    yield loads(line)
+            return
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            start = 0
+            size = len(mm)
+            while start < size:
+                end = mm.find(b"\n", start)
+                if end == -1:
+                    end = size
+                # Blank lines, including a lone "\r", are skipped without parsing
+                record = None
+                if end - start > 2 or mm[start:end].strip():
+                    with view[start:end] as line:
+                        record = loads(line)
+                start = end + 1
+                if record is not None:
+                    yield record
+
+
+def load_jsonl(filepath, use_mmap=False):
+    return list(iter_jsonl(filepath, use_mmap=use_mmap))
+
+
+class JsonlWriter:
+    """
+    Buffered JSONL writer; ``flush()`` after records that must survive a crash
+    """
+
+    def __init__(self, filepath, mode="w", buffer_size=1 << 20):
+        dirname = os.path.dirname(filepath)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._file = open(filepath, mode + "b", buffering=buffer_size)
+
+    def write(self, record):
+        self._file.write(dumps(record) + b"\n")
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def save_jsonl(data, filepath):
+    with JsonlWriter(filepath) as writer:
+        for item in data:
+            writer.write(item)
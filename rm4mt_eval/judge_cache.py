@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+# Hits whose last-used time is written back in one statement
+TOUCH_BATCH = 1024
+
+
+def cache_key(model, contents, config):
+    """
+    Content hash of everything that determines a judge response
+    """
+    payload = json.dumps(
+        [
+            model,
+            contents,
+            config.get("system_instruction"),
+            config.get("temperature"),
+            config.get("seed"),
+        ],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).digest()
+
+
+class CachedResponse:
+    """
+    Stand-in for a generate_content response served from the cache
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.usage_metadata = None
+
+
+class JudgeCache:
+    """
+    On-disk cache of judge response texts, keyed by ``cache_key``.
+
+    Backed by one SQLite file so it survives across runs and output
+    directories: identical hypotheses from different budgets, or a rerun
+    with --overwrite, are scored without another API call. Entries carry a
+    last-used timestamp; once the stored text exceeds ``max_bytes`` the
+    least recently used entries are evicted down to 90% of the limit.
+
+    Jobs on different nodes share the file, so it keeps SQLite's default
+    rollback journal (WAL needs shared memory on one host and is unsafe on
+    network filesystems) and waits up to a minute for the write lock. Hits
+    only read; their last-used times are written back in batches. Triggers
+    keep the stored size in a one-row table, so every job's writes and
+    evictions count and ``put`` reads the current total inside its write
+    transaction before deciding what to evict.
+    """
+
+    def __init__(self, path, max_bytes=1 << 30):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.touched = []
+
+        # timeout is SQLite's busy timeout: wait for other jobs' writes
+        self.conn = sqlite3.connect(path, timeout=60)
+        # Also turns a file left in WAL mode by older runs back
+        self.conn.execute("PRAGMA journal_mode=DELETE")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key BLOB PRIMARY KEY, text TEXT NOT NULL, "
+            "size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)"
+        )
+        # Files from older runs have no size table yet: count them once, in
+        # the same transaction that adds the triggers
+        self.conn.execute("BEGIN IMMEDIATE")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS stored (id INTEGER PRIMARY KEY CHECK (id = 0), "
+            "total_bytes INTEGER NOT NULL)"
+        )
+        self.conn.execute(
+            "INSERT OR IGNORE INTO stored "
+            "SELECT 0, COALESCE(SUM(size), 0) FROM responses"
+        )
+        self.conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS responses_insert AFTER INSERT ON responses "
+            "BEGIN UPDATE stored SET total_bytes = total_bytes + NEW.size; END"
+        )
+        self.conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS responses_update AFTER UPDATE OF size ON responses "
+            "BEGIN UPDATE stored SET total_bytes = total_bytes + NEW.size - OLD.size; END"
+        )
+        self.conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS responses_delete AFTER DELETE ON responses "
+            "BEGIN UPDATE stored SET total_bytes = total_bytes - OLD.size; END"
+        )
+        self.conn.commit()
+        self.total_bytes = self._stored_bytes()
+
+    def _stored_bytes(self):
+        return self.conn.execute("SELECT total_bytes FROM stored").fetchone()[0]
+
+    def get(self, key):
+        row = self.conn.execute(
+            "SELECT text FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.touched.append(key)
+        if len(self.touched) >= TOUCH_BATCH:
+            self._write_touched()
+            self.conn.commit()
+        return row[0]
+
+    def _write_touched(self):
+        if not self.touched:
+            return
+        now = time.time()
+        self.conn.executemany(
+            "UPDATE responses SET last_used = ? WHERE key = ?",
+            ((now, key) for key in self.touched),
+        )
+        self.touched = []
+
+    def put(self, key, text):
+        size = len(text.encode("utf-8"))
+        # The insert opens the write transaction, so the total read below
+        # stays current until the commit. An upsert rather than INSERT OR
+        # REPLACE, whose implicit delete would not fire the trigger.
+        self.conn.execute(
+            "INSERT INTO responses (key, text, size, last_used) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET text = excluded.text, "
+            "size = excluded.size, last_used = excluded.last_used",
+            (key, text, size, time.time()),
+        )
+        self._write_touched()
+        self.total_bytes = self._stored_bytes()
+        if self.total_bytes > self.max_bytes:
+            self._evict(int(self.max_bytes * 0.9))
+        self.conn.commit()
+
+    def _evict(self, target_bytes):
+        rows = self.conn.execute(
+            "SELECT key, size FROM responses ORDER BY last_used"
+        )
+        victims = []
+        for key, size in rows:
+            if self.total_bytes <= target_bytes:
+                break
+            victims.append((key,))
+            self.total_bytes -= size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+        self.evicted += len(victims)
+
+    def report(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups * 100 if lookups else 0.0
+        print(
+            f"Judge cache: {self.hits} hits, {self.misses} misses "
+            f"({hit_rate:.1f}% hit rate), {self.evicted} evicted, "
+            f"{self.total_bytes / (1 << 20):.1f} MB in {self.path}"
+        )
+
+    def close(self):
+        self._write_touched()
+        self.conn.commit()
+        self.conn.close()
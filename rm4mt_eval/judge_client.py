@@ -0,0 +1,108 @@
+import asyncio
+import httpx
+from google.genai import errors
+
+from judge_cache import CachedResponse, cache_key
+from rate_limit import TokenBucket, backoff_delay
+
+
+# Timeouts and dropped connections below the API errors; google-genai uses
+# httpx, or aiohttp when it is installed
+TRANSPORT_ERRORS = (httpx.TransportError, asyncio.TimeoutError)
+try:
+    import aiohttp
+
+    TRANSPORT_ERRORS += (aiohttp.ClientError,)
+except ImportError:
+    pass
+
+
+class QuotaExhausted(Exception):
+    """
+    Raised when a request keeps getting 429 RESOURCE_EXHAUSTED after every retry
+    """
+
+
+class AsyncJudgeClient:
+    """
+    Rate-limited asyncio wrapper around ``client.aio.models.generate_content``.
+
+    Requests wait for a requests-per-minute and a tokens-per-minute bucket
+    (either may be None for no limit). 429 and 5xx responses, timeouts and
+    dropped connections are retried with jittered exponential backoff. A
+    request that is still rate limited after ``max_retries`` retries raises
+    QuotaExhausted so the caller can drain and checkpoint instead of exiting
+    mid-flight. With a JudgeCache, a request whose (model, prompt, system
+    instruction, temperature, seed) was already answered is served from disk
+    and skips the rate limits entirely.
+    """
+
+    def __init__(
+        self,
+        client,
+        rpm=None,
+        tpm=None,
+        max_retries=6,
+        base_delay=1.0,
+        max_delay=60.0,
+        cache=None,
+    ):
+        self.client = client
+        self.cache = cache
+        self.request_bucket = TokenBucket(rpm) if rpm else None
+        self.token_bucket = TokenBucket(tpm) if tpm else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+
+    @staticmethod
+    def estimate_tokens(contents, config):
+        # Roughly four characters per token, plus a few output tokens
+        chars = len(contents) + len(config.get("system_instruction", ""))
+        return chars // 4 + 8
+
+    async def generate_content(self, model, contents, config):
+        if self.cache is not None:
+            key = cache_key(model, contents, config)
+            text = self.cache.get(key)
+            if text is not None:
+                return CachedResponse(text)
+
+        estimate = self.estimate_tokens(contents, config)
+
+        for attempt in range(self.max_retries + 1):
+            if self.request_bucket is not None:
+                await self.request_bucket.acquire(1)
+            if self.token_bucket is not None:
+                await self.token_bucket.acquire(estimate)
+
+            try:
+                response = await self.client.aio.models.generate_content(
+                    model=model, contents=contents, config=config
+                )
+            except errors.APIError as e:
+                retryable = e.code == 429 or (e.code is not None and e.code >= 500)
+                if not retryable:
+                    raise
+                if attempt == self.max_retries:
+                    if e.code == 429:
+                        raise QuotaExhausted(str(e)) from e
+                    raise
+                self.retries += 1
+                await asyncio.sleep(backoff_delay(attempt, self.base_delay, self.max_delay))
+                continue
+            except TRANSPORT_ERRORS:
+                if attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                await asyncio.sleep(backoff_delay(attempt, self.base_delay, self.max_delay))
+                continue
+
+            usage = getattr(response, "usage_metadata", None)
+            total_tokens = getattr(usage, "total_token_count", None)
+            if self.token_bucket is not None and total_tokens:
+                self.token_bucket.adjust(total_tokens - estimate)
+            if self.cache is not None and getattr(response, "text", None) is not None:
+                self.cache.put(key, response.text)
+            return response
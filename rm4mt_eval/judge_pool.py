@@ -0,0 +1,63 @@
+import asyncio
+from tqdm import tqdm
+
+from judge_client import QuotaExhausted
+
+
+class JudgePool:
+    """
+    Fixed set of asyncio workers for a whole scoring run.
+
+    Jobs are ``(key, fn)`` pairs, typically one per (item, metric), where
+    ``fn()`` returns a coroutine. All workers pull from a single job queue, so
+    different metrics interleave and the pool never drains between metrics.
+    On QuotaExhausted no new job is started, the requests already in flight
+    are drained and reported, and the error is re-raised. Any other error
+    fails only its own job: it goes to ``on_error(key, error)`` and is never
+    reported as a result, so the job can be retried by the next run.
+    """
+
+    def __init__(self, max_workers=10):
+        self.max_workers = max_workers
+        self.failures = 0
+
+    async def run(self, jobs, on_result, total=None, desc="Scoring", on_error=None):
+        """
+        Await ``fn()`` for every job and call ``on_result(key, result)`` in
+        completion order
+        """
+        jobs = iter(jobs)
+        quota_error = None
+        progress_bar = tqdm(total=total, desc=desc, unit="job")
+
+        async def worker():
+            nonlocal quota_error
+            while quota_error is None:
+                job = next(jobs, None)
+                if job is None:
+                    return
+                key, fn = job
+                try:
+                    result = await fn()
+                except QuotaExhausted as e:
+                    # Leave this job unscored, it is retried on the next run
+                    quota_error = e
+                    return
+                except Exception as e:
+                    self.failures += 1
+                    if on_error is not None:
+                        on_error(key, e)
+                    else:
+                        print(f"Job {key} failed: {e}")
+                    progress_bar.update(1)
+                    continue
+                on_result(key, result)
+                progress_bar.update(1)
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(self.max_workers)))
+        finally:
+            progress_bar.close()
+
+        if quota_error is not None:
+            raise quota_error
@@ -0,0 +1,296 @@
+import os
+import sys
+import asyncio
+import argparse
+from glob import glob
+from functools import partial
+from tqdm import tqdm
+from google import genai
+
+from judge_cache import JudgeCache
+from judge_client import AsyncJudgeClient, QuotaExhausted
+from judge_pool import JudgePool
+from jsonl_io import JsonlWriter, iter_jsonl
+from results_store import ResultsStore, partition_for
+from score_journal import ScoreJournal
+
+
+def find_input_files(input_root):
+    # JSONL files in budget_* and reasoning_effort_* directories
+    patterns = [
+        os.path.join(input_root, "*", "budget_*", "*.jsonl"),
+        os.path.join(input_root, "*", "reasoning_effort_*", "*.jsonl"),
+    ]
+    jsonl_files = []
+    for pattern in patterns:
+        jsonl_files.extend(glob(pattern))
+    return jsonl_files
+
+
+def load_prompt_fields(filepath, prompt_fields, metrics):
+    # Records are streamed, so reasoning text never stays in memory
+    return [
+        {key: value for key, value in item.items() if key in prompt_fields or key in metrics}
+        for item in iter_jsonl(filepath)
+    ]
+
+
+async def score_files(
+    judge,
+    pool,
+    jsonl_files,
+    input_root,
+    output_root,
+    overwrite,
+    metrics,
+    compute_score,
+    prompt_fields,
+    desc="Scoring",
+    results=None,
+):
+    """
+    Score every file in a single pool run.
+
+    ``metrics`` maps each metric name to the keyword arguments of
+    ``compute_score(judge, item, **options)``, and ``prompt_fields`` are the
+    record fields the prompts read. The jobs of all files go into one queue,
+    so the workers stay busy across file boundaries instead of draining at
+    the end of each file. A file is merged into its output as soon as its
+    last score is in.
+    """
+    # output_path → what finish() needs, the jobs still to come back and
+    # the jobs that failed
+    files = {}
+    remaining = {}
+    failed = {}
+
+    def finish(output_path):
+        input_path, source_path, data, journal = files.pop(output_path)
+        del remaining[output_path]
+        temp_output_path = output_path + ".temp"
+        if failed.pop(output_path):
+            # Keep the journal, the next run only requests the missing scores
+            journal.close()
+            print(f"✘ {input_path}: some scores failed, rerun to retry them")
+            return
+
+        # Once every score is in, merge the journal into the final output
+        merge_path = output_path + ".merge"
+        with JsonlWriter(merge_path) as writer:
+            for item, scored in zip(iter_jsonl(source_path), data):
+                item.update((metric, scored[metric]) for metric in metrics)
+                writer.write(item)
+        os.replace(merge_path, output_path)
+        journal.remove()
+        if results is not None:
+            partition = partition_for(input_root, input_path)
+            for metric in metrics:
+                results.write_metric(partition, metric, [item[metric] for item in data])
+        if os.path.exists(temp_output_path):
+            os.remove(temp_output_path)
+        print(f"✔ {input_path} → {output_path}")
+
+    def jobs():
+        for input_path in tqdm(jsonl_files, desc="Processing files"):
+            relative_path = os.path.relpath(input_path, input_root)
+            output_path = os.path.join(output_root, relative_path)
+            temp_output_path = output_path + ".temp"
+
+            # Skip if output file exists and overwrite is False
+            if os.path.exists(output_path) and not overwrite:
+                print(f"Skipping {input_path} (already processed)")
+                continue
+
+            # Legacy runs checkpointed the whole file to .temp, start from it if present
+            if os.path.exists(temp_output_path):
+                source_path = temp_output_path
+                print(f"Resuming from temporary file: {temp_output_path}")
+            else:
+                source_path = input_path
+            data = load_prompt_fields(source_path, prompt_fields, metrics)
+
+            # Replay scores journaled by an interrupted run
+            journal = ScoreJournal(output_path + ".journal")
+            replayed = journal.replay(data)
+            if replayed:
+                print(f"Resuming from journal: {journal.path} ({replayed} scores)")
+
+            # One (item, metric) job per missing score, all metrics interleaved
+            pending = [
+                (item_id, metric)
+                for item_id in range(len(data))
+                for metric in metrics
+                if metric not in data[item_id]
+            ]
+            files[output_path] = (input_path, source_path, data, journal)
+            remaining[output_path] = len(pending)
+            failed[output_path] = 0
+            if not pending:
+                finish(output_path)
+                continue
+            for item_id, metric in pending:
+                yield (
+                    (output_path, item_id, metric),
+                    partial(compute_score, judge, data[item_id], **metrics[metric]),
+                )
+
+    def on_result(key, score):
+        output_path, item_id, metric = key
+        _, _, data, journal = files[output_path]
+        data[item_id][metric] = score
+        journal.append(item_id, {metric: score})
+        remaining[output_path] -= 1
+        if not remaining[output_path]:
+            finish(output_path)
+
+    def on_error(key, error):
+        output_path, item_id, metric = key
+        print(f"Failed {metric} of line {item_id} in {files[output_path][0]}: {error}")
+        failed[output_path] += 1
+        remaining[output_path] -= 1
+        if not remaining[output_path]:
+            finish(output_path)
+
+    await pool.run(jobs(), on_result, desc=desc, on_error=on_error)
+
+
+def main(
+    metrics,
+    compute_score,
+    prompt_fields,
+    desc,
+    input_root,
+    output_root,
+    overwrite=False,
+    max_workers=10,
+    rpm=None,
+    tpm=None,
+    max_retries=6,
+    base_url=None,
+    cache_path=None,
+    cache_max_mb=1024,
+    results_root=None,
+):
+    # base_url points the client at another endpoint, e.g. a local fake server
+    http_options = {"base_url": base_url} if base_url else None
+    client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"), http_options=http_options)
+    cache = JudgeCache(cache_path, max_bytes=cache_max_mb << 20) if cache_path else None
+    judge = AsyncJudgeClient(
+        client, rpm=rpm, tpm=tpm, max_retries=max_retries, cache=cache
+    )
+
+    jsonl_files = find_input_files(input_root)
+    print(f"Found {len(jsonl_files)} JSONL file")
+
+    pool = JudgePool(max_workers=max_workers)
+    results = ResultsStore(results_root) if results_root else None
+    try:
+        asyncio.run(
+            score_files(
+                judge,
+                pool,
+                jsonl_files,
+                input_root,
+                output_root,
+                overwrite,
+                metrics,
+                compute_score,
+                prompt_fields,
+                desc=desc,
+                results=results,
+            )
+        )
+    except QuotaExhausted as e:
+        print("\n\nERROR: Hit Gemini API quota limit. Stopped after draining in-flight requests.")
+        print(f"Error details: {e}")
+        print(f"Retried requests: {judge.retries}")
+        print("\nEvery finished score is journaled, rerun when your quota resets to resume.")
+        sys.exit(1)
+    finally:
+        if cache is not None:
+            cache.report()
+            cache.close()
+
+    print(f"Retried requests: {judge.retries}")
+    if pool.failures:
+        print(f"Failed requests: {pool.failures}, rerun to retry them")
+        sys.exit(1)
+
+
+def cli(metrics, compute_score, prompt_fields, desc):
+    """
+    Parse the command line shared by the Gemini judge scripts and run main
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--input_root", required=True, help="Path to original data root"
+    )
+    parser.add_argument(
+        "--output_root", required=True, help="Path to write scored data"
+    )
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="Overwrite existing output files (default: skip already processed files)",
+    )
+    parser.add_argument(
+        "--max_workers",
+        type=int,
+        default=10,
+        help="Maximum number of concurrent requests"
+    )
+    parser.add_argument(
+        "--rpm", type=int, default=None, help="Requests per minute limit (default: none)"
+    )
+    parser.add_argument(
+        "--tpm", type=int, default=None, help="Tokens per minute limit (default: none)"
+    )
+    parser.add_argument(
+        "--max_retries",
+        type=int,
+        default=6,
+        help="Retries with backoff on 429/5xx before giving up on a request",
+    )
+    parser.add_argument(
+        "--base_url",
+        default=None,
+        help="Override the Gemini API endpoint (e.g. a local fake server)",
+    )
+    parser.add_argument(
+        "--cache_path",
+        default="../cache/judge_cache.sqlite",
+        help="SQLite cache of judge responses shared across runs",
+    )
+    parser.add_argument(
+        "--no_cache", action="store_true", help="Always call the API"
+    )
+    parser.add_argument(
+        "--cache_max_mb",
+        type=int,
+        default=1024,
+        help="Evict least recently used responses beyond this size",
+    )
+    parser.add_argument(
+        "--results_root",
+        default=None,
+        help="Also add the metric columns to this columnar results store",
+    )
+    args = parser.parse_args()
+
+    main(
+        metrics,
+        compute_score,
+        prompt_fields,
+        desc,
+        args.input_root,
+        args.output_root,
+        args.overwrite,
+        args.max_workers,
+        args.rpm,
+        args.tpm,
+        args.max_retries,
+        args.base_url,
+        None if args.no_cache else args.cache_path,
+        args.cache_max_mb,
+        args.results_root,
+    )
@@ -1,189 +1,219 @@
 import os
-import json
 import argparse
+from collections import Counter
+from functools import partial
+from itertools import islice
 import torch
-from transformers import LogitsProcessor, AutoTokenizer, AutoModelForCausalLM
 from tqdm import tqdm
 
-LANG_CODE_TO_NAME = {
-    "en": "English",
-    "fr": "French",
-    "nl": "Dutch",
-    "pt": "Portuguese",
-    "es": "Spanish",
-    "hi": "Hindi",
-    "ta": "Tamil",
-    "te": "Telugu",
-    "zh": "Chinese",
-    "de": "German",
-    "ru": "Russian",
-    "it": "Italian",
-}
-
-
-class ThinkingTokenBudgetProcessor(LogitsProcessor):
+from backends import add_backend_args, backend_options, build_backend
+from engine import (
+    LANG_CODE_TO_NAME,
+    EarlyStopStats,
+    QwenFamily,
+    TokenAccounting,
+    build_output_record,
+    load_model,
+    parse_device_map,
+    translate_grid,
+)
+from jsonl_io import JsonlWriter, iter_jsonl
+from resume_index import ResumeIndex
+from round_metrics import ROUND_METRICS
+
+
+def safe_float_convert(value):
     """
-    A processor where after a maximum number of tokens are generated,
-    a </think> token is added at the end to stop the thinking generation,
-    and then it will continue to generate the response.
+    Convert a score to float, return None if it is not a valid number
     """
-
-    def __init__(self, tokenizer, max_thinking_tokens=None, enable_wait_insertion=True):
-        self.tokenizer = tokenizer
-        self.max_thinking_tokens = max_thinking_tokens
-        self.enable_wait_insertion = enable_wait_insertion  # 是否开启强制插入wait
-
-        # 获取关键token的ID
-        self.think_start_token = self.tokenizer.encode(
-            "<think>", add_special_tokens=False
-        )[0]
-        self.think_end_token = self.tokenizer.encode(
-            "</think>", add_special_tokens=False
-        )[0]
-        self.nl_token = self.tokenizer.encode("\n", add_special_tokens=False)[0]
-        self.wait_token = self.tokenizer.encode("wait", add_special_tokens=False)[
-            0
-        ]  # 延长思考的token
-
-        # 状态跟踪
-        self.tokens_generated = 0
-        self.thinking_tokens_count = 0
-        self.in_thinking = False
-        self.stopped_thinking = False
-        self.wait_inserted = False  # 跟踪是否已插入wait
-        self.neg_inf = float("-inf")
-
-    def __call__(
-        self, input_ids: torch.LongTensor, scores: torch.FloatTensor
-    ) -> torch.FloatTensor:
-        # 检查当前是否在思考状态中
-        if input_ids.shape[1] > 0:
-            last_token = input_ids[0, -1].item()
-
-            # 检测思考开始
-            if last_token == self.think_start_token:
-                self.in_thinking = True
-                self.thinking_tokens_count = 0
-                self.wait_inserted = False  # 重置wait状态
-
-            # 检测思考结束
-            elif last_token == self.think_end_token:
-                self.in_thinking = False
-                self.stopped_thinking = True
-
-        # 如果在思考状态中，增加思考token计数
-        if self.in_thinking:
-            self.thinking_tokens_count += 1
-
-        self.tokens_generated += 1
-
-        # 处理有限制的思考token数量
-        if (
-            self.max_thinking_tokens is not None
-            and self.max_thinking_tokens > 0
-            and self.in_thinking
-            and not self.stopped_thinking
-        ):
-            # 如果开启了wait插入功能，且模型想要结束思考但还没达到最大tokens，且还没插入过wait，就插入wait
-            if (
-                self.enable_wait_insertion
-                and self.thinking_tokens_count < self.max_thinking_tokens
-                and not self.wait_inserted
-                and self.thinking_tokens_count > 5  # 至少思考5个token后才考虑插入wait
-                and scores[0][self.think_end_token] == scores[0].max()
-            ):  # </think>必须是概率最高的token
-
-                # 强制选择wait token
-                scores[:] = self.neg_inf
-                scores[0][self.wait_token] = 0
-                self.wait_inserted = True
-                return scores
-
-            # 当接近token限制时，增加结束思考的概率
-            if self.thinking_tokens_count >= self.max_thinking_tokens * 0.95:
-                # 增强换行和结束思考token的概率
-                boost_factor = 1 + (
-                    self.thinking_tokens_count / self.max_thinking_tokens
-                )
-                scores[0][self.nl_token] = scores[0][self.nl_token] * boost_factor
-                scores[0][self.think_end_token] = (
-                    scores[0][self.think_end_token] * boost_factor
-                )
-
-            # 强制结束思考
-            if self.thinking_tokens_count >= self.max_thinking_tokens - 1:
-                if self.thinking_tokens_count == self.max_thinking_tokens - 1:
-                    # 倒数第二个token，优先选择换行
-                    scores[:] = self.neg_inf
-                    scores[0][self.nl_token] = 0
-                else:
-                    # 最后一个token，强制选择结束思考
-                    scores[:] = self.neg_inf
-                    scores[0][self.think_end_token] = 0
-                    self.stopped_thinking = True
-
-        return scores
-
-
-def extract_thinking_and_response(text):
+    try:
+        if isinstance(value, (int, float)):
+            return float(value)
+        elif isinstance(value, str):
+            # Try to convert string to float
+            return float(value)
+        else:
+            return None
+    except (ValueError, TypeError):
+        return None
+
+
+def draft_quality_score(item):
     """
-    Extract thinking content and response from generated text
+    Quality score of an input draft from its precomputed grb/grf scores
     """
-    thinking_content = ""
-    response_content = ""
+    # Safely extract and validate grb and grf scores
+    grb_score = safe_float_convert(item.get("grb", 0))
+    grf_score = safe_float_convert(item.get("grf", 0))
+
+    # Calculate quality score based on valid values
+    if grb_score is not None and grf_score is not None:
+        # Both are valid numbers, take average
+        quality_score = round((grb_score + grf_score) / 2, 2)
+    elif grb_score is not None:
+        # Only grb is valid, use it
+        quality_score = round(grb_score, 2)
+    elif grf_score is not None:
+        # Only grf is valid, use it
+        quality_score = round(grf_score, 2)
+    else:
+        # Both are invalid, set to 80
+        quality_score = 80
+    return quality_score
 
-    # Find thinking tags
-    think_start = text.find("<think>")
-    think_end = text.find("</think>")
 
-    if think_start != -1 and think_end != -1:
-        thinking_content = text[think_start + 7 : think_end].strip()
-        response_content = text[think_end + 8 :].strip()
+def build_request(task, item, src_lang, tgt_lang, include_quality_score):
+    """
+    Build the refinement messages for one scored draft translation.
+    ``round_score``, set by the iterative loop, replaces the grb/grf score.
+    """
+    src_text = item.get("src_text", "").strip()
+    hyp_text = item.get("hyp_text", "").strip()
+    quality_score = item.get("round_score")
+    if quality_score is None:
+        quality_score = draft_quality_score(item)
+
+    src_lang_name = LANG_CODE_TO_NAME[src_lang]
+    tgt_lang_name = LANG_CODE_TO_NAME[tgt_lang]
+
+    if include_quality_score:
+        sys_prompt = f"You are a professional translator, and your task is to refine the {tgt_lang_name} draft translation below based on the {src_lang_name} source text and its quality evaluation.\nPlease only provide me with the refined translation, without any additional explanations."
+        prompt = f"Source Text: {src_text}\nDraft Translation: {hyp_text}\nQuality Score: {quality_score}/100"
     else:
-        response_content = text.strip()
+        sys_prompt = f"You are a professional translator, and your task is to refine the {tgt_lang_name} draft translation below based on the {src_lang_name} source text.\nPlease only provide me with the refined translation, without any additional explanations."
+        prompt = f"Source Text: {src_text}\nDraft Translation: {hyp_text}"
+    messages = [
+        {"role": "system", "content": sys_prompt},
+        {"role": "user", "content": prompt}
+    ]
+    return src_text, item.get("tgt_text", ""), messages
 
-    return thinking_content, response_content
 
+def draft_record(model_name, thinking_budget, src_lang, tgt_lang, src_text, tgt_text, item):
+    """
+    The input draft as an output record, written back when no refinement
+    round scores higher
+    """
+    return {
+        "model": model_name,
+        "thinking_budget": thinking_budget,
+        "thinking_length": 0,
+        "src_lang": src_lang,
+        "tgt_lang": tgt_lang,
+        "src_text": src_text,
+        "tgt_text": tgt_text,
+        "hyp_text": item.get("hyp_text", "").strip(),
+        "reasoning": "",
+        "all_generated_text": "",
+    }
+
+
+class Refinement:
+    """
+    One draft going through the refinement rounds: its current hypothesis
+    and score, the best round so far and the tokens the rounds cost. The
+    draft itself is round 0, so a round only replaces it by scoring higher.
+    """
 
-def translate_dataset(
+    def __init__(self, src_text, tgt_text, item, score, draft_record):
+        self.src_text = src_text
+        self.tgt_text = tgt_text
+        self.item = item
+        self.hyp_text = item.get("hyp_text", "").strip()
+        self.score = score
+        self.round_scores = [score]
+        self.round_tokens = []
+        self.prompt_tokens = 0
+        self.best_record = draft_record
+        self.best_score = score
+        self.best_round = 0
+        self.stop_reason = None
+
+    def request_item(self):
+        """
+        The input line of the next round: the current hypothesis with its
+        metric score, so every round's prompt is on the scale the stopping
+        rule compares
+        """
+        return dict(self.item, hyp_text=self.hyp_text, round_score=self.score)
+
+    def update(self, record, score, prompt_tokens, new_tokens, max_rounds, min_improvement):
+        """
+        Record one round; returns True while the item is worth another one
+        """
+        self.round_scores.append(score)
+        self.round_tokens.append(new_tokens)
+        self.prompt_tokens += prompt_tokens
+        if score > self.best_score:
+            self.best_record = record
+            self.best_score = score
+            self.best_round = len(self.round_tokens)
+
+        hyp_text = record["hyp_text"]
+        if " ".join(hyp_text.split()) == " ".join(self.hyp_text.split()):
+            self.stop_reason = "unchanged"
+        elif score <= self.score + min_improvement:
+            self.stop_reason = "no_improvement"
+        elif len(self.round_tokens) >= max_rounds:
+            self.stop_reason = "max_rounds"
+        else:
+            self.hyp_text = hyp_text
+            self.score = score
+            return True
+        return False
+
+    def output(self, metric_name):
+        return {
+            **self.best_record,
+            "rounds": len(self.round_tokens),
+            "best_round": self.best_round,
+            "stop_reason": self.stop_reason,
+            "round_metric": metric_name,
+            "round_scores": self.round_scores,
+            "round_tokens": self.round_tokens,
+            "tokens_spent": sum(self.round_tokens),
+            "prompt_tokens_spent": self.prompt_tokens,
+        }
+
+
+def post_edit_iterative(
+    backend,
+    family,
+    build_request,
+    scorer,
     input_dir,
     output_dir,
     model_name,
     thinking_budget,
-    temperature,
-    top_p,
     max_new_tokens,
     seed,
-    device_map,
     enable_wait_insertion,
-    include_quality_score,
+    rounds,
+    min_improvement=0.0,
+    temperature=None,
+    top_p=None,
+    batch_size=1,
 ):
     """
-    Translate dataset using local model inference
+    Refine every draft in input_dir for up to ``rounds`` rounds.
+
+    Each round feeds the current hypothesis back with its ``scorer`` score
+    and re-scores the refinement. A draft leaves the loop once its
+    hypothesis no longer changes or its score improves by at most
+    ``min_improvement``, and its best-scoring round is written out with
+    the number of rounds and tokens it took; that is the draft itself
+    (``best_round`` 0) when no round beats it. Drafts at different rounds
+    share a batch, and a retired draft's place goes to the next input line,
+    so batches stay full of drafts that are still improving.
     """
-    # Set random seed for reproducibility
+    tokenizer = backend.tokenizer
+    trailing_ids = TokenAccounting(tokenizer, family, backend.model).trailing_ids
     torch.manual_seed(seed)
     if torch.cuda.is_available():
         torch.cuda.manual_seed(seed)
 
-    # Load tokenizer
-    print(f"Loading model: {model_name}")
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-
-    # Determine device configuration
-    if device_map:
-        print(f"Using device_map: {device_map}")
-        device = None  # device should be None when using device_map
-    else:
-        device = 0 if torch.cuda.is_available() else -1
-        print(f"Using device: {'GPU' if device == 0 else 'CPU'}")
-
-    model = AutoModelForCausalLM.from_pretrained(
-        model_name, torch_dtype="auto", device_map="auto"
-    )
-
     os.makedirs(output_dir, exist_ok=True)
-    
+
     task = input_dir.split("/")[-1]
     for filename in os.listdir(input_dir):
         if not filename.endswith(".jsonl"):
@@ -193,166 +223,301 @@ def translate_dataset(
         input_file = os.path.join(input_dir, filename)
         output_file = os.path.join(output_dir, filename)
 
-        already_translated = set()
-        if os.path.exists(output_file):
-            with open(output_file, "r", encoding="utf-8") as fdone:
-                for line in fdone:
-                    try:
-                        obj = json.loads(line)
-                        already_translated.add(obj.get("src_text", "").strip())
-                    except Exception:
-                        continue
-
-        with open(input_file, "r", encoding="utf-8") as fin:
-            total_lines = sum(1 for _ in fin)
-
-        with open(input_file, "r", encoding="utf-8") as fin, open(
-            output_file, "a", encoding="utf-8"
-        ) as fout:
-            progress_bar = tqdm(
-                fin, total=total_lines, desc=f"Translating {filename}", unit="examples"
-            )
-
-            for line in progress_bar:
-                item = json.loads(line)
-                src_text = item.get("src_text", "").strip()
-                if not src_text or src_text in already_translated:
-                    continue
-                hyp_text = item.get("hyp_text", "").strip()
-                
-                # Safely extract and validate grb and grf scores
-                grb_raw = item.get("grb", 0)
-                grf_raw = item.get("grf", 0)
-                
-                # Convert to numeric values, return None if not valid
-                def safe_float_convert(value):
-                    try:
-                        if isinstance(value, (int, float)):
-                            return float(value)
-                        elif isinstance(value, str):
-                            # Try to convert string to float
-                            return float(value)
-                        else:
-                            return None
-                    except (ValueError, TypeError):
-                        return None
-                
-                grb_score = safe_float_convert(grb_raw)
-                grf_score = safe_float_convert(grf_raw)
-                
-                # Calculate quality score based on valid values
-                if grb_score is not None and grf_score is not None:
-                    # Both are valid numbers, take average
-                    quality_score = round((grb_score + grf_score) / 2, 2)
-                elif grb_score is not None:
-                    # Only grb is valid, use it
-                    quality_score = round(grb_score, 2)
-                elif grf_score is not None:
-                    # Only grf is valid, use it
-                    quality_score = round(grf_score, 2)
-                else:
-                    # Both are invalid, set to 80
-                    quality_score = 80
-
-                src_lang_name = LANG_CODE_TO_NAME[src_lang]
-                tgt_lang_name = LANG_CODE_TO_NAME[tgt_lang]
-                
-                if include_quality_score:
-                    sys_prompt = f"You are a professional translator, and your task is to refine the {tgt_lang_name} draft translation below based on the {src_lang_name} source text and its quality evaluation.\nPlease only provide me with the refined translation, without any additional explanations."
-                    prompt = f"Source Text: {src_text}\nDraft Translation: {hyp_text}\nQuality Score: {quality_score}/100"
+        resume_index = ResumeIndex(output_file, input_file)
+        early_stop_stats = EarlyStopStats(max_new_tokens)
+        round_counts = Counter()
+
+        progress_bar = tqdm(
+            total=resume_index.input_lines,
+            desc=f"Post-editing {filename}",
+            unit="examples",
+        )
+
+        def pending_drafts():
+            for item in iter_jsonl(input_file):
+                src_text, tgt_text, _ = build_request(task, item, src_lang, tgt_lang)
+                if src_text and (src_lang, tgt_lang, src_text) not in resume_index:
+                    yield src_text, tgt_text, item
                 else:
-                    sys_prompt = f"You are a professional translator, and your task is to refine the {tgt_lang_name} draft translation below based on the {src_lang_name} source text.\nPlease only provide me with the refined translation, without any additional explanations."
-                    prompt = f"Source Text: {src_text}\nDraft Translation: {hyp_text}"
-                messages = [
-                    {"role": "system", "content": sys_prompt},
-                    {"role": "user", "content": prompt}
+                    progress_bar.update(1)
+
+        drafts = pending_drafts()
+        active = []
+
+        def admit():
+            new = list(islice(drafts, batch_size - len(active)))
+            if not new:
+                return
+            scores = scorer(
+                [
+                    {"src": src_text, "mt": item.get("hyp_text", "").strip(), "ref": tgt_text}
+                    for src_text, tgt_text, item in new
                 ]
+            )
+            for (src_text, tgt_text, item), score in zip(new, scores):
+                record = draft_record(
+                    model_name, thinking_budget, src_lang, tgt_lang, src_text, tgt_text, item
+                )
+                active.append(Refinement(src_text, tgt_text, item, score, record))
 
+        with JsonlWriter(output_file, mode="a") as fout:
+            admit()
+            while active:
                 try:
-                    if thinking_budget == 0:
-                        text = tokenizer.apply_chat_template(
-                            messages,
-                            tokenize=False,
-                            add_generation_prompt=True,
-                            enable_thinking=False,
-                        )
-                        model_inputs = tokenizer([text], return_tensors="pt").to(
-                            model.device
-                        )
-                        generated_ids = model.generate(
-                            **model_inputs,
-                            max_new_tokens=max_new_tokens,
-                            temperature=temperature,
-                            top_p=top_p,
-                        )
-                    else:
-                        text = tokenizer.apply_chat_template(
-                            messages,
-                            tokenize=False,
-                            add_generation_prompt=True,
-                            enable_thinking=True,
-                        )
-                        model_inputs = tokenizer([text], return_tensors="pt").to(
-                            model.device
-                        )
-                        processor = ThinkingTokenBudgetProcessor(
-                            tokenizer,
-                            max_thinking_tokens=thinking_budget,
-                            enable_wait_insertion=enable_wait_insertion,
-                        )
-                        generated_ids = model.generate(
-                            **model_inputs,
-                            max_new_tokens=max_new_tokens,
-                            temperature=temperature,
-                            top_p=top_p,
-                            logits_processor=[processor],
-                        )
-
-                    generated_text = tokenizer.decode(
-                        generated_ids[0], skip_special_tokens=True
+                    generations = backend.generate(
+                        family,
+                        [
+                            build_request(task, state.request_item(), src_lang, tgt_lang)[2]
+                            for state in active
+                        ],
+                        thinking_budget,
+                        max_new_tokens,
+                        enable_wait_insertion,
+                        temperature=temperature,
+                        top_p=top_p,
+                        early_stop_stats=early_stop_stats,
+                    )
+                except Exception as e:
+                    print("=" * 30)
+                    print(f"Skipping batch of {len(active)} due to error: {e}")
+                    for state in active:
+                        print(f"src_text: {state.src_text}")
+                    print("=" * 30)
+                    # Drafts with a finished round keep their best one (maybe
+                    # the draft itself), the others stay out of the output
+                    # and are retried on resume
+                    finished = [state for state in active if state.round_tokens]
+                    for state in finished:
+                        state.stop_reason = "error"
+                        fout.write(state.output(scorer.name))
+                        round_counts[f"{len(state.round_tokens)} (error)"] += 1
+                    fout.flush()
+                    resume_index.add_all(
+                        (src_lang, tgt_lang, state.src_text) for state in finished
                     )
+                    progress_bar.update(len(finished))
+                    active.clear()
+                    admit()
+                    continue
 
-                    # Extract thinking and response
-                    reasoning_content, answer_content = extract_thinking_and_response(
-                        generated_text
+                records = [
+                    build_output_record(
+                        tokenizer,
+                        family,
+                        model_name,
+                        thinking_budget,
+                        src_lang,
+                        tgt_lang,
+                        state.src_text,
+                        state.tgt_text,
+                        generation,
                     )
+                    for state, generation in zip(active, generations)
+                ]
+                scores = scorer(
+                    [
+                        {"src": state.src_text, "mt": record["hyp_text"], "ref": state.tgt_text}
+                        for state, record in zip(active, records)
+                    ]
+                )
 
-                    # Calculate thinking length
-                    thinking_length = tokenizer(reasoning_content, return_length=True)[
-                        "length"
-                    ][0]
-
-                    output = {
-                        "model": model_name,
-                        "thinking_budget": thinking_budget,
-                        "thinking_length": thinking_length,
-                        "src_lang": src_lang,
-                        "tgt_lang": tgt_lang,
-                        "src_text": src_text,
-                        "tgt_text": item.get("tgt_text", ""),
-                        "hyp_text": answer_content,
-                        "reasoning": reasoning_content,
-                        "all_generated_text": generated_text,
-                    }
-                    fout.write(json.dumps(output, ensure_ascii=False) + "\n")
-                    fout.flush()  # Ensure data is written immediately
+                still_active = []
+                finished = []
+                for state, generation, record, score in zip(active, generations, records, scores):
+                    new_ids = generation.new_ids
+                    end = len(new_ids)
+                    while end and new_ids[end - 1] in trailing_ids:
+                        end -= 1
+                    if state.update(
+                        record, score, len(generation.prompt_ids), end, rounds, min_improvement
+                    ):
+                        still_active.append(state)
+                    else:
+                        fout.write(state.output(scorer.name))
+                        finished.append(state)
+                fout.flush()  # Ensure data is written immediately
+                resume_index.add_all(
+                    (src_lang, tgt_lang, state.src_text) for state in finished
+                )
+                for state in finished:
+                    round_counts[f"{len(state.round_tokens)} ({state.stop_reason})"] += 1
+                progress_bar.update(len(finished))
 
-                except Exception as e:
-                    print("=" * 30)
-                    print(f"Skipping due to error: {e}")
-                    print(f"src_text: {src_text}")
-                    print("=" * 30)
+                active[:] = still_active
+                admit()
+            progress_bar.close()
+
+        early_stop_stats.report(filename)
+        if round_counts:
+            print(f"Rounds (stop reason) in {filename}: {dict(sorted(round_counts.items()))}")
+        print(f"✔ Post-edited {filename} → saved to {output_file}")
+
+
+def post_edit_grouped(
+    family,
+    build_request,
+    dir_pairs,
+    model_name,
+    thinking_budget,
+    max_new_tokens,
+    seed,
+    device_map,
+    enable_wait_insertion,
+    temperature=None,
+    top_p=None,
+    batch_size=64,
+    backend_options=None,
+):
+    """
+    Post-edit the drafts of several input directories (e.g. every budget
+    and model of one dataset) together, grouped by source text.
+
+    ``dir_pairs`` is a list of ``(input_dir, output_dir)``. All drafts of a
+    source share the system prompt and "Source Text: ..." prefix, so they
+    are queued next to each other on the paged backend with prefix caching:
+    the prefix is prefilled once and its KV blocks are shared by the drafts.
+    Each output directory is written and resumed exactly as
+    translate_dataset would.
+    """
+    tokenizer, model = load_model(model_name, family, device_map)
+    options = dict(backend_options or {}, prefix_caching=True)
+    backend = build_backend("paged", tokenizer, model, **options)
+    torch.manual_seed(seed)
+    if torch.cuda.is_available():
+        torch.cuda.manual_seed(seed)
+
+    for _, output_dir in dir_pairs:
+        os.makedirs(output_dir, exist_ok=True)
+
+    filenames = sorted(
+        {
+            filename
+            for input_dir, _ in dir_pairs
+            for filename in os.listdir(input_dir)
+            if filename.endswith(".jsonl")
+        }
+    )
+    for filename in filenames:
+        src_lang, tgt_lang = filename.replace(".jsonl", "").split("-")
+        early_stop_stats = EarlyStopStats(max_new_tokens)
+
+        # src_text → [(pair, tgt_text, messages)] over all input directories
+        groups = {}
+        resume_indexes = {}
+        for pair, (input_dir, output_dir) in enumerate(dir_pairs):
+            input_file = os.path.join(input_dir, filename)
+            if not os.path.exists(input_file):
+                continue
+            resume_index = ResumeIndex(os.path.join(output_dir, filename), input_file)
+            resume_indexes[pair] = resume_index
+            task = input_dir.rstrip("/").split("/")[-1]
+            for item in iter_jsonl(input_file):
+                src_text, tgt_text, messages = build_request(
+                    task, item, src_lang, tgt_lang
+                )
+                if not src_text or (src_lang, tgt_lang, src_text) in resume_index:
                     continue
+                groups.setdefault(src_text, []).append((pair, tgt_text, messages))
+
+        writers = {
+            pair: JsonlWriter(os.path.join(dir_pairs[pair][1], filename), mode="a")
+            for pair in resume_indexes
+        }
+        progress_bar = tqdm(
+            total=sum(len(group) for group in groups.values()),
+            desc=f"Post-editing {filename}",
+            unit="drafts",
+        )
+
+        def flush(pending):
+            try:
+                generations = backend.generate(
+                    family,
+                    [messages for _, _, _, messages in pending],
+                    thinking_budget,
+                    max_new_tokens,
+                    enable_wait_insertion,
+                    temperature=temperature,
+                    top_p=top_p,
+                    early_stop_stats=early_stop_stats,
+                )
+            except Exception as e:
+                print("=" * 30)
+                print(f"Skipping batch of {len(pending)} due to error: {e}")
+                for _, src_text, _, _ in pending:
+                    print(f"src_text: {src_text}")
+                print("=" * 30)
+                return
+
+            for (pair, src_text, tgt_text, _), generation in zip(pending, generations):
+                output = build_output_record(
+                    tokenizer,
+                    family,
+                    model_name,
+                    thinking_budget,
+                    src_lang,
+                    tgt_lang,
+                    src_text,
+                    tgt_text,
+                    generation,
+                )
+                writers[pair].write(output)
+            for pair in {pair for pair, _, _, _ in pending}:
+                writers[pair].flush()
+            for pair in {pair for pair, _, _, _ in pending}:
+                resume_indexes[pair].add_all(
+                    (src_lang, tgt_lang, src_text)
+                    for p, src_text, _, _ in pending
+                    if p == pair
+                )
+            progress_bar.update(len(pending))
 
-        print(f"✔ Translated {filename} → saved to {output_file}")
+        try:
+            # Whole groups go into a batch, so a prefix is still cached when
+            # the other drafts of its source are admitted
+            pending = []
+            for src_text, group in groups.items():
+                pending.extend(
+                    (pair, src_text, tgt_text, messages)
+                    for pair, tgt_text, messages in group
+                )
+                if len(pending) >= batch_size:
+                    flush(pending)
+                    pending = []
+            if pending:
+                flush(pending)
+        finally:
+            progress_bar.close()
+            for writer in writers.values():
+                writer.close()
+
+        early_stop_stats.report(filename)
+        print(f"✔ Post-edited {filename} for {len(resume_indexes)} input directories")
+
+    if backend.prefill_tokens:
+        print(
+            f"Prefix cache: {backend.prefix_hit_tokens}/{backend.prefill_tokens} "
+            f"prompt tokens reused "
+            f"({backend.prefix_hit_tokens / backend.prefill_tokens:.1%})"
+        )
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Local model inference for translation evaluation"
     )
-    parser.add_argument("--input_dir", required=True, help="Path to input .jsonl files")
-    parser.add_argument("--output_dir", required=True, help="Directory to save results")
+    parser.add_argument(
+        "--input_dir",
+        required=True,
+        nargs="+",
+        help="Path(s) to input .jsonl files, e.g. the budget directories of one dataset",
+    )
+    parser.add_argument(
+        "--output_dir",
+        required=True,
+        nargs="+",
+        help="Directory to save results, one per input directory",
+    )
     parser.add_argument("--model", default="Qwen/Qwen3-1.7B", help="Model name or path")
     parser.add_argument(
         "--temperature", type=float, default=0.6, help="Temperature for generation"
@@ -391,24 +556,53 @@ if __name__ == "__main__":
         action="store_true",
         help="Include quality score in the prompt",
     )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=1,
+        help="Number of drafts to left-pad and decode together",
+    )
+
+    parser.add_argument(
+        "--group_by_source",
+        action="store_true",
+        help="Post-edit the drafts of all input directories together, grouped by "
+        "source text, sharing the KV of the prompt prefix (paged backend)",
+    )
+    parser.add_argument(
+        "--rounds",
+        type=int,
+        default=1,
+        help="Refinement rounds per draft; above 1, each round is re-scored with "
+        "--round_metric and a draft stops once it no longer changes or improves",
+    )
+    parser.add_argument(
+        "--round_metric",
+        choices=sorted(ROUND_METRICS),
+        default="cometkiwi",
+        help="Local metric scoring each round: reference-free cometkiwi (needs "
+        "unbabel-comet), or chrf_oracle, chrF against tgt_text, which leaks the "
+        "reference into the refinement and is only an upper bound",
+    )
+    parser.add_argument(
+        "--min_improvement",
+        type=float,
+        default=0.0,
+        help="Score gain (0-100) a round needs for its draft to be refined again",
+    )
+
+    add_backend_args(parser)
 
     args = parser.parse_args()
+    if len(args.input_dir) != len(args.output_dir):
+        parser.error("--input_dir and --output_dir need the same number of directories")
+    if args.group_by_source and args.backend != "paged":
+        parser.error("--group_by_source shares prompt prefixes on the paged backend, add --backend paged")
+    if args.group_by_source and args.rounds > 1:
+        parser.error("--group_by_source runs a single round, drop it to use --rounds")
 
     # Parse device_map if it's a string representation of a dict
-    if args.device_map and args.device_map not in [
-        "auto",
-        "balanced",
-        "balanced_low_0",
-        "sequential",
-    ]:
-        try:
-            # Try to parse as JSON for custom device mapping
-            import ast
-
-            args.device_map = ast.literal_eval(args.device_map)
-        except:
-            # If parsing fails, use as string
-            pass
+    args.device_map = parse_device_map(args.device_map)
 
     print(f"Configuration:")
     print(f"  Model: {args.model}")
@@ -421,19 +615,82 @@ if __name__ == "__main__":
     print(f"  enable_wait_insertion: {args.enable_wait_insertion}")
     print(f"  Device map: {args.device_map}")
     print(f"  Include quality score: {args.include_quality_score}")
+    print(f"  Batch size: {args.batch_size}")
+    print(f"  Backend: {args.backend}")
+    print(f"  Group by source: {args.group_by_source}")
+    print(f"  Rounds: {args.rounds}")
+    if args.rounds > 1:
+        print(f"  Round metric: {args.round_metric}")
+        if args.round_metric == "chrf_oracle":
+            print(
+                "  ⚠️ chrf_oracle scores every round against the reference: the prompts, "
+                "best rounds and stops see tgt_text, so the results are an oracle upper bound"
+            )
+        print(f"  Min improvement: {args.min_improvement}")
     print(f"  Seed: {args.seed}")
     print()
 
-    translate_dataset(
-        input_dir=args.input_dir,
-        output_dir=args.output_dir,
-        model_name=args.model,
-        thinking_budget=args.thinking_budget,
-        temperature=args.temperature,
-        top_p=args.top_p,
-        max_new_tokens=args.max_new_tokens,
-        seed=args.seed,
-        device_map=args.device_map,
-        enable_wait_insertion=args.enable_wait_insertion,
-        include_quality_score=args.include_quality_score,
-    )
+    build = partial(build_request, include_quality_score=args.include_quality_score)
+    if args.rounds > 1:
+        tokenizer, model = load_model(args.model, QwenFamily(), args.device_map)
+        backend = build_backend(args.backend, tokenizer, model, **backend_options(args))
+        scorer = ROUND_METRICS[args.round_metric]()
+        for input_dir, output_dir in zip(args.input_dir, args.output_dir):
+            post_edit_iterative(
+                backend,
+                QwenFamily(),
+                build,
+                scorer,
+                input_dir,
+                output_dir,
+                model_name=args.model,
+                thinking_budget=args.thinking_budget,
+                max_new_tokens=args.max_new_tokens,
+                seed=args.seed,
+                enable_wait_insertion=args.enable_wait_insertion,
+                rounds=args.rounds,
+                min_improvement=args.min_improvement,
+                temperature=args.temperature,
+                top_p=args.top_p,
+                batch_size=args.batch_size,
+            )
+    elif args.group_by_source:
+        post_edit_grouped(
+            family=QwenFamily(),
+            build_request=build,
+            dir_pairs=list(zip(args.input_dir, args.output_dir)),
+            model_name=args.model,
+            thinking_budget=args.thinking_budget,
+            max_new_tokens=args.max_new_tokens,
+            seed=args.seed,
+            device_map=args.device_map,
+            enable_wait_insertion=args.enable_wait_insertion,
+            temperature=args.temperature,
+            top_p=args.top_p,
+            batch_size=args.batch_size,
+            backend_options=backend_options(args),
+        )
+    else:
+        cells = [
+            {
+                "input_dir": input_dir,
+                "output_dir": output_dir,
+                "thinking_budget": args.thinking_budget,
+                "temperature": args.temperature,
+                "top_p": args.top_p,
+            }
+            for input_dir, output_dir in zip(args.input_dir, args.output_dir)
+        ]
+        translate_grid(
+            family=QwenFamily(),
+            build_request=build,
+            model_name=args.model,
+            cells=cells,
+            max_new_tokens=args.max_new_tokens,
+            seed=args.seed,
+            device_map=args.device_map,
+            enable_wait_insertion=args.enable_wait_insertion,
+            batch_size=args.batch_size,
+            backend=args.backend,
+            backend_options=backend_options(args),
+        )
@@ -21,6 +21,8 @@ ENABLE_WAIT_INSERTION=""
 INCLUDE_QUALITY_SCORE=""
 DATASET_NAME=""
 SEED=42
+BATCH_SIZE=1
+ROUNDS=1
 
 if [ "$THINKING_BUDGET" -eq 0 ]; then
     TEMPERATURE=0.7
@@ -49,6 +51,8 @@ CMD="python $SCRIPT \
     --max_new_tokens 12000 \
     --thinking_budget \"$THINKING_BUDGET\" \
     --seed \"$SEED\" \
+    --batch_size \"$BATCH_SIZE\" \
+    --rounds \"$ROUNDS\" \
     --device_map \"auto\""
 
 if [ "$ENABLE_WAIT_INSERTION" = "True" ]; then
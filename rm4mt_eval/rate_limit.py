@@ -0,0 +1,43 @@
+import time
+import random
+import asyncio
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at ``per_minute`` units per minute
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def adjust(self, amount):
+        """
+        Charge (or refund, if negative) the difference between an estimate and actual use
+        """
+        self._refill()
+        self.tokens -= amount
+
+
+def backoff_delay(attempt, base_delay, max_delay):
+    # Full jitter: sleep a random time up to the exponential cap
+    return random.uniform(0, min(max_delay, base_delay * 2**attempt))
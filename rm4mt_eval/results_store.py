@@ -0,0 +1,223 @@
+import os
+import argparse
+from glob import glob
+from tqdm import tqdm
+
+from jsonl_io import iter_jsonl
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+PARTITION_KEYS = ("dataset", "model", "budget", "pair")
+# Bulky generation text, kept in its own file so score queries never read it
+REASONING_FIELDS = ("reasoning", "all_generated_text")
+METRIC_FIELDS = ("comet_score", "comet_kiwi_score", "grb", "grf", "gea_100", "gea_5")
+
+TEXT_FILE = "text.parquet"
+REASONING_FILE = "reasoning.parquet"
+METRIC_FILE = "metric={}.parquet"
+
+
+def partition_from_path(relative_path):
+    """
+    Partition of ``<dataset>/<model>/<budget dir>/<src>-<tgt>.jsonl``; the
+    budget is the directory name, e.g. ``budget_100`` or ``reasoning_effort_low``
+    """
+    dataset, model, budget, filename = os.path.normpath(relative_path).split(os.sep)[-4:]
+    return {
+        "dataset": dataset,
+        "model": model,
+        "budget": budget,
+        "pair": filename.replace(".jsonl", ""),
+    }
+
+
+def partition_for(input_root, input_path):
+    """
+    Partition of a file under a per-dataset root, as the scorers' --input_root
+    """
+    dataset = os.path.basename(os.path.normpath(input_root))
+    return partition_from_path(os.path.join(dataset, os.path.relpath(input_path, input_root)))
+
+
+def to_float(value):
+    # Judge failures are recorded as error strings in the JSONL outputs
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return float(value)
+
+
+class ResultsStore:
+    """
+    Columnar store of translated and scored outputs.
+
+    Every (dataset, model, budget, lang pair) partition is a directory
+    ``dataset=<d>/model=<m>/budget=<b>/pair=<p>`` holding row-aligned
+    Parquet files: ``text.parquet`` with the record fields,
+    ``reasoning.parquet`` with the reasoning text, and one
+    ``metric=<name>.parquet`` per metric. A scorer adds its metric by
+    writing one small file, the text is never rewritten, and a query for
+    scores and thinking_length opens neither the text nor the reasoning.
+    """
+
+    def __init__(self, root):
+        if pa is None:
+            raise ImportError("The results store needs pyarrow: pip install pyarrow")
+        self.root = root
+
+    def partition_dir(self, partition):
+        return os.path.join(
+            self.root, *(f"{key}={partition[key]}" for key in PARTITION_KEYS)
+        )
+
+    def _write(self, table, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pq.write_table(table, path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+    def write_records(self, partition, records):
+        """
+        Write a partition from output records, splitting them into the text,
+        reasoning and metric files
+        """
+        text, reasoning, metrics = {}, {}, {}
+        for i, record in enumerate(records):
+            for key, value in record.items():
+                if key in REASONING_FIELDS:
+                    group = reasoning
+                elif key in METRIC_FIELDS:
+                    group = metrics
+                    value = to_float(value)
+                else:
+                    group = text
+                # Fields missing from earlier records are padded with nulls
+                group.setdefault(key, [None] * i).append(value)
+            for group in (text, reasoning, metrics):
+                for column in group.values():
+                    if len(column) == i:
+                        column.append(None)
+
+        directory = self.partition_dir(partition)
+        self._write(pa.table(text), os.path.join(directory, TEXT_FILE))
+        if reasoning:
+            self._write(pa.table(reasoning), os.path.join(directory, REASONING_FILE))
+        for name, values in metrics.items():
+            self.write_metric(partition, name, values)
+
+    def write_metric(self, partition, name, values):
+        """
+        Add or replace one metric column of a partition
+        """
+        table = pa.table({name: pa.array([to_float(v) for v in values], pa.float64())})
+        self._write(table, os.path.join(self.partition_dir(partition), METRIC_FILE.format(name)))
+
+    def partitions(self, **filters):
+        """
+        Yield ``(partition, directory)`` for partitions matching ``key=value`` filters
+        """
+        pattern = os.path.join(
+            self.root,
+            *(f"{key}={filters.get(key, '*')}" for key in PARTITION_KEYS),
+        )
+        for directory in sorted(glob(pattern)):
+            parts = os.path.relpath(directory, self.root).split(os.sep)
+            yield dict(part.split("=", 1) for part in parts), directory
+
+    def read_partition(self, directory, columns):
+        """
+        Read the requested columns of one partition, opening only the files that hold them
+        """
+        arrays = {}
+        remaining = list(columns)
+
+        for column in [c for c in remaining if c in METRIC_FIELDS]:
+            path = os.path.join(directory, METRIC_FILE.format(column))
+            if os.path.exists(path):
+                arrays[column] = pq.read_table(path).column(column)
+            remaining.remove(column)
+
+        for filename in (TEXT_FILE, REASONING_FILE):
+            path = os.path.join(directory, filename)
+            if not remaining or not os.path.exists(path):
+                continue
+            available = set(pq.read_schema(path).names)
+            wanted = [c for c in remaining if c in available]
+            if wanted:
+                table = pq.read_table(path, columns=wanted)
+                for column in wanted:
+                    arrays[column] = table.column(column)
+                    remaining.remove(column)
+
+        num_rows = max((len(array) for array in arrays.values()), default=0)
+        return pa.table(
+            {
+                column: arrays.get(column, pa.nulls(num_rows, pa.float64()))
+                for column in columns
+            }
+        )
+
+    def read(self, columns, **filters):
+        """
+        Read columns across matching partitions into one Arrow table, with
+        the partition keys added as columns
+        """
+        tables = []
+        for partition, directory in self.partitions(**filters):
+            table = self.read_partition(directory, columns)
+            for key in PARTITION_KEYS:
+                table = table.append_column(
+                    key, pa.array([partition[key]] * table.num_rows, pa.string())
+                )
+            tables.append(table)
+        if not tables:
+            return pa.table({column: [] for column in [*columns, *PARTITION_KEYS]})
+        return pa.concat_tables(tables, promote_options="default")
+
+
+def ingest(input_root, store_root, overwrite=False):
+    """
+    Convert a ``<dataset>/<model>/<budget dir>/<pair>.jsonl`` output tree
+    into the store, skipping partitions newer than their JSONL file
+    """
+    store = ResultsStore(store_root)
+    patterns = [
+        os.path.join(input_root, "*", "*", "budget_*", "*.jsonl"),
+        os.path.join(input_root, "*", "*", "reasoning_effort_*", "*.jsonl"),
+    ]
+    jsonl_files = []
+    for pattern in patterns:
+        jsonl_files.extend(glob(pattern))
+    print(f"Found {len(jsonl_files)} JSONL files")
+
+    for path in tqdm(jsonl_files, desc="Ingesting"):
+        partition = partition_from_path(os.path.relpath(path, input_root))
+        text_path = os.path.join(store.partition_dir(partition), TEXT_FILE)
+        if (
+            not overwrite
+            and os.path.exists(text_path)
+            and os.path.getmtime(text_path) >= os.path.getmtime(path)
+        ):
+            continue
+        store.write_records(partition, iter_jsonl(path))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert JSONL outputs into the columnar results store"
+    )
+    parser.add_argument(
+        "--input_root",
+        required=True,
+        help="Root holding <dataset>/<model>/budget_*/<pair>.jsonl",
+    )
+    parser.add_argument("--store_root", required=True, help="Results store root")
+    parser.add_argument(
+        "--overwrite", action="store_true", help="Rewrite partitions that look up to date"
+    )
+    args = parser.parse_args()
+
+    ingest(args.input_root, args.store_root, args.overwrite)
@@ -0,0 +1,153 @@
+import os
+import struct
+import hashlib
+import numpy as np
+
+from jsonl_io import loads
+
+MAGIC = b"RM4MTIX2"
+# magic, input file size, input file mtime (ns), input line count, output file size
+HEADER = struct.Struct("<8sQqQQ")
+
+
+def record_key(src_lang, tgt_lang, src_text):
+    """
+    Stable 64-bit hash of (src_lang, tgt_lang, src_text)
+    """
+    digest = hashlib.blake2b(
+        f"{src_lang}\t{tgt_lang}\t{src_text.strip()}".encode("utf-8"), digest_size=8
+    ).digest()
+    return int.from_bytes(digest, "little")
+
+
+def count_lines(filepath):
+    """
+    Count lines the way iterating over the file would, without decoding it
+    """
+    lines = 0
+    last = b"\n"
+    with open(filepath, "rb") as f:
+        while chunk := f.read(1 << 20):
+            lines += chunk.count(b"\n")
+            last = chunk[-1:]
+    return lines + (last != b"\n")
+
+
+class ResumeIndex:
+    """
+    Sidecar index ``<output_file>.idx`` of the records already written to an
+    output file.
+
+    The file holds a fixed header with the input file's size, mtime and line
+    count and the output file's size, followed by one little-endian uint64
+    hash per written record. It is loaded with a single read into a sorted
+    array, so resuming costs 8 bytes per finished record and needs no JSON
+    parsing. The index is rebuilt from the output when there is none, or
+    when the output's size disagrees with the header, e.g. after a crash
+    between writing records and indexing them.
+
+    Membership only looks at the records written before this run, like the
+    set of finished source texts it replaces: duplicate lines of one input
+    are all translated, whatever the batch size.
+    """
+
+    def __init__(self, output_file, input_file):
+        self.path = output_file + ".idx"
+        self.output_file = output_file
+        self.input_file = input_file
+        self.added = 0
+
+        stat = os.stat(input_file)
+        header = None
+        if os.path.exists(self.path) and os.path.exists(output_file):
+            with open(self.path, "rb") as f:
+                data = f.read()
+            if (
+                len(data) >= HEADER.size
+                and data[:8] == MAGIC
+                and HEADER.unpack_from(data)[4] == os.path.getsize(output_file)
+            ):
+                header = HEADER.unpack_from(data)
+                body = data[HEADER.size :]
+                body = body[: len(body) - len(body) % 8]
+                self.done = np.sort(np.frombuffer(body, dtype="<u8"))
+
+        if header is None:
+            self.done = np.sort(
+                np.fromiter(self._scan_output(), dtype="<u8")
+            )
+            self.input_lines = count_lines(input_file)
+            self._write(stat)
+        elif header[1] != stat.st_size or header[2] != stat.st_mtime_ns:
+            # The input changed since the index was written, recount its lines
+            self.input_lines = count_lines(input_file)
+            self._write_header(stat, header[4])
+        else:
+            self.input_lines = header[3]
+        self.stat = stat
+
+    def _scan_output(self):
+        if not os.path.exists(self.output_file):
+            return
+        with open(self.output_file, "rb") as fdone:
+            for line in fdone:
+                try:
+                    obj = loads(line)
+                    yield record_key(
+                        obj.get("src_lang", ""),
+                        obj.get("tgt_lang", ""),
+                        obj.get("src_text", ""),
+                    )
+                except Exception:
+                    continue
+
+    def _output_size(self):
+        if not os.path.exists(self.output_file):
+            return 0
+        return os.path.getsize(self.output_file)
+
+    def _write(self, stat):
+        with open(self.path, "wb") as f:
+            f.write(
+                HEADER.pack(
+                    MAGIC, stat.st_size, stat.st_mtime_ns, self.input_lines, self._output_size()
+                )
+            )
+            f.write(self.done.astype("<u8").tobytes())
+
+    def _write_header(self, stat, output_size):
+        with open(self.path, "r+b") as f:
+            f.write(
+                HEADER.pack(MAGIC, stat.st_size, stat.st_mtime_ns, self.input_lines, output_size)
+            )
+
+    def __len__(self):
+        return len(self.done) + self.added
+
+    def __contains__(self, key):
+        src_lang, tgt_lang, src_text = key
+        key = record_key(src_lang, tgt_lang, src_text)
+        pos = np.searchsorted(self.done, np.uint64(key))
+        return pos < len(self.done) and int(self.done[pos]) == key
+
+    def add_all(self, keys):
+        """
+        Record written output lines, given as ``(src_lang, tgt_lang, src_text)``;
+        call once all of them are flushed, with nothing else flushed after them
+        """
+        data = b"".join(
+            record_key(src_lang, tgt_lang, src_text).to_bytes(8, "little")
+            for src_lang, tgt_lang, src_text in keys
+        )
+        with open(self.path, "ab") as f:
+            f.write(data)
+        self.added += len(data) // 8
+        # The output size goes in last: a crash before it leaves a header
+        # that disagrees with the output, and the index is rebuilt
+        self._write_header(self.stat, self._output_size())
+
+    def add(self, src_lang, tgt_lang, src_text):
+        """
+        Record a written output line; call after the record itself is flushed
+        """
+        self.add_all([(src_lang, tgt_lang, src_text)])
@@ -0,0 +1,84 @@
+from collections import Counter
+
+# Scores are on the 0-100 scale of the "Quality Score: q/100" prompt line
+CHRF_CHAR_ORDER = 6
+CHRF_BETA = 2
+
+
+def char_ngrams(text, n):
+    return Counter(text[i : i + n] for i in range(len(text) - n + 1))
+
+
+def chrf(hypothesis, reference, char_order=CHRF_CHAR_ORDER, beta=CHRF_BETA):
+    """
+    Sentence-level chrF (0-100), computed like sacrebleu's default: character
+    n-grams up to ``char_order`` with whitespace removed, precision and recall
+    averaged over the orders both texts are long enough for, then F-beta
+    """
+    hypothesis = "".join(hypothesis.split())
+    reference = "".join(reference.split())
+    precision = recall = 0.0
+    effective_order = 0
+    for n in range(1, char_order + 1):
+        hyp_ngrams = char_ngrams(hypothesis, n)
+        ref_ngrams = char_ngrams(reference, n)
+        hyp_count = sum(hyp_ngrams.values())
+        ref_count = sum(ref_ngrams.values())
+        if not hyp_count or not ref_count:
+            continue
+        matches = sum((hyp_ngrams & ref_ngrams).values())
+        precision += matches / hyp_count
+        recall += matches / ref_count
+        effective_order += 1
+    if not effective_order:
+        return 0.0
+    precision /= effective_order
+    recall /= effective_order
+    if not precision + recall:
+        return 0.0
+    return 100 * (1 + beta**2) * precision * recall / (beta**2 * precision + recall)
+
+
+class ChrfScorer:
+    """
+    chrF of each hypothesis against its reference. This is an oracle: the
+    score reaches the prompt, the best round and the stopping rule, so the
+    reference leaks into the refinement. Use it only to bound what a perfect
+    metric could give.
+    """
+
+    name = "chrf_oracle"
+
+    def __call__(self, entries):
+        return [round(chrf(entry["mt"], entry.get("ref") or ""), 2) for entry in entries]
+
+
+class CometKiwiScorer:
+    """
+    Reference-free CometKiwi scores scaled to 0-100, predicted in
+    length-bucketed batches on the local GPU
+    """
+
+    name = "cometkiwi"
+
+    def __init__(self, device=None):
+        # COMET is only needed when this metric is picked
+        from comet import download_model, load_from_checkpoint
+
+        from compute_comet import COMETKIWI_MODEL
+
+        self.model = load_from_checkpoint(download_model(COMETKIWI_MODEL))
+        self.device = device
+
+    def __call__(self, entries):
+        from comet_batching import predict_bucketed
+
+        scores = predict_bucketed(
+            self.model,
+            [{"src": entry["src"], "mt": entry["mt"]} for entry in entries],
+            device=self.device,
+        )
+        return [round(100 * score, 2) for score in scores]
+
+
+ROUND_METRICS = {"chrf_oracle": ChrfScorer, "cometkiwi": CometKiwiScorer}
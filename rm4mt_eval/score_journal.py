@@ -0,0 +1,62 @@
+import os
+import json
+
+
+class ScoreJournal:
+    """
+    Append-only journal of scores for one output file.
+
+    Every line is ``{"id": <line number in the input file>, <metric>: <score>}``.
+    Scores are appended as they arrive, so a checkpoint costs one short line
+    per score instead of a rewrite of the whole file. Resuming replays the
+    journal onto the input records; the journal is merged into the final
+    output once, when the file is complete.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def replay(self, data):
+        """
+        Apply journaled scores to ``data`` in place and return how many were applied
+        """
+        if not os.path.exists(self.path):
+            return 0
+
+        replayed = 0
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn last line from an interrupted run
+                    continue
+                item_id = entry.pop("id")
+                # Older runs journaled failed requests as "Error: ..." scores
+                entry = {
+                    metric: score
+                    for metric, score in entry.items()
+                    if not (isinstance(score, str) and score.startswith("Error: "))
+                }
+                data[item_id].update(entry)
+                replayed += len(entry)
+        return replayed
+
+    def append(self, item_id, scores):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps({"id": item_id, **scores}, ensure_ascii=False) + "\n")
+        # Flush per score so a quota exit or a kill loses nothing already paid for
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,159 @@
+import json
+import time
+import zlib
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from stub_openai_server import StubState
+
+
+def fake_score(body):
+    """
+    A deterministic judge score for a generateContent request, in the range
+    the prompt asks for
+    """
+    prompt = body["contents"][-1]["parts"][-1]["text"]
+    system = "".join(
+        part.get("text", "") for part in (body.get("systemInstruction") or {}).get("parts", [])
+    )
+    scale = 5 if "scale of 0 to 5" in system else 100
+    return zlib.crc32((system + prompt).encode("utf-8")) % (scale + 1)
+
+
+def fake_response(body, model):
+    text = str(fake_score(body))
+    prompt_tokens = sum(
+        len(part.get("text", "")) for content in body["contents"] for part in content["parts"]
+    ) // 4
+    return {
+        "candidates": [
+            {
+                "content": {"role": "model", "parts": [{"text": text}]},
+                "finishReason": "STOP",
+                "index": 0,
+            }
+        ],
+        "usageMetadata": {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": 1,
+            "totalTokenCount": prompt_tokens + 1,
+        },
+        "modelVersion": model,
+    }
+
+
+def make_handler(state, server_error_rate, drop_rate):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, payload):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def send_error_status(self, code, status, message):
+            self.send_json(code, {"error": {"code": code, "message": message, "status": status}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            # .../models/<model>:generateContent
+            path = self.path.split("?")[0]
+            if not path.endswith(":generateContent"):
+                self.send_error_status(404, "NOT_FOUND", f"Unknown path {self.path}")
+                return
+            model = path.rsplit("/", 1)[-1].split(":")[0]
+
+            with state.lock:
+                state.requests += 1
+                state.in_flight += 1
+                state.max_in_flight = max(state.max_in_flight, state.in_flight)
+                delay = max(0.0, state.latency + state.rng.uniform(-state.jitter, state.jitter))
+                draw = state.rng.random()
+                if draw < state.error_rate + server_error_rate + drop_rate:
+                    state.errors += 1
+            try:
+                time.sleep(delay)
+                if draw < state.error_rate:
+                    self.send_error_status(
+                        429, "RESOURCE_EXHAUSTED", "Resource has been exhausted (e.g. check quota)."
+                    )
+                elif draw < state.error_rate + server_error_rate:
+                    self.send_error_status(503, "UNAVAILABLE", "The model is overloaded.")
+                elif draw < state.error_rate + server_error_rate + drop_rate:
+                    # Hang up without an answer, the client sees a dropped connection
+                    self.close_connection = True
+                    self.connection.close()
+                else:
+                    self.send_json(200, fake_response(body, model))
+            finally:
+                with state.lock:
+                    state.in_flight -= 1
+
+        def do_GET(self):
+            if self.path.endswith("/stats"):
+                with state.lock:
+                    self.send_json(
+                        200,
+                        {
+                            "requests": state.requests,
+                            "errors": state.errors,
+                            "max_in_flight": state.max_in_flight,
+                        },
+                    )
+            else:
+                self.send_error_status(404, "NOT_FOUND", f"Unknown path {self.path}")
+
+    return Handler
+
+
+def serve(host, port, latency, jitter, error_rate, server_error_rate=0.0, drop_rate=0.0, seed=42):
+    """
+    A ThreadingHTTPServer answering Gemini generateContent requests
+    """
+    state = StubState(latency, jitter, error_rate, seed)
+    server = ThreadingHTTPServer(
+        (host, port), make_handler(state, server_error_rate, drop_rate)
+    )
+    return server, state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Local Gemini generateContent stub with injected 429s, 5xx and dropped connections, for exercising the judge scripts"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.25, help="± seconds added to the latency")
+    parser.add_argument(
+        "--error_rate", type=float, default=0.1, help="Fraction of requests answered with a 429"
+    )
+    parser.add_argument(
+        "--server_error_rate", type=float, default=0.0, help="Fraction answered with a 503"
+    )
+    parser.add_argument(
+        "--drop_rate", type=float, default=0.0, help="Fraction of connections closed unanswered"
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    server, _ = serve(
+        args.host,
+        args.port,
+        args.latency,
+        args.jitter,
+        args.error_rate,
+        args.server_error_rate,
+        args.drop_rate,
+        args.seed,
+    )
+    print(f"Gemini stub on http://{args.host}:{args.port} (pass it as --base_url, GET /stats for counters)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,305 @@
+import json
+import time
+import uuid
+import email
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Reasoning words per request, by reasoning_effort
+REASONING_WORDS = {"low": 8, "high": 64}
+
+
+class StubState:
+    """
+    Settings and counters shared by the request handler threads
+    """
+
+    def __init__(self, latency, jitter, error_rate, seed, batch_delay=5.0, token_interval=0.01):
+        self.latency = latency
+        self.token_interval = token_interval
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.batch_delay = batch_delay
+        self.files = {}
+        self.batches = {}
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+
+def fake_completion(body):
+    """
+    A chat completion that "translates" the last line of the prompt by
+    upper-casing it, with reasoning as long as the reasoning effort asks for
+    """
+    prompt = body["messages"][-1]["content"]
+    source = prompt.rstrip().split("\n")[-2].split(": ", 1)[-1] if "\n" in prompt else prompt
+    words = REASONING_WORDS.get(body.get("reasoning_effort", "low"), 8)
+    reasoning = " ".join(["think"] * words)
+    content = source.upper()
+    prompt_tokens = sum(len(m["content"]) for m in body["messages"]) // 4
+    completion_tokens = len(content) // 4 + 1
+    return {
+        "id": f"chatcmpl-{random.getrandbits(32):08x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [
+            {
+                "index": 0,
+                "message": {
+                    "role": "assistant",
+                    "content": content,
+                    "reasoning_content": reasoning,
+                },
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens + words,
+            "total_tokens": prompt_tokens + completion_tokens + words,
+            "completion_tokens_details": {"reasoning_tokens": words},
+        },
+    }
+
+
+def multipart_fields(content_type, body):
+    """
+    ``{name: bytes}`` of a multipart/form-data body
+    """
+    message = email.message_from_bytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + body
+    )
+    return {
+        part.get_param("name", header="content-disposition"): part.get_payload(decode=True)
+        for part in message.get_payload()
+    }
+
+
+def run_batch(state, batch):
+    """
+    Answer every request of a batch input file, failing ``error_rate`` of them
+    """
+    lines = []
+    completed = failed = 0
+    for raw in state.files[batch["input_file_id"]].splitlines():
+        if not raw.strip():
+            continue
+        request = json.loads(raw)
+        if state.rng.random() < state.error_rate:
+            failed += 1
+            response = {
+                "status_code": 429,
+                "body": {"error": {"message": "Rate limit exceeded", "type": "rate_limit"}},
+            }
+        else:
+            completed += 1
+            response = {"status_code": 200, "body": fake_completion(request["body"])}
+        response["request_id"] = uuid.uuid4().hex
+        lines.append(
+            {
+                "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+                "custom_id": request["custom_id"],
+                "response": response,
+                "error": None,
+            }
+        )
+    output_file_id = f"file-{uuid.uuid4().hex[:12]}"
+    state.files[output_file_id] = "".join(json.dumps(line) + "\n" for line in lines).encode()
+    batch.update(
+        status="completed",
+        output_file_id=output_file_id,
+        completed_at=int(time.time()),
+        request_counts={"total": completed + failed, "completed": completed, "failed": failed},
+    )
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, payload):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def send_stream(self, completion, body):
+            """
+            Send a completion as server-sent events, one word per chunk:
+            the reasoning first, then the answer, then the usage if asked for
+            """
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+
+            def event(delta=None, usage=None):
+                chunk = {
+                    "id": completion["id"],
+                    "object": "chat.completion.chunk",
+                    "created": completion["created"],
+                    "model": completion["model"],
+                    "choices": [] if delta is None else [{"index": 0, "delta": delta}],
+                }
+                if usage is not None:
+                    chunk["usage"] = usage
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            message = completion["choices"][0]["message"]
+            event({"role": "assistant"})
+            for field in ("reasoning_content", "content"):
+                for word in message[field].split(" "):
+                    time.sleep(state.token_interval)
+                    event({field: word + " "})
+            if (body.get("stream_options") or {}).get("include_usage"):
+                event(usage=completion["usage"])
+            self.wfile.write(b"data: [DONE]\n\n")
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            raw = self.rfile.read(length)
+            if self.path.endswith("/files"):
+                fields = multipart_fields(self.headers["Content-Type"], raw)
+                file_id = f"file-{uuid.uuid4().hex[:12]}"
+                with state.lock:
+                    state.files[file_id] = fields["file"]
+                self.send_json(
+                    200,
+                    {
+                        "id": file_id,
+                        "object": "file",
+                        "bytes": len(fields["file"]),
+                        "created_at": int(time.time()),
+                        "filename": "batch.jsonl",
+                        "purpose": fields["purpose"].decode(),
+                        "status": "processed",
+                    },
+                )
+                return
+            body = json.loads(raw or b"{}")
+            if self.path.endswith("/batches"):
+                batch = {
+                    "id": f"batch_{uuid.uuid4().hex[:12]}",
+                    "object": "batch",
+                    "endpoint": body["endpoint"],
+                    "input_file_id": body["input_file_id"],
+                    "completion_window": body["completion_window"],
+                    "status": "in_progress",
+                    "created_at": int(time.time()),
+                }
+                with state.lock:
+                    state.batches[batch["id"]] = batch
+                self.send_json(200, batch)
+                return
+            if not self.path.endswith("/chat/completions"):
+                self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+                return
+
+            with state.lock:
+                state.requests += 1
+                state.in_flight += 1
+                state.max_in_flight = max(state.max_in_flight, state.in_flight)
+                delay = max(0.0, state.latency + state.rng.uniform(-state.jitter, state.jitter))
+                fail = state.rng.random() < state.error_rate
+                if fail:
+                    state.errors += 1
+            try:
+                time.sleep(delay)
+                if fail:
+                    self.send_json(
+                        429, {"error": {"message": "Rate limit exceeded", "type": "rate_limit"}}
+                    )
+                elif body.get("stream"):
+                    self.send_stream(fake_completion(body), body)
+                else:
+                    self.send_json(200, fake_completion(body))
+            finally:
+                with state.lock:
+                    state.in_flight -= 1
+
+        def do_GET(self):
+            parts = self.path.rstrip("/").split("/")
+            if len(parts) >= 2 and parts[-2] == "batches":
+                with state.lock:
+                    batch = state.batches.get(parts[-1])
+                    if batch is None:
+                        self.send_json(404, {"error": {"message": "No such batch"}})
+                        return
+                    # A batch finishes batch_delay seconds after it was created
+                    if (
+                        batch["status"] == "in_progress"
+                        and time.time() - batch["created_at"] >= state.batch_delay
+                    ):
+                        run_batch(state, batch)
+                    self.send_json(200, batch)
+            elif len(parts) >= 3 and parts[-1] == "content" and parts[-3] == "files":
+                with state.lock:
+                    data = state.files.get(parts[-2])
+                if data is None:
+                    self.send_json(404, {"error": {"message": "No such file"}})
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/jsonl")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            elif self.path.endswith("/stats"):
+                with state.lock:
+                    self.send_json(
+                        200,
+                        {
+                            "requests": state.requests,
+                            "errors": state.errors,
+                            "max_in_flight": state.max_in_flight,
+                        },
+                    )
+            else:
+                self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Local OpenAI-compatible stub server (chat completions, streaming and batches) for exercising the API eval scripts"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=1.0, help="Seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.5, help="± seconds added to the latency")
+    parser.add_argument(
+        "--error_rate", type=float, default=0.0, help="Fraction of requests answered with a 429"
+    )
+    parser.add_argument(
+        "--batch_delay", type=float, default=5.0, help="Seconds until a submitted batch completes"
+    )
+    parser.add_argument(
+        "--token_interval", type=float, default=0.01, help="Seconds between streamed chunks"
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    state = StubState(
+        args.latency,
+        args.jitter,
+        args.error_rate,
+        args.seed,
+        args.batch_delay,
+        args.token_interval,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(state))
+    print(f"Stub server on http://{args.host}:{args.port}/v1 (GET /v1/stats for counters)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,80 @@
+#!/bin/bash
+
+# One job per model: the checkpoint is loaded once and the job walks the
+# whole dataset × budget grid, resuming every cell from its own output files.
+
+DATASETS=(
+  # "CAMT"
+  # "DRT-Gutenberg"
+  # "WMT23-Biomedical-Doc"
+  # "WMT23-Biomedical-Sentence"
+  # "WMT24-Biomedical"
+  # "WMT-Literary"
+  # "LITEVAL-CORPUS"
+  # "CommonsenseMT-Contextless"
+  # "CommonsenseMT-Contextual"
+  # "CommonsenseMT-Lexical"
+  # "RTT"
+  # "RAGtrans"
+)
+
+MODELS=(
+  # "Qwen/Qwen3-0.6B"
+  # "Qwen/Qwen3-1.7B"
+  # "Qwen/Qwen3-4B"
+  # "Qwen/Qwen3-8B"
+  # "Qwen/Qwen3-14B"
+  # "Qwen/Qwen3-32B"
+)
+
+THINKING_BUDGETS=(
+  # 0
+  # 100
+  # 200
+  # 300
+  # 400
+  # 500
+  # 1000
+  # 2000
+)
+
+ENABLE_WAIT_INSERTION="False" 
+ADD_DOC_FOR_RAGTRANS="False"
+
+TEMPLATE="eval_qwen_sweep.sh"
+
+TMP_SCRIPT_DIR="./tmp_jobs"
+mkdir -p "$TMP_SCRIPT_DIR"
+
+INPUT_DIRS=""
+for dataset in "${DATASETS[@]}"; do
+  INPUT_DIRS="$INPUT_DIRS ../rm4mt_dataset/processed/${dataset}"
+done
+
+for model in "${MODELS[@]}"; do
+
+  jobname="sweep_$(basename "$model")"
+  tmp_script="${TMP_SCRIPT_DIR}/${jobname}.sh"
+
+  if [[ "$model" == *"32B"* ]]; then
+    GPUS_PER_TASK=2
+  else
+    GPUS_PER_TASK=1
+  fi
+
+  echo "Generating job: $jobname"
+
+  sed \
+    -e "s|^#SBATCH --job-name=.*|#SBATCH --job-name=${jobname}|" \
+    -e "s|^#SBATCH --gpus-per-task=.*|#SBATCH --gpus-per-task=${GPUS_PER_TASK}|" \
+    -e "s|^INPUT_DIRS=.*|INPUT_DIRS=\"${INPUT_DIRS}\"|" \
+    -e "s|^MODEL_NAME=.*|MODEL_NAME=\"${model}\"|" \
+    -e "s|^THINKING_BUDGETS=.*|THINKING_BUDGETS=\"${THINKING_BUDGETS[*]}\"|" \
+    -e "s|^ENABLE_WAIT_INSERTION=.*|ENABLE_WAIT_INSERTION=${ENABLE_WAIT_INSERTION}|" \
+    -e "s|^ADD_DOC_FOR_RAGTRANS=.*|ADD_DOC_FOR_RAGTRANS=${ADD_DOC_FOR_RAGTRANS}|" \
+    "$TEMPLATE" >"$tmp_script"
+
+  chmod +x "$tmp_script"
+  sbatch "$tmp_script"
+
+done